@@ -19,6 +19,8 @@ Optional parameters:
     -o <org_name>       The name of the organization you want to interact with. This can be omitted if your API key
                         only has access to a single organization
     -t <net_tag>        If defined, networks must have a matching network tag to be processed. Default is all
+    --no-cache          Do not use cached organization and network lists, even if environment variable
+                        "MERAKI_RESPONSE_CACHE" is set
                         
                  
 Example, verify if any networks tagged "Brazil" in organization "Big Industries Inc" have client tracking mode 
@@ -35,8 +37,9 @@ import sys, getopt, requests, os, datetime
 
 import time
 
-from urllib.parse import urlencode
-from requests import Session, utils
+from meraki_request import merakiRequest
+from meraki_request.fanout import fanOut
+from meraki_request import configureCacheFromArgv
 
 def printhelp():
     #prints help text
@@ -65,137 +68,11 @@ def getApiKey(argument):
         return str(argument)
     return os.environ.get(API_KEY_ENV_VAR_NAME, None)   
 
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
-
-API_MAX_RETRIES             = 3
-API_CONNECT_TIMEOUT         = 60
-API_TRANSMIT_TIMEOUT        = 60
-API_STATUS_RATE_LIMIT       = 429
-API_RETRY_DEFAULT_WAIT      = 3
-
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE        = True
 
-API_BASE_URL                = "https://api.meraki.com/api/v1"
 API_KEY_ENV_VAR_NAME        = "MERAKI_DASHBOARD_API_KEY"
 
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-        
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        qArrayFix = {}
-        for item in p_queryItems:
-            if isinstance(p_queryItems[item], list):
-                qArrayFix["%s[]" % item] = p_queryItems[item]
-            else:
-                qArrayFix[item] = p_queryItems[item]
-        query = "?" + urlencode(qArrayFix, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-    
-    verbs   = {
-        'DELETE'    : { 'function': session.delete, 'hasBody': False },
-        'GET'       : { 'function': session.get,    'hasBody': False },
-        'POST'      : { 'function': session.post,   'hasBody': True  },
-        'PUT'       : { 'function': session.put,    'hasBody': True  }
-    }
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-            
-        if verb in verbs:
-            if verbs[verb]['hasBody'] and not p_requestBody is None:
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-            else: 
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        retryInterval = API_RETRY_DEFAULT_WAIT
-        if "Retry-After" in r.headers:
-            retryInterval = r.headers["Retry-After"]
-        if "retry-after" in r.headers:
-            retryInterval = r.headers["retry-after"]
-        
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, retryInterval))
-        time.sleep(int(retryInterval))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody    
     
 def getOrganizations(apiKey):
     url = "/organizations"
@@ -286,14 +163,25 @@ def main(argv):
     for net in allNetworks:
         if arg_tag is None or arg_tag in net['tags']:
             if 'appliance' in net['productTypes']:
-                success, errors, response = getNetworkApplianceSettings(apiKey, net['id'])
-                if not success:
-                    log('WARNING: Unable to get tracking mode for net %s "%s"' % (net['id'], net['name']))
-                elif not response is None:
-                    if 'clientTrackingMethod' in response and response['clientTrackingMethod'] != arg_mode:
-                        log('POLICY VIOLATION: Network %s "%s" is set to mode "%s"' % (net['id'], net['name'], response['clientTrackingMethod']))
+                filteredNetworks.append(net)
+                
+    # Fetch appliance settings for all matching networks concurrently
+    jobs = []
+    for net in filteredNetworks:
+        jobs.append({'key': net['id'], 'label': 'settings', 'function': getNetworkApplianceSettings, 'args': (apiKey, net['id'])})
+    results = fanOut(jobs)
+    
+    for net in filteredNetworks:
+        success, errors, response = False, None, None
+        if not results.get(net['id'], {}).get('settings') is None:
+            success, errors, response = results[net['id']]['settings']
+        if not success:
+            log('WARNING: Unable to get tracking mode for net %s "%s"' % (net['id'], net['name']))
+        elif not response is None:
+            if 'clientTrackingMethod' in response and response['clientTrackingMethod'] != arg_mode:
+                log('POLICY VIOLATION: Network %s "%s" is set to mode "%s"' % (net['id'], net['name'], response['clientTrackingMethod']))
         
     log("End of script.")
             
 if __name__ == '__main__':
-    main(sys.argv[1:])
\ No newline at end of file
+    main(configureCacheFromArgv(sys.argv[1:]))
\ No newline at end of file
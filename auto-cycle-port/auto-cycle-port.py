@@ -20,139 +20,14 @@ Depending on your operating system and Python environment, you may need to use c
  "python3" and "pip3" instead of "python" and "pip".
 """
 
-import sys, getopt, yaml, time, datetime
+import sys, os, getopt, yaml, time, datetime
 
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
-
-API_MAX_RETRIES         = 3
-API_CONNECT_TIMEOUT     = 60
-API_TRANSMIT_TIMEOUT    = 60
-API_STATUS_RATE_LIMIT   = 429
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meraki_request import merakiRequest, setOrganization
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE    = True
 
-API_BASE_URL            = "https://api.meraki.com/api/v1"
-
-
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        query = "?" + urlencode(p_queryItems, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-        if verb == "GET":
-            r = session.get(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        elif verb == "PUT":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.put(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "POST":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.post(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "DELETE":
-            r = session.delete(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, r.headers["Retry-After"]))
-        time.sleep(int(r.headers["Retry-After"]))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
   
 
 def getOrganizations(p_apiKey):
@@ -278,6 +153,9 @@ def main(argv):
             
     if config['organizationId'] is None:
         killScript("No organization found with that name")
+        
+    # Charge network-level requests to this organization's shared rate limit budget
+    setOrganization(config['organizationId'])
                 
     while(True):
         performScan(config)
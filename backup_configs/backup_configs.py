@@ -45,6 +45,7 @@ import yaml
 BACKUP_FORMAT = 'json'  # possible options of ('json', 'yaml', 'both') to specify output format
 GET_OPERATION_MAPPINGS_FILE = 'backup_GET_operations.csv'  # path to input file, listing GET operations of API calls
 DEFAULT_CONFIGS_DIRECTORY = 'defaults'  # path to folder where default configurations (for a new network) are stored
+BASE_URL = os.environ.get('MERAKI_DASHBOARD_API_BASE_URL', 'https://api.meraki.com/api/v1')  # override to use a test server
 
 # Global variables; DO NOT MODIFY
 ORG_ID = None
@@ -589,7 +590,7 @@ async def backup_ble_settings(dashboard, networks, devices):
 
 async def main_async(api_key, operations, endpoints, tag, template_only=False, template_name=None):
     global DEVICES, NETWORKS, TEMPLATES
-    async with meraki.aio.AsyncDashboardAPI(api_key, maximum_retries=5,
+    async with meraki.aio.AsyncDashboardAPI(api_key, base_url=BASE_URL, maximum_retries=5,
                                            single_request_timeout=60, wait_on_rate_limit=True,
                                            print_console=False, suppress_logging=True) as dashboard:
         if template_only:
@@ -657,7 +658,7 @@ async def main_async(api_key, operations, endpoints, tag, template_only=False, t
 def estimate_backup(api_key, org_id, filter_tag, template_only=False, template_name=None):
     try:
         # Estimate of API calls for org
-        m = meraki.DashboardAPI(api_key, suppress_logging=True)
+        m = meraki.DashboardAPI(api_key, base_url=BASE_URL, suppress_logging=True)
 
         templates = m.organizations.getOrganizationConfigTemplates(org_id)
         
@@ -750,7 +751,7 @@ def run_backup(api_key, org_id, filter_tag, template_only=False, template_name=N
         'X-Cisco-Meraki-API-Key': api_key
     }
     # Get operations from current dashboard OpenAPI specification
-    spec = requests.get('https://api.meraki.com/api/v1/openapiSpec', headers=spec_headers).json()
+    spec = requests.get(f'{BASE_URL}/openapiSpec', headers=spec_headers).json()
     current_operations = []
 
     # Filter for just GET methods with corresponding POST/PUT configuration methods
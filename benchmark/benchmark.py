@@ -0,0 +1,243 @@
+readMe = """Benchmarks representative scripts of this repository against the local mock Dashboard API in
+mock_dashboard.py, and reports for each of them wall clock time, number of API requests made, number of
+429 responses received and peak memory usage (maximum resident set size).
+
+Every script runs in its own process with OS environment variable MERAKI_DASHBOARD_API_BASE_URL pointing to the
+mock, a private rate limiter database and a dummy API key. Their console output is discarded. Run the benchmark
+before and after a change to compare the results.
+
+Syntax, Linux and Mac:
+    python3 benchmark.py [-o <orgs>] [-n <networks>] [-d <devices>] [-c <clients>] [-l <latency ms>]
+        [-r <requests per second>] [-x <429 probability>] [-s <scripts>] [-u] [-j <file>]
+
+Optional parameters:
+    -o <orgs>               Number of organizations in the mock. Default is 1
+    -n <networks>           Number of networks per organization. Default is 50
+    -d <devices>            Number of devices per network. Default is 3
+    -c <clients>            Number of clients per network. Default is 200
+    -l <latency ms>         Latency of every mock response, in milliseconds. Default is 20
+    -r <requests/s>         Per organization request budget of the mock. Default is 10. Use 0 for no budget
+    -x <429 probability>    Probability to answer any request with a 429 response. Default is 0
+    -s <scripts>            Comma separated list of benchmarks to run. Default is all of them:
+                            inventorycsv,org_subnets,clients_in_ip_range,backup_configs
+    -u                      Disable the host-wide rate limiter of the scripts, to measure the mock's 429 handling
+    -j <file>               Also write the results to a JSON file
+
+Example, benchmark the two fastest scripts with 500 networks:
+    python3 benchmark.py -n 500 -s inventorycsv,org_subnets
+
+Notes:
+ * Peak memory is measured with os.wait4() and is only available on Linux and Mac
+ * The backup_configs benchmark requires the meraki Python module and runs in a temporary copy of its folder
+
+Required Python 3 modules:
+    requests
+    meraki (for the backup_configs benchmark only)"""
+
+
+import sys, os, getopt, json, time, shutil, tempfile, subprocess
+
+import mock_dashboard
+
+REPOSITORY_ROOT         = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARK_ORG_NAME      = "Benchmark Org 1"
+
+# Name, script path relative to the repository root, function returning the arguments for a run
+BENCHMARKS              = [
+                            ("inventorycsv",        "inventorycsv.py",
+                                lambda run: ["-o", BENCHMARK_ORG_NAME, "-f", os.path.join(run["tempDir"], "inventory.csv")]),
+                            ("org_subnets",         "org_subnets.py",
+                                lambda run: ["-o", BENCHMARK_ORG_NAME]),
+                            ("clients_in_ip_range", "clients_in_ip_range.py",
+                                lambda run: ["-o", BENCHMARK_ORG_NAME, "-i", "10.0.0.0/16"]),
+                            ("backup_configs",      os.path.join("backup_configs", "backup_configs.py"),
+                                lambda run: ["-o", mock_dashboard.organizationId(0), "-y"])
+                        ]
+
+# Benchmarks that write files to their working directory run in a temporary copy of their folder
+BENCHMARKS_IN_FOLDER_COPY = ["backup_configs"]
+
+# Where the meraki module caches the organization of every network and device, relative to the home folder
+MERAKI_MODULE_CACHE_PATH = os.path.join(".meraki", ".cache", "rate_limit_cache.json")
+
+
+def writeMerakiModuleCache(p_homeDir):
+    # The meraki module rate limits requests per organization, using a cache of which organization every network
+    # and device belongs to. Without it, requests for networks and devices are only limited to the source IP rate
+    # of 100 requests per second, and the run fails on 429 responses before the module has learned the mapping.
+    # Every run gets the complete cache for the mock, like on a host where the module has run before
+    config  = mock_dashboard.CONFIG
+    data    = {"saved_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "networks": [], "devices": []}
+    for orgIndex in range(config["organizations"]):
+        organization = {"id": mock_dashboard.organizationId(orgIndex)}
+        for netIndex in range(config["networks"]):
+            data["networks"].append({"id": mock_dashboard.makeNetwork(orgIndex, netIndex)["id"],
+                "organization": organization})
+            for devIndex in range(config["devices"]):
+                data["devices"].append({"serial": mock_dashboard.makeDevice(orgIndex, netIndex, devIndex)["serial"],
+                    "organization": organization})
+
+    path = os.path.join(p_homeDir, MERAKI_MODULE_CACHE_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(data, file)
+
+
+def runProcess(p_command, p_cwd, p_env):
+    # Runs a command to completion. Returns exit code and peak resident set size in kilobytes, or None if unknown
+    process = subprocess.Popen(p_command, cwd=p_cwd, env=p_env, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    if hasattr(os, "wait4"):
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr = process.stderr.read()
+        process.stderr.close()
+        peakRss = usage.ru_maxrss
+        if sys.platform == "darwin":
+            # macOS reports bytes instead of kilobytes
+            peakRss = peakRss // 1024
+        return process.returncode, peakRss, stderr.decode(errors="replace")
+
+    stdout, stderr = process.communicate()
+    return process.returncode, None, stderr.decode(errors="replace")
+
+
+def runBenchmark(p_name, p_script, p_argsFunction, p_baseUrl, p_disableRateLimiter):
+    tempDir = tempfile.mkdtemp(prefix="meraki_benchmark_")
+    try:
+        scriptPath = os.path.join(REPOSITORY_ROOT, p_script)
+        cwd = tempDir
+        if p_name in BENCHMARKS_IN_FOLDER_COPY:
+            cwd = os.path.join(tempDir, "work")
+            shutil.copytree(os.path.dirname(scriptPath), cwd)
+            scriptPath = os.path.join(cwd, os.path.basename(scriptPath))
+
+        env = dict(os.environ)
+        env["MERAKI_DASHBOARD_API_BASE_URL"]    = p_baseUrl
+        env["MERAKI_DASHBOARD_API_KEY"]         = "benchmark"
+        env["MERAKI_RATE_LIMIT_DB"]             = os.path.join(tempDir, "rate_limit.sqlite")
+        # The meraki module keeps a cache of which organization every network and device belongs to in the home
+        # folder. A stale cache left by another run or data set makes the module slow down to a crawl after the
+        # first 429 responses, so every run gets its own home folder with a cache that matches the mock
+        env["HOME"]                             = tempDir
+        env["USERPROFILE"]                      = tempDir
+        writeMerakiModuleCache(tempDir)
+        env.pop("MERAKI_RESPONSE_CACHE", None)
+        if p_disableRateLimiter:
+            env["MERAKI_RATE_LIMIT_DISABLED"]   = "1"
+
+        command = [sys.executable, scriptPath] + p_argsFunction({"tempDir": tempDir})
+
+        mock_dashboard.resetStats()
+        startTime = time.monotonic()
+        exitCode, peakRss, stderr = runProcess(command, cwd, env)
+        wallTime = time.monotonic() - startTime
+        stats = mock_dashboard.getStats()
+
+        result = {
+            "script"        : p_name,
+            "exitCode"      : exitCode,
+            "wallSeconds"   : round(wallTime, 3),
+            "requests"      : stats["requests"],
+            "rateLimited"   : stats["rateLimited"],
+            "peakRssKb"     : peakRss,
+            "byOperation"   : stats["byOperation"]
+        }
+        if exitCode != 0:
+            result["error"] = stderr.strip().split("\n")[-1]
+        return result
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+
+def printResults(p_results):
+    print("\n%-22s %10s %10s %8s %12s  %s" % ("Script", "Wall (s)", "Requests", "429s", "Peak RSS MB", "Status"))
+    for result in p_results:
+        peakRss = "n/a" if result["peakRssKb"] is None else "%.1f" % (result["peakRssKb"] / 1024)
+        status = "OK" if result["exitCode"] == 0 else "FAILED: %s" % result.get("error", result["exitCode"])
+        print("%-22s %10.2f %10s %8s %12s  %s" % (result["script"], result["wallSeconds"], result["requests"],
+            result["rateLimited"], peakRss, status))
+
+
+def killScript(reason=None):
+    if reason is None:
+        print(readMe)
+        sys.exit()
+    else:
+        print("ERROR: %s" % reason)
+        sys.exit()
+
+
+def main(argv):
+    arg_scripts         = None
+    arg_jsonFile        = None
+    flag_noRateLimiter  = False
+
+    mock_dashboard.configure(p_latency=20)
+
+    try:
+        opts, args = getopt.getopt(argv, 'ho:n:d:c:l:r:x:s:uj:')
+    except getopt.GetoptError:
+        killScript()
+
+    try:
+        for opt, arg in opts:
+            if opt == '-h':
+                killScript()
+            elif opt == '-o':
+                mock_dashboard.configure(p_organizations=int(arg))
+            elif opt == '-n':
+                mock_dashboard.configure(p_networks=int(arg))
+            elif opt == '-d':
+                mock_dashboard.configure(p_devices=int(arg))
+            elif opt == '-c':
+                mock_dashboard.configure(p_clients=int(arg))
+            elif opt == '-l':
+                mock_dashboard.configure(p_latency=float(arg))
+            elif opt == '-r':
+                mock_dashboard.configure(p_rateLimit=float(arg))
+            elif opt == '-x':
+                mock_dashboard.configure(p_errorProbability=float(arg))
+            elif opt == '-s':
+                arg_scripts = arg.split(",")
+            elif opt == '-u':
+                flag_noRateLimiter = True
+            elif opt == '-j':
+                arg_jsonFile = arg
+    except ValueError:
+        killScript("Invalid numeric parameter")
+
+    benchmarks = []
+    for benchmark in BENCHMARKS:
+        if arg_scripts is None or benchmark[0] in arg_scripts:
+            benchmarks.append(benchmark)
+    if len(benchmarks) == 0:
+        killScript("No matching benchmarks")
+
+    server, baseUrl = mock_dashboard.startServer(0)
+
+    config = mock_dashboard.CONFIG
+    print("Mock Dashboard API at %s: %s organizations, %s networks, %s devices and %s clients per network" % (
+        baseUrl, config["organizations"], config["networks"], config["devices"], config["clients"]))
+
+    results = []
+    for name, script, argsFunction in benchmarks:
+        print("Running %s..." % name)
+        results.append(runBenchmark(name, script, argsFunction, baseUrl, flag_noRateLimiter))
+
+    server.shutdown()
+
+    printResults(results)
+
+    if not arg_jsonFile is None:
+        try:
+            with open(arg_jsonFile, "w") as file:
+                json.dump({"config": config, "results": results}, file, indent=4)
+        except:
+            killScript("Unable to write file %s" % arg_jsonFile)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
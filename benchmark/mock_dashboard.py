@@ -0,0 +1,601 @@
+readMe = """A local mock of the Meraki Dashboard API, for benchmarking the scripts in this repository without touching
+a real organization and without spending its API budget.
+
+The server generates a synthetic data set of organizations, networks, devices and clients and serves the GET
+endpoints used by the benchmarked scripts, with Link header pagination, configurable response latency and
+injection of 429 Too Many Requests responses with a Retry-After header. Unknown GET endpoints return an empty
+object. POST, PUT and DELETE requests are accepted and echo their request body.
+
+Point a script to the mock by setting OS environment variable MERAKI_DASHBOARD_API_BASE_URL to the URL printed
+on startup. Any API key is accepted.
+
+Syntax, Windows:
+    python mock_dashboard.py [-p <port>] [-o <orgs>] [-n <networks>] [-d <devices>] [-c <clients>]
+        [-l <latency ms>] [-r <requests per second>] [-x <429 probability>] [-a <retry after>]
+
+Syntax, Linux and Mac:
+    python3 mock_dashboard.py [-p <port>] [-o <orgs>] [-n <networks>] [-d <devices>] [-c <clients>]
+        [-l <latency ms>] [-r <requests per second>] [-x <429 probability>] [-a <retry after>]
+
+Optional parameters:
+    -p <port>               TCP port to listen on. Default is 8765
+    -o <orgs>               Number of organizations. Default is 1
+    -n <networks>           Number of networks per organization. Default is 50
+    -d <devices>            Number of devices per network. Default is 3
+    -c <clients>            Number of clients per network. Default is 200
+    -l <latency ms>         Delay added to every response, in milliseconds. Default is 0
+    -r <requests/s>         Per organization request budget. Requests above it get a 429 response.
+                            Default is 10, like the real Dashboard API. Use 0 for no budget
+    -x <429 probability>    Probability between 0 and 1 to answer any request with a 429 response. Default is 0
+    -a <retry after>        Value of the Retry-After header of 429 responses, in seconds. Default is 1
+
+Example, serve 2 organizations with 500 networks each, with 50ms latency:
+    python mock_dashboard.py -o 2 -n 500 -l 50
+
+Required Python 3 modules: None. Only the Python standard library is used"""
+
+
+import sys, getopt, json, time, random, threading, ipaddress
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+DEFAULT_PORT                = 8765
+API_PATH_PREFIX             = "/api/v1"
+
+# Default and maximum perPage values of the mocked list endpoints, as in the real API
+PAGINATION_LIMITS           = {
+                                "networks"          : (1000,    100000),
+                                "inventoryDevices"  : (1000,    1000),
+                                "devices"           : (1000,    1000),
+                                "statuses"          : (1000,    1000),
+                                "clients"           : (10,      5000)
+                            }
+
+CONFIG                      = {
+                                "organizations"     : 1,
+                                "networks"          : 50,
+                                "devices"           : 3,
+                                "clients"           : 200,
+                                "latency"           : 0,
+                                "rateLimit"         : 10,
+                                "errorProbability"  : 0,
+                                "retryAfter"        : 1
+                            }
+
+DEVICE_MODELS               = [("MX68", "appliance"), ("MS120-8", "switch"), ("MR46", "wireless")]
+
+STATS                       = {"requests": 0, "rateLimited": 0, "byOperation": {}}
+STATS_LOCK                  = threading.Lock()
+
+BUCKETS                     = {}
+BUCKETS_LOCK                = threading.Lock()
+
+
+def configure(p_organizations=None, p_networks=None, p_devices=None, p_clients=None, p_latency=None,
+        p_rateLimit=None, p_errorProbability=None, p_retryAfter=None):
+    # Changes the data set and behaviour of the mock. Parameters left as None keep their current value
+    values = {
+        "organizations"     : p_organizations,
+        "networks"          : p_networks,
+        "devices"           : p_devices,
+        "clients"           : p_clients,
+        "latency"           : p_latency,
+        "rateLimit"         : p_rateLimit,
+        "errorProbability"  : p_errorProbability,
+        "retryAfter"        : p_retryAfter
+    }
+    for key in values:
+        if not values[key] is None:
+            CONFIG[key] = values[key]
+
+
+def getStats():
+    with STATS_LOCK:
+        return json.loads(json.dumps(STATS))
+
+
+def resetStats():
+    with STATS_LOCK:
+        STATS["requests"]       = 0
+        STATS["rateLimited"]    = 0
+        STATS["byOperation"]    = {}
+    with BUCKETS_LOCK:
+        BUCKETS.clear()
+
+
+def recordRequest(p_operation, p_rateLimited):
+    with STATS_LOCK:
+        STATS["requests"] += 1
+        if p_rateLimited:
+            STATS["rateLimited"] += 1
+        STATS["byOperation"][p_operation] = STATS["byOperation"].get(p_operation, 0) + 1
+
+
+def takeToken(p_bucket):
+    # Per organization token bucket, refilled at CONFIG["rateLimit"] tokens per second. Like the real API, it
+    # allows a burst of as many additional requests. Returns True if the request is within budget
+    rate = CONFIG["rateLimit"]
+    if rate <= 0:
+        return True
+    burst = 2 * rate
+    with BUCKETS_LOCK:
+        now = time.monotonic()
+        tokens, updated = BUCKETS.get(p_bucket, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        BUCKETS[p_bucket] = (tokens, now)
+    return allowed
+
+
+# Synthetic data set
+#
+# Everything is derived from indexes, so that nothing has to be kept in memory and large data sets start instantly.
+# Organization o has ID "10000<o>". Network n of organization o has ID "N_<o>_<n>" and owns subnet 10.<n>.0.0/16
+# of its organization. Device d of a network has serial "Q2XX-<o>-<n>-<d>". Client c of a network has an IP
+# address in the subnet of its network.
+
+def organizationId(p_orgIndex):
+    return str(100000 + p_orgIndex)
+
+
+def orgIndexFromId(p_orgId):
+    try:
+        index = int(p_orgId) - 100000
+    except:
+        return None
+    if index < 0 or index >= CONFIG["organizations"]:
+        return None
+    return index
+
+
+def parseNetworkId(p_netId):
+    # Returns (orgIndex, netIndex) or None
+    parts = p_netId.split("_")
+    if len(parts) != 3 or parts[0] != "N":
+        return None
+    try:
+        orgIndex = int(parts[1])
+        netIndex = int(parts[2])
+    except:
+        return None
+    if orgIndex >= CONFIG["organizations"] or netIndex >= CONFIG["networks"]:
+        return None
+    return orgIndex, netIndex
+
+
+def parseSerial(p_serial):
+    # Returns (orgIndex, netIndex, devIndex) or None
+    parts = p_serial.split("-")
+    if len(parts) != 4 or parts[0] != "Q2XX":
+        return None
+    try:
+        indexes = (int(parts[1]), int(parts[2]), int(parts[3]))
+    except:
+        return None
+    if indexes[0] >= CONFIG["organizations"] or indexes[1] >= CONFIG["networks"] or indexes[2] >= CONFIG["devices"]:
+        return None
+    return indexes
+
+
+def networkSubnet(p_netIndex):
+    return ipaddress.IPv4Network("10.%s.0.0/16" % (p_netIndex % 256))
+
+
+def makeOrganization(p_orgIndex):
+    orgId = organizationId(p_orgIndex)
+    return {
+        "id"    : orgId,
+        "name"  : "Benchmark Org %s" % (p_orgIndex + 1),
+        "url"   : "https://n1.meraki.com/o/%s/manage/organization/overview" % orgId,
+        "api"   : {"enabled": True}
+    }
+
+
+def makeNetwork(p_orgIndex, p_netIndex):
+    return {
+        "id"                : "N_%s_%s" % (p_orgIndex, p_netIndex),
+        "organizationId"    : organizationId(p_orgIndex),
+        "name"              : "Benchmark Network %s" % (p_netIndex + 1),
+        "productTypes"      : ["appliance", "switch", "wireless"],
+        "timeZone"          : "America/Los_Angeles",
+        "tags"              : ["benchmark", "group%s" % (p_netIndex % 4)],
+        "enrollmentString"  : None,
+        "notes"             : "",
+        "isBoundToConfigTemplate": False
+    }
+
+
+def makeDevice(p_orgIndex, p_netIndex, p_devIndex):
+    model, productType = DEVICE_MODELS[p_devIndex % len(DEVICE_MODELS)]
+    deviceNumber = (p_orgIndex * CONFIG["networks"] + p_netIndex) * CONFIG["devices"] + p_devIndex
+    return {
+        "serial"        : "Q2XX-%s-%s-%s" % (p_orgIndex, p_netIndex, p_devIndex),
+        "name"          : "%s-%s-%s" % (model, p_netIndex + 1, p_devIndex + 1),
+        "mac"           : formatMac(0x0c8ddb000000 + deviceNumber),
+        "model"         : model,
+        "productType"   : productType,
+        "networkId"     : "N_%s_%s" % (p_orgIndex, p_netIndex),
+        "tags"          : [],
+        "orderNumber"   : "4C%07d" % p_orgIndex,
+        "claimedAt"     : "2020-01-01T00:00:00.000000Z",
+        "licenseExpirationDate": None,
+        "firmware"      : "wired-17-10",
+        "lanIp"         : str(networkSubnet(p_netIndex)[p_devIndex + 1])
+    }
+
+
+def makeDeviceStatus(p_orgIndex, p_netIndex, p_devIndex):
+    device = makeDevice(p_orgIndex, p_netIndex, p_devIndex)
+    isAppliance = device["productType"] == "appliance"
+    return {
+        "serial"            : device["serial"],
+        "name"              : device["name"],
+        "mac"               : device["mac"],
+        "model"             : device["model"],
+        "productType"       : device["productType"],
+        "networkId"         : device["networkId"],
+        "status"            : "online",
+        "lastReportedAt"    : "2024-01-01T00:00:00.000000Z",
+        "publicIp"          : "198.51.100.%s" % (p_netIndex % 254 + 1),
+        "lanIp"             : None if isAppliance else device["lanIp"],
+        "wan1Ip"            : "192.0.2.%s" % (p_netIndex % 254 + 1) if isAppliance else None,
+        "wan2Ip"            : None,
+        "tags"              : []
+    }
+
+
+def makeClient(p_orgIndex, p_netIndex, p_clientIndex):
+    subnet = networkSubnet(p_netIndex)
+    hostNumber = p_clientIndex % (subnet.num_addresses - 2 - 16) + 16
+    networkNumber = p_orgIndex * CONFIG["networks"] + p_netIndex
+    mac = formatMac(0x020000000000 + (networkNumber << 20) + p_clientIndex)
+    return {
+        "id"                : "k%x" % ((networkNumber << 20) + p_clientIndex),
+        "mac"               : mac,
+        "description"       : "client-%s" % (p_clientIndex + 1),
+        "ip"                : str(subnet[hostNumber]),
+        "ip6"               : None,
+        "user"              : None,
+        "firstSeen"         : "2024-01-01T00:00:00Z",
+        "lastSeen"          : "2024-01-02T00:00:00Z",
+        "manufacturer"      : "Benchmark Inc",
+        "os"                : None,
+        "recentDeviceSerial": "Q2XX-%s-%s-0" % (p_orgIndex, p_netIndex),
+        "recentDeviceName"  : None,
+        "vlan"              : 1 + hostNumber // 32768 if p_netIndex % 2 == 0 else None,
+        "ssid"              : None,
+        "status"            : "Online",
+        "usage"             : {"sent": 1000 + p_clientIndex, "recv": 5000 + p_clientIndex}
+    }
+
+
+def deviceClients(p_indexes, p_query):
+    # All clients of a network are reported by its first device. Their usage grows linearly with the timespan,
+    # so that usage over a longer timespan is always the sum of the usage over its parts
+    orgIndex, netIndex, devIndex = p_indexes
+    if devIndex != 0:
+        return []
+    try:
+        timespan = int(p_query.get("timespan", [86400])[0])
+    except:
+        timespan = 86400
+    clients = []
+    for i in range(CONFIG["clients"]):
+        client = makeClient(orgIndex, netIndex, i)
+        client["usage"] = {"sent": timespan * (1 + i % 5) / 3600, "recv": timespan * (1 + i % 7) / 600}
+        clients.append(client)
+    return clients
+
+
+def formatMac(p_value):
+    hexString = "%012x" % p_value
+    return ":".join(hexString[i:i+2] for i in range(0, 12, 2))
+
+
+def networkVlans(p_netIndex):
+    subnets = list(networkSubnet(p_netIndex).subnets(new_prefix=17))
+    vlans = []
+    for i in range(len(subnets)):
+        vlans.append({
+            "id"            : str(i + 1),
+            "name"          : "VLAN %s" % (i + 1),
+            "subnet"        : str(subnets[i]),
+            "applianceIp"   : str(subnets[i][1])
+        })
+    return vlans
+
+
+def countAndGetter(p_orgIndex, p_collection, p_netIndex=None):
+    # Returns (number of items, function(index) -> item) for a paginated collection
+    networks    = CONFIG["networks"]
+    devices     = CONFIG["devices"]
+
+    if p_collection == "networks":
+        return networks, lambda i: makeNetwork(p_orgIndex, i)
+    if p_collection in ["inventoryDevices", "devices"]:
+        return networks * devices, lambda i: makeDevice(p_orgIndex, i // devices, i % devices)
+    if p_collection == "statuses":
+        return networks * devices, lambda i: makeDeviceStatus(p_orgIndex, i // devices, i % devices)
+    if p_collection == "clients":
+        return CONFIG["clients"], lambda i: makeClient(p_orgIndex, p_netIndex, i)
+    return 0, None
+
+
+def paginate(p_handler, p_path, p_query, p_collection, p_orgIndex, p_netIndex=None):
+    # Serves one page of a list. The startingAfter token is the index of the last item of the previous page
+    count, getItem = countAndGetter(p_orgIndex, p_collection, p_netIndex)
+    defaultPerPage, maxPerPage = PAGINATION_LIMITS[p_collection]
+
+    try:
+        perPage = int(p_query.get("perPage", [defaultPerPage])[0])
+    except:
+        perPage = defaultPerPage
+    perPage = max(3, min(perPage, maxPerPage))
+
+    try:
+        start = int(p_query.get("startingAfter", [-1])[0]) + 1
+    except:
+        start = 0
+    end = min(count, start + perPage)
+
+    items = [getItem(i) for i in range(start, end)]
+
+    headers = {}
+    if end < count:
+        nextQuery = {}
+        for key in p_query:
+            if key != "startingAfter":
+                nextQuery[key] = p_query[key]
+        nextQuery["perPage"] = [str(perPage)]
+        nextQuery["startingAfter"] = [str(end - 1)]
+        host = p_handler.headers.get("Host", "127.0.0.1:%s" % DEFAULT_PORT)
+        headers["Link"] = '<http://%s%s%s?%s>; rel=next' % (host, API_PATH_PREFIX, p_path,
+            urlencode(nextQuery, True))
+    return 200, items, headers
+
+
+def routeGet(p_handler, p_path, p_query):
+    # Returns (status, body, extra headers) for a GET request
+    segments = [segment for segment in p_path.split("/") if segment != ""]
+    notFound = (404, {"errors": ["Not found"]}, {})
+
+    if segments == ["organizations"]:
+        return 200, [makeOrganization(i) for i in range(CONFIG["organizations"])], {}
+
+    if segments == ["openapiSpec"]:
+        return 200, {"swagger": "2.0", "paths": {}}, {}
+
+    if len(segments) >= 2 and segments[0] == "organizations":
+        orgIndex = orgIndexFromId(segments[1])
+        if orgIndex is None:
+            return notFound
+        rest = segments[2:]
+        if rest == []:
+            return 200, makeOrganization(orgIndex), {}
+        if rest in [["networks"], ["inventoryDevices"], ["devices"]]:
+            return paginate(p_handler, p_path, p_query, rest[0], orgIndex)
+        if rest == ["devices", "statuses"]:
+            return paginate(p_handler, p_path, p_query, "statuses", orgIndex)
+        if rest in [["configTemplates"], ["admins"], ["policyObjects"], ["policyObjects", "groups"]]:
+            return 200, [], {}
+        return 200, {}, {}
+
+    if len(segments) >= 2 and segments[0] == "networks":
+        indexes = parseNetworkId(segments[1])
+        if indexes is None:
+            return notFound
+        orgIndex, netIndex = indexes
+        rest = segments[2:]
+        if rest == []:
+            return 200, makeNetwork(orgIndex, netIndex), {}
+        if rest == ["devices"]:
+            return 200, [makeDevice(orgIndex, netIndex, d) for d in range(CONFIG["devices"])], {}
+        if rest == ["clients"]:
+            return paginate(p_handler, p_path, p_query, "clients", orgIndex, netIndex)
+        # Even networks are in VLAN mode, odd networks are in single LAN mode
+        if rest == ["appliance", "vlans", "settings"]:
+            return 200, {"vlansEnabled": netIndex % 2 == 0}, {}
+        if rest == ["appliance", "vlans"]:
+            if netIndex % 2 == 0:
+                return 200, networkVlans(netIndex), {}
+            return 400, {"errors": ["VLANs are not enabled for this network"]}, {}
+        if rest == ["appliance", "singleLan"]:
+            if netIndex % 2 == 1:
+                subnet = networkSubnet(netIndex)
+                return 200, {"subnet": str(subnet), "applianceIp": str(subnet[1])}, {}
+            return 400, {"errors": ["Single LAN is not enabled for this network"]}, {}
+        if rest == ["appliance", "staticRoutes"]:
+            return 200, [], {}
+        if rest == ["appliance", "vpn", "advertisements"]:
+            return 200, {"routes": []}, {}
+        if rest == ["appliance", "settings"]:
+            return 200, {"clientTrackingMethod": "MAC address", "deploymentMode": "routed"}, {}
+        return 200, {}, {}
+
+    if len(segments) >= 2 and segments[0] == "devices":
+        indexes = parseSerial(segments[1])
+        if indexes is None:
+            return notFound
+        if len(segments) == 2:
+            return 200, makeDevice(*indexes), {}
+        if segments[2:] == ["clients"]:
+            return 200, deviceClients(indexes, p_query), {}
+        return 200, {}, {}
+
+    return notFound
+
+
+def bucketForPath(p_path):
+    # Requests are charged to the organization they belong to, like in the real API
+    segments = [segment for segment in p_path.split("/") if segment != ""]
+    if len(segments) >= 2:
+        if segments[0] == "organizations":
+            return "org:%s" % segments[1]
+        if segments[0] == "networks":
+            indexes = parseNetworkId(segments[1])
+            if not indexes is None:
+                return "org:%s" % organizationId(indexes[0])
+        if segments[0] == "devices":
+            indexes = parseSerial(segments[1])
+            if not indexes is None:
+                return "org:%s" % organizationId(indexes[0])
+    return "global"
+
+
+def operationName(p_verb, p_path):
+    segments = []
+    for segment in p_path.split("/"):
+        if segment == "" or segment.isalpha():
+            segments.append(segment)
+        else:
+            segments.append("{id}")
+    return "%s %s" % (p_verb, "/".join(segments))
+
+
+class MockDashboardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep the console quiet while benchmarking
+        pass
+
+    def sendJson(self, p_status, p_body, p_headers=None):
+        data = json.dumps(p_body).encode()
+        self.send_response(p_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if not p_headers is None:
+            for header in p_headers:
+                self.send_header(header, p_headers[header])
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return None
+        try:
+            return json.loads(self.rfile.read(length).decode())
+        except:
+            return None
+
+    def handleRequest(self, p_verb):
+        url = urlsplit(self.path)
+        requestBody = self.readBody() if p_verb in ["POST", "PUT"] else None
+
+        if not url.path.startswith(API_PATH_PREFIX):
+            recordRequest("%s (invalid)" % p_verb, False)
+            self.sendJson(404, {"errors": ["Not found"]})
+            return
+        path = url.path[len(API_PATH_PREFIX):]
+        operation = operationName(p_verb, path)
+
+        if CONFIG["latency"] > 0:
+            time.sleep(CONFIG["latency"] / 1000)
+
+        rateLimited = not takeToken(bucketForPath(path))
+        if not rateLimited and CONFIG["errorProbability"] > 0:
+            rateLimited = random.random() < CONFIG["errorProbability"]
+        recordRequest(operation, rateLimited)
+
+        if rateLimited:
+            self.sendJson(429, {"errors": ["API rate limit exceeded for organization"]},
+                {"Retry-After": str(CONFIG["retryAfter"])})
+            return
+
+        if p_verb == "GET":
+            status, body, headers = routeGet(self, path, parse_qs(url.query))
+            self.sendJson(status, body, headers)
+        elif p_verb == "DELETE":
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.sendJson(201 if p_verb == "POST" else 200, requestBody if not requestBody is None else {})
+
+    def do_GET(self):
+        self.handleRequest("GET")
+
+    def do_POST(self):
+        self.handleRequest("POST")
+
+    def do_PUT(self):
+        self.handleRequest("PUT")
+
+    def do_DELETE(self):
+        self.handleRequest("DELETE")
+
+
+def startServer(p_port=DEFAULT_PORT, p_host="127.0.0.1"):
+    # Starts the mock on a background thread. Returns the server and its API base URL. Use port 0 for any free port
+    server = ThreadingHTTPServer((p_host, p_port), MockDashboardHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    baseUrl = "http://%s:%s%s" % (p_host, server.server_address[1], API_PATH_PREFIX)
+    return server, baseUrl
+
+
+def killScript(reason=None):
+    if reason is None:
+        print(readMe)
+        sys.exit()
+    else:
+        print("ERROR: %s" % reason)
+        sys.exit()
+
+
+def main(argv):
+    arg_port = DEFAULT_PORT
+
+    try:
+        opts, args = getopt.getopt(argv, 'hp:o:n:d:c:l:r:x:a:')
+    except getopt.GetoptError:
+        killScript()
+
+    try:
+        for opt, arg in opts:
+            if opt == '-h':
+                killScript()
+            elif opt == '-p':
+                arg_port = int(arg)
+            elif opt == '-o':
+                configure(p_organizations=int(arg))
+            elif opt == '-n':
+                configure(p_networks=int(arg))
+            elif opt == '-d':
+                configure(p_devices=int(arg))
+            elif opt == '-c':
+                configure(p_clients=int(arg))
+            elif opt == '-l':
+                configure(p_latency=float(arg))
+            elif opt == '-r':
+                configure(p_rateLimit=float(arg))
+            elif opt == '-x':
+                configure(p_errorProbability=float(arg))
+            elif opt == '-a':
+                configure(p_retryAfter=int(arg))
+    except ValueError:
+        killScript("Invalid numeric parameter")
+
+    server, baseUrl = startServer(arg_port)
+
+    print("Serving %s organizations, %s networks, %s devices and %s clients per network" % (
+        CONFIG["organizations"], CONFIG["networks"], CONFIG["devices"], CONFIG["clients"]))
+    print("Set MERAKI_DASHBOARD_API_BASE_URL=%s" % baseUrl)
+    print("Press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stats = getStats()
+        print("\nServed %s requests, %s rate limited" % (stats["requests"], stats["rateLimited"]))
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
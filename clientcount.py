@@ -2,19 +2,31 @@
 #  an organization during the last month.
 #
 # Usage:
-#  clientcount.py -k <api key> [-o <org name>]
+#  clientcount.py -k <api key> [-o <org name>] [-m <mode>] [-e <error>] [-b <breakdown>]
 #
 # Parameters:
 #  -k <api key>     :   Mandatory. Your Meraki Dashboard API key
 #  -o <org name>    :   Optional. Name of the organization you want to process. Use keyword "/all" to explicitly
 #                       specify all orgs. Default is "/all"
+#  -m <mode>        :   Optional. Counting mode. Valid options:
+#                         exact     : Count every unique MAC address exactly. Memory use grows with the number
+#                                     of unique clients, about 100 bytes per client. This is the default
+#                         approx    : Estimate the count with a HyperLogLog sketch. Memory use is fixed, a few
+#                                     kilobytes per organization or network, regardless of the number of clients
+#  -e <error>       :   Optional. Relative standard error of "approx" mode, as a percentage. Default is 1
+#  -b <breakdown>   :   Optional. Also print a count per organization ("org") or per organization and network
+#                       ("net"). Default is no breakdown
 #
 # Example:
 #  clientcount.py -k 1234 -o "Big Industries Inc" 
+#  clientcount.py -k 1234 -m approx -e 2 -b net
 #
 # Notes:
 #  * In Windows, use double quotes ("") to enter command line parameters containing spaces.
 #  * This script was built for Python 3.7.1.
+#  * Clients are read from the client list of every network, which includes the clients of all its APs, and only
+#     if that fails from the client lists of the individual APs. Networks are processed in parallel. All requests
+#     share the rate limiter of the meraki_request package in the root of this repository.
 #  * Depending on your operating system, the command to start python can be either "python" or "python3". 
 # 
 # Required Python modules:
@@ -25,23 +37,28 @@
 #
 # Depending on your operating system, the command can be "pip3" instead of "pip".
 
-import sys, getopt, requests, json, time, datetime, os, sqlite3
+import sys, getopt, json, time, datetime, os, math
+
+from meraki_request import merakiRequest, merakiRequestPages
+from meraki_request.fanout import fanOut
 
 #SECTION: GLOBAL VARIABLES: MODIFY TO CHANGE SCRIPT BEHAVIOUR
 
-API_EXEC_DELAY              = 0.21 #Used in merakirequestthrottler() to avoid hitting dashboard API max request rate
+MAX_CONCURRENT_NETWORKS     = 10 #max number of organizations or networks whose data is requested at the same time
+
+CLIENT_PAGE_SIZE            = 5000 #clients per page of the network client list. 5000 is the maximum
 
-#connect and read timeouts for the Requests module in seconds
-REQUESTS_CONNECT_TIMEOUT    = 90
-REQUESTS_READ_TIMEOUT       = 90
+DEFAULT_APPROX_ERROR        = 1 #default relative standard error of approx mode in percent
 
 #SECTION: GLOBAL VARIABLES AND CLASSES: DO NOT MODIFY
 
-LAST_MERAKI_REQUEST         = datetime.datetime.now()   #used by merakirequestthrottler()
 ARG_APIKEY                  = '' #DO NOT STATICALLY SET YOUR API KEY HERE
 ARG_ORGNAME                 = '' #DO NOT STATICALLY SET YOUR ORGANIZATION NAME HERE
 ORG_LIST                    = None #list of organizations, networks and MRs the used API key has access to
 MAX_CLIENT_TIMESPAN         = 2592000 #maximum timespan GET clients Dashboard API call supports
+MASK64                      = 0xFFFFFFFFFFFFFFFF #used by mix64()
+HLL_MIN_PRECISION           = 4  #HyperLogLog sketches have between 2^4 and 2^18 registers
+HLL_MAX_PRECISION           = 18
         
 class c_Net:
     def __init__(self):
@@ -57,97 +74,171 @@ class c_Organization:
         shard       = 'api.meraki.com'
         nets        = []
         
+class c_ExactCounter:
+    #exact count of unique MAC addresses, stored as 48-bit integers
+    def __init__(self):
+        self.macs       = set()
+        
+    def add(self, p_mac):
+        self.macs.add(p_mac)
+        
+    def merge(self, p_other):
+        self.macs |= p_other.macs
+        
+    def count(self):
+        return(len(self.macs))
+        
+class c_HyperLogLog:
+    #HyperLogLog sketch estimating the count of unique MAC addresses. With 2^p_precision registers the relative
+    #standard error is about 1.04/sqrt(2^p_precision). Sketches of the same precision can be merged
+    def __init__(self, p_precision):
+        self.precision  = p_precision
+        self.registers  = bytearray(1 << p_precision)
+        
+    def add(self, p_mac):
+        hashvalue = mix64(p_mac)
+        index   = hashvalue >> (64 - self.precision)
+        rest    = hashvalue & ((1 << (64 - self.precision)) - 1)
+        rank    = 64 - self.precision - rest.bit_length() + 1 #position of the leftmost 1 bit of the rest
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            
+    def merge(self, p_other):
+        self.registers = bytearray(map(max, self.registers, p_other.registers))
+        
+    def count(self):
+        m = len(self.registers)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            #small range correction
+            estimate = m * math.log(m / zeros)
+        return(int(round(estimate)))
+        
         
 #SECTION: General use functions
-
-def merakirequestthrottler():
-    #makes sure there is enough time between API requests to Dashboard not to hit shaper
-    global LAST_MERAKI_REQUEST
-    
-    if (datetime.datetime.now()-LAST_MERAKI_REQUEST).total_seconds() < (API_EXEC_DELAY):
-        time.sleep(API_EXEC_DELAY)
-    
-    LAST_MERAKI_REQUEST = datetime.datetime.now()
-    return
     
 def printhelp():
     print('This is a Python 3 script to count the total unique client MAC addresses connected to MR access points for')
     print(' an organization during the last month.')
     print('')
     print('Usage:')
-    print(' clientcount.py -k <api key> [-o <org name>]')
+    print(' clientcount.py -k <api key> [-o <org name>] [-m <mode>] [-e <error>] [-b <breakdown>]')
     print('')
     print('Parameters:')
     print(' -k <api key>     :   Mandatory. Your Meraki Dashboard API key')
     print(' -o <org name>    :   Optional. Name of the organization you want to process. Use keyword "/all" to explicitly')
     print('                      specify all orgs. Default is "/all"')
+    print(' -m <mode>        :   Optional. Counting mode. Valid options:')
+    print('                        exact     : Count every unique MAC address exactly. This is the default')
+    print('                        approx    : Estimate the count with fixed memory use, using a HyperLogLog sketch')
+    print(' -e <error>       :   Optional. Relative standard error of "approx" mode, as a percentage. Default is 1')
+    print(' -b <breakdown>   :   Optional. Also print a count per organization ("org") or per organization and network')
+    print('                      ("net"). Default is no breakdown')
     print('')
     print('Example:')
     print(' clientcount.py -k 1234 -o "Big Industries Inc"')
+    print(' clientcount.py -k 1234 -m approx -e 2 -b net')
     print('')
     print('Notes:')
     print(' * In Windows, use double quotes ("") to enter command line parameters containing spaces.')
     
     
-#SECTION: Meraki Dashboard API communication functions
-
-def getInventory(p_org):
-    #returns a list of all networks in an organization
+def mix64(p_value):
+    #64-bit hash of an integer (SplitMix64 finalizer). Spreads MAC addresses evenly over the registers of a sketch
+    x = (p_value + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return(x ^ (x >> 31))
+    
     
-    merakirequestthrottler()
+def macToInt(p_mac):
+    #returns a MAC address string as a 48-bit integer, or None if it is not a valid MAC address
     try:
-        r = requests.get('https://%s/api/v0/organizations/%s/inventory' % (p_org.shard, p_org.id), headers={'X-Cisco-Meraki-API-Key': ARG_APIKEY, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
+        value = int(p_mac.replace(':', '').replace('-', ''), 16)
     except:
-        print('ERROR 06: Unable to contact Meraki cloud')
         return(None)
+    if value > 0xFFFFFFFFFFFF:
+        return(None)
+    return(value)
+    
+    
+def createCounter(p_mode, p_precision):
+    #returns an empty counter for the selected mode. Both kinds support add(), merge() and count()
+    if p_mode == 'approx':
+        return(c_HyperLogLog(p_precision))
+    return(c_ExactCounter())
+    
+    
+def precisionForError(p_errorPercent):
+    #returns the smallest HyperLogLog precision with a relative standard error of at most p_errorPercent
+    registers = (1.04 / (p_errorPercent / 100)) ** 2
+    precision = int(math.ceil(math.log2(registers)))
+    return(max(HLL_MIN_PRECISION, min(precision, HLL_MAX_PRECISION)))
+    
+    
+def countClients(p_counter, p_clients):
+    #adds the MAC addresses of a list of clients to a counter. The list can be discarded afterwards
+    for client in p_clients:
+        mac = macToInt(client.get('mac', None))
+        if not mac is None:
+            p_counter.add(mac)
+            
+            
+def isWirelessClient(p_client, p_serials):
+    #returns True if a client of a network client list was seen by one of the APs in set p_serials
+    if p_client.get('recentDeviceSerial', None) in p_serials:
+        return(True)
+    return(p_client.get('recentDeviceConnection', None) == 'Wireless' or not p_client.get('ssid', None) is None)
     
-    if r.status_code != requests.codes.ok:
+    
+#SECTION: Meraki Dashboard API communication functions
+
+def getInventory(p_org):
+    #returns a list of all devices in the inventory of an organization
+    
+    success, errors, headers, response = merakiRequest(ARG_APIKEY, 'GET', '/organizations/%s/inventoryDevices' % p_org.id)
+    if not success:
+        print('ERROR 06: Unable to read inventory of org "%s"' % p_org.name)
         return(None)
     
-    return(r.json())
+    return(response)
     
 
 def getNetworks(p_org):
     #returns a list of all networks in an organization
     
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://%s/api/v0/organizations/%s/networks' % (p_org.shard, p_org.id), headers={'X-Cisco-Meraki-API-Key': ARG_APIKEY, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        print('ERROR 07: Unable to contact Meraki cloud')
-        return(None)
-    
-    if r.status_code != requests.codes.ok:
+    success, errors, headers, response = merakiRequest(ARG_APIKEY, 'GET', '/organizations/%s/networks' % p_org.id)
+    if not success:
+        print('ERROR 07: Unable to read networks of org "%s"' % p_org.name)
         return(None)
     
-    return(r.json())
+    return(response)
         
 
 def getOrgs():
     #returns the organizations' list for a specified admin, with filters applied
         
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://api.meraki.com/api/v0/organizations', headers={'X-Cisco-Meraki-API-Key': ARG_APIKEY, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
+    success, errors, headers, response = merakiRequest(ARG_APIKEY, 'GET', '/organizations')
+    if not success:
         print('ERROR 01: Unable to contact Meraki cloud')
         return(None)
-    
-    if r.status_code != requests.codes.ok:
-        return(None)
         
-    rjson = r.json()
     orglist = []
     listlen = -1
     
     if ARG_ORGNAME.lower() == '/all':
-        for org in rjson:
+        for org in response:
             orglist.append(c_Organization())
             listlen += 1
             orglist[listlen].id     = org['id']
             orglist[listlen].name   = org['name']
     else:
-        for org in rjson:
+        for org in response:
             if org['name'] == ARG_ORGNAME:
                 orglist.append(c_Organization())
                 listlen += 1
@@ -167,66 +258,51 @@ def refreshOrgList():
     
     print('INFO: Starting org list refresh at %s...' % datetime.datetime.now())
 
-    flag_firstorg = True
     orglist = getOrgs()
     
     if not orglist is None:
+        #network and inventory lists of all orgs are requested at the same time
+        jobs = []
         for org in orglist:
-            print('INFO: Processing org "%s"' % org.name)
-            
             org.shard = 'api.meraki.com'
             orgshard = getShardHost(org)
             if not orgshard is None:
                 org.shard = orgshard
-            netlist = getNetworks(org)
-            devlist = getInventory(org)
+            jobs.append({'key': org.id, 'label': 'networks', 'function': getNetworks, 'args': (org,)})
+            jobs.append({'key': org.id, 'label': 'inventory', 'function': getInventory, 'args': (org,)})
+        results = fanOut(jobs, MAX_CONCURRENT_NETWORKS)
+        
+        for org in orglist:
+            print('INFO: Processing org "%s"' % org.name)
+            
+            netlist = results[org.id]['networks']
+            devlist = results[org.id]['inventory']
                             
             if not devlist is None and not netlist is None:
             
-                db = sqlite3.connect(':memory:')
-                dbcursor = db.cursor()
-                dbcursor.execute('''CREATE TABLE devices (serial text, networkId text)''')
-                db.commit()
-                
+                #group MR serials by network
+                devicesbynet = {}
                 for device in devlist:
                     if not device['networkId'] is None:
                         if device['model'].startswith('MR'):
-                            dbcursor.execute('''INSERT INTO devices VALUES (?,?)''', (device['serial'],device['networkId']))
-                db.commit()   
-                                                
-                flag_firstnet = True
-                
+                            if not device['networkId'] in devicesbynet:
+                                devicesbynet[device['networkId']] = []
+                            devicesbynet[device['networkId']].append(device['serial'])
+                            
+                org.nets = []
                 for net in netlist:
-                    if net['type'] != 'systems manager': #ignore systems manager nets
-                        dbcursor.execute('''SELECT serial FROM devices WHERE networkId = ?''', (net['id'],))
-                        
-                        devicesofnet = dbcursor.fetchall()
-                        
-                        if len(devicesofnet) > 0: #network has MRs
-                            if flag_firstnet:
-                                if flag_firstorg:
-                                    ORG_LIST = []
-                                    lastorg = -1
-                                    flag_firstorg = False
-                                
-                                ORG_LIST.append(org)
-                                lastorg += 1
-                                lastnet = -1
-                                ORG_LIST[lastorg].nets = []
-                                
-                                flag_firstnet = False
-                                
-                            ORG_LIST[lastorg].nets.append(c_Net())
-                            lastnet += 1
-                            ORG_LIST[lastorg].nets[lastnet].id      = net['id']
-                            ORG_LIST[lastorg].nets[lastnet].name    = net['name']
-                            ORG_LIST[lastorg].nets[lastnet].shard   = org.shard
-                            ORG_LIST[lastorg].nets[lastnet].devices = []
+                    if net.get('productTypes', []) != ['systemsManager']: #ignore systems manager nets
+                        if net['id'] in devicesbynet: #network has MRs
+                            org.nets.append(c_Net())
+                            org.nets[-1].id         = net['id']
+                            org.nets[-1].name       = net['name']
+                            org.nets[-1].shard      = org.shard
+                            org.nets[-1].devices    = devicesbynet[net['id']]
                             
-                            for device in devicesofnet:
-                                ORG_LIST[lastorg].nets[lastnet].devices.append(device[0])
-                                                    
-                db.close()
+                if len(org.nets) > 0:
+                    if ORG_LIST is None:
+                        ORG_LIST = []
+                    ORG_LIST.append(org)
                 
     LAST_ORGLIST_REFRESH = datetime.datetime.now()      
     print('INFO: Refresh complete at %s' % LAST_ORGLIST_REFRESH)
@@ -235,18 +311,43 @@ def refreshOrgList():
 
     
 def getclientlist(p_shardhost, p_serial, p_timespan):
+    #returns the clients of a single device, or None on failure
     
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://%s/api/v0/devices/%s/clients?timespan=%s' % (p_shardhost, p_serial, p_timespan), headers={'X-Cisco-Meraki-API-Key': ARG_APIKEY, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        printusertext('ERROR 02: Unable to contact Meraki cloud')
-        return(None)
-        
-    if r.status_code != requests.codes.ok:
+    success, errors, headers, response = merakiRequest(ARG_APIKEY, 'GET', '/devices/%s/clients' % p_serial,
+        p_queryItems={'timespan': p_timespan})
+    if not success:
         return(None)
     
-    return(r.json())   
+    return(response)
+    
+    
+def countNetworkClients(p_net, p_mode, p_precision):
+    #counts the unique clients of the APs of a network. Pages of the network client list are counted as they
+    #arrive. If the list cannot be read, falls back to the client lists of the individual APs. Counters ignore
+    #MAC addresses they already contain, so pages counted before the failure do no harm
+    #returns counter
+    
+    counter = createCounter(p_mode, p_precision)
+    serials = set(p_net.devices)
+    
+    flag_success = True
+    for success, errors, headers, page in merakiRequestPages(ARG_APIKEY, 'GET', '/networks/%s/clients' % p_net.id,
+            p_queryItems={'timespan': MAX_CLIENT_TIMESPAN, 'perPage': CLIENT_PAGE_SIZE}):
+        if not success or page is None:
+            flag_success = False
+            break
+        countClients(counter, [client for client in page if isWirelessClient(client, serials)])
+        
+    if not flag_success:
+        print('WARNING: Unable to read client list of net "%s". Reading clients of its APs instead' % p_net.name)
+        for serial in p_net.devices:
+            clients = getclientlist(p_net.shard, serial, MAX_CLIENT_TIMESPAN)
+            if clients is None:
+                print('WARNING: Unable to read clients of device "%s". They will not be counted' % serial)
+                continue
+            countClients(counter, clients)
+            
+    return(counter)
 
     
 #SECTION: main
@@ -261,10 +362,12 @@ def main(argv):
     arg_numresults  = ''
     arg_mode        = ''
     arg_filter      = ''    
+    arg_error       = ''
+    arg_breakdown   = ''
     
     #get command line arguments
     try:
-        opts, args = getopt.getopt(argv, 'hk:o:m:')
+        opts, args = getopt.getopt(argv, 'hk:o:m:e:b:')
     except getopt.GetoptError:
         printhelp()
         sys.exit(2)
@@ -279,6 +382,10 @@ def main(argv):
             ARG_ORGNAME     = arg
         elif opt == '-m':
             arg_mode        = arg
+        elif opt == '-e':
+            arg_error       = arg
+        elif opt == '-b':
+            arg_breakdown   = arg
             
     #check that all mandatory arguments have been given
     if ARG_APIKEY == '':
@@ -288,6 +395,26 @@ def main(argv):
     #set defaults for empty command line arguments
     if ARG_ORGNAME == '':
         ARG_ORGNAME = '/all'
+    arg_mode = arg_mode.lower()
+    if arg_mode == '':
+        arg_mode = 'exact'
+    if arg_mode != 'exact' and arg_mode != 'approx':
+        print('ERROR 08: Invalid counting mode: -m %s' % arg_mode)
+        sys.exit(2)
+    arg_breakdown = arg_breakdown.lower()
+    if arg_breakdown != '' and arg_breakdown != 'org' and arg_breakdown != 'net':
+        print('ERROR 09: Invalid breakdown: -b %s' % arg_breakdown)
+        sys.exit(2)
+    if arg_error == '':
+        arg_error = DEFAULT_APPROX_ERROR
+    try:
+        arg_error = float(arg_error)
+        if arg_error <= 0 or arg_error >= 100:
+            raise ValueError('error')
+    except:
+        print('ERROR 10: Invalid relative error: -e %s' % arg_error)
+        sys.exit(2)
+    precision = precisionForError(arg_error)
    
     refreshOrgList()
     
@@ -295,53 +422,55 @@ def main(argv):
         print('ERROR 03: No organizations with MR access points for the specified API key')
         sys.exit(2) 
         
-    print ('INFO: Starting client device database creation at %s...' % datetime.datetime.now())
-    db = sqlite3.connect(':memory:')
+    print ('INFO: Starting client count at %s...' % datetime.datetime.now())
     
-    dbcursor = db.cursor()
-    
-    dbcursor.execute('''CREATE TABLE clients
-             (id text, description text, dhcpHostName text, mac text, ip text, vlan text, orgid text, orgname text, netid text, netname text)''')
-              
-    db.commit()
-    
-    flag_madechanges = False
+    #networks of all orgs are processed at the same time. every network count is merged into its organization
+    #count as soon as it is complete and then discarded
+    jobs = []
     for org in ORG_LIST:
-        print ('INFO: Processing org "%s"' % org.name)
         for net in org.nets:
-            print ('INFO: Processing net "%s"' % net.name)
-            for dev in net.devices:
-                clients = getclientlist(org.shard, dev, MAX_CLIENT_TIMESPAN)
-                for client in clients:
-                    dbcursor.execute('''INSERT INTO clients VALUES (?,?,?,?,?,?,?,?,?,?)''', 
-                        (client['id'],
-                        client['description'],
-                        client['dhcpHostname'],
-                        client['mac'],
-                        client['ip'],
-                        client['vlan'],
-                        org.id,
-                        org.name,
-                        net.id,
-                        net.name))
-                    flag_madechanges = True
-                    
-    if flag_madechanges:
-        db.commit()
+            jobs.append({'key': org.id, 'label': net.id, 'function': countNetworkClients,
+                'args': (net, arg_mode, precision)})
+            
+    orgcounters = {}
+    netcounts   = {}
+    for org in ORG_LIST:
+        orgcounters[org.id] = createCounter(arg_mode, precision)
+    
+    def onresult(p_job, p_counter):
+        net = p_job['args'][0]
+        if p_counter is None:
+            print ('WARNING: Unable to count clients of net "%s"' % net.name)
+            return
+        print ('INFO: Processed net "%s"' % net.name)
+        if arg_breakdown == 'net':
+            netcounts[net.id] = p_counter.count()
+        orgcounters[p_job['key']].merge(p_counter)
         
-    print ('INFO: Database creation complete at %s' % datetime.datetime.now())
-   
-    dbcursor.execute('''SELECT DISTINCT mac FROM clients''')
+    fanOut(jobs, MAX_CONCURRENT_NETWORKS, p_onResult=onresult)
     
-    retvalue = dbcursor.fetchall()
-    
-    print ('\nTotal unique client MAC addresses across all WLAN APs: %s\n' % len(retvalue))    
+    total       = createCounter(arg_mode, precision)
+    breakdown   = [] #lines of the per-org/net breakdown
+    for org in ORG_LIST:
+        if arg_breakdown != '':
+            breakdown.append('Organization "%s": %s' % (org.name, orgcounters[org.id].count()))
+        if arg_breakdown == 'net':
+            for net in org.nets:
+                if net.id in netcounts:
+                    breakdown.append('    Network "%s": %s' % (net.name, netcounts[net.id]))
+        total.merge(orgcounters[org.id])
+        
+    print ('INFO: Client count complete at %s' % datetime.datetime.now())
     
-    #List unique MAC addresses
-    #for line in retvalue:
-    #    print (line[0])   
+    if arg_mode == 'approx':
+        print ('\nCounts are estimates with a relative standard error of %.2f%%' % (104 / math.sqrt(1 << precision)))
+        
+    if len(breakdown) > 0:
+        print ('\nUnique client MAC addresses per %s:' % ('organization and network' if arg_breakdown == 'net' else 'organization'))
+        for line in breakdown:
+            print (line)
     
-    db.close()
+    print ('\nTotal unique client MAC addresses across all WLAN APs: %s\n' % total.count())    
     
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
@@ -1,4 +1,4 @@
-readMe = """Python 3 script that lists all clients with IPv4 addresses within the specified range or subnet.
+readMe = """Python 3 script that lists all clients with IPv4 or IPv6 addresses within the specified ranges or subnets.
 
 Script syntax, Windows:
     python clients_in_ip_range.py [-k <api_key>] -i <ip_range> [-o <org_name>]
@@ -7,7 +7,8 @@ Script syntax, Linux and Mac:
     python3 clients_in_ip_range.py [-k <api_key>] -i <ip_range> [-o <org_name>]
     
 Mandatory parameters:
-    -i <ip_range>           The IP range or subnet to match client IP addresses against
+    -i <ip_range>           The IP range or subnet to match client IP addresses against. IPv4 and IPv6
+                            are supported. Separate multiple ranges and subnets with commas
                             Valid forms:
                                 <network_ip>/<netmask bits>
                                 <start_ip>-<end_ip>
@@ -18,6 +19,8 @@ Optional parameters:
                             from there instead                            
     -o <org_name>           Specify the name of the organization to scan for matching clients.
                             If omitted, all organizations will be scanned
+    --no-cache              Do not use cached organization and network lists, even if OS environment
+                            variable "MERAKI_RESPONSE_CACHE" is set
                             
 Example, find all clients in organization "Big Industries Inc" belonging to subnet 10.0.0.0/8
     python clients_in_ip_range.py -k 1234 -o "Big Industries Inc" -i 10.0.0.0/8
@@ -25,6 +28,9 @@ Example, find all clients in organization "Big Industries Inc" belonging to subn
 Example, find all clients in all organizations with IP addresses between 10.10.10.1 and 10.20.20.20
     python clients_in_ip_range.py -k 1234 -o "Big Industries Inc" -i 10.10.10.1-10.20.20.20
     
+Example, find all clients in subnets 192.168.0.0/16 and 2001:db8::/32
+    python clients_in_ip_range.py -k 1234 -i 192.168.0.0/16,2001:db8::/32
+    
 Required Python 3 modules:
     requests
     
@@ -41,147 +47,15 @@ Depending on your operating system and Python environment, you may need to use c
 """
 
 
-import sys, getopt, time, datetime, ipaddress, os
-
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
+import sys, getopt, time, datetime, ipaddress, os, bisect
 
-API_MAX_RETRIES         = 3
-API_CONNECT_TIMEOUT     = 60
-API_TRANSMIT_TIMEOUT    = 60
-API_STATUS_RATE_LIMIT   = 429
+from meraki_request import merakiRequest, merakiRequestPages
+from meraki_request import configureCacheFromArgv
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE    = True
 
-API_BASE_URL            = "https://api.meraki.com/api/v1"
-
 API_KEY_ENV_VAR_NAME    = "MERAKI_DASHBOARD_API_KEY"
-
-
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        query = "?" + urlencode(p_queryItems, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-        if verb == "GET":
-            r = session.get(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        elif verb == "PUT":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.put(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "POST":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.post(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "DELETE":
-            r = session.delete(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        retryInterval = 2
-        if "Retry-After" in r.headers:
-            retryInterval = r.headers["Retry-After"]
-        if "retry-after" in r.headers:
-            retryInterval = r.headers["retry-after"]
-        
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, retryInterval))
-        time.sleep(int(retryInterval))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
     
     
 def getOrganizations(apiKey):
@@ -194,10 +68,12 @@ def getOrganizationNetworks(apiKey, organizationId):
     success, errors, headers, response = merakiRequest(apiKey, "GET", endpoint, p_verbose=FLAG_REQUEST_VERBOSE)    
     return success, errors, headers, response        
     
-def getNetworkClients(apiKey, networkId, timespan=2678400):
-    endpoint = "/networks/%s/clients?timespan=%s" % (networkId, timespan)
-    success, errors, headers, response = merakiRequest(apiKey, "GET", endpoint, p_verbose=FLAG_REQUEST_VERBOSE)    
-    return success, errors, headers, response
+def iterNetworkClientPages(apiKey, networkId, timespan=2678400):
+    # Yields (success, errors, headers, response) for every page of clients, instead of collecting the whole list
+    # in memory. Stops after the first page that fails
+    endpoint = "/networks/%s/clients" % networkId
+    query = {"timespan": timespan}
+    return merakiRequestPages(apiKey, "GET", endpoint, p_queryItems=query, p_verbose=FLAG_REQUEST_VERBOSE)
     
     
 def log(text, filePath=None):
@@ -220,32 +96,49 @@ def killScript(reason=None):
         sys.exit()
         
         
-def parseIpSubnets(ipRangeString):
-    result = []
-
-    if ipRangeString.find("-") != -1:
-        splitStr = ipRangeString.split("-")
+def parseIpRanges(ipRangeString):
+    # Converts a comma separated list of IP ranges and subnets to sorted, non-overlapping intervals of integer
+    # addresses, so that addresses can be matched with a binary search, however large the ranges are
+    #returns {ip version: ([first address of every interval], [last address of every interval])}, or None if invalid
+    intervals = {4: [], 6: []}
+    
+    for item in ipRangeString.split(","):
+        item = item.strip()
         try:
-            first = ipaddress.IPv4Address(splitStr[0])
-            last = ipaddress.IPv4Address(splitStr[1])
-            for subnet in ipaddress.summarize_address_range(first, last):
-                result.append(subnet)
+            if item.find("-") != -1:
+                splitStr = item.split("-")
+                first = ipaddress.ip_address(splitStr[0].strip())
+                last = ipaddress.ip_address(splitStr[1].strip())
+                subnets = ipaddress.summarize_address_range(first, last)
+            else:
+                subnets = [ipaddress.ip_network(item)]
+            for subnet in subnets:
+                intervals[subnet.version].append((int(subnet.network_address), int(subnet.broadcast_address)))
         except:
-            result = None
-    else:
-        try:
-            result.append(ipaddress.ip_network(ipRangeString))
-        except:
-            result = None
+            return None
+            
+    result = {}
+    for version in intervals:
+        merged = []
+        for start, end in sorted(intervals[version]):
+            if len(merged) > 0 and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        result[version] = ([interval[0] for interval in merged], [interval[1] for interval in merged])
     return result
     
     
-def expandSubnets(subnets):
-    hosts = []
-    for subnet in subnets:
-        for host in subnet.hosts():
-            hosts.append(host)
-    return hosts
+def ipInRanges(ipString, ranges):
+    # Returns True if an IP address string is inside one of the intervals returned by parseIpRanges()
+    try:
+        address = ipaddress.ip_address(ipString)
+    except:
+        return False
+    starts, ends = ranges[address.version]
+    value = int(address)
+    index = bisect.bisect_right(starts, value) - 1
+    return index >= 0 and value <= ends[index]
     
     
 def getApiKey(argument):
@@ -277,12 +170,9 @@ def main(argv):
     if apiKey is None or arg_ipRange is None:
         killScript()        
         
-    log("Expanding subnets...")
-    
-    subnets = parseIpSubnets(arg_ipRange)    
-    hosts = expandSubnets(subnets)
+    ranges = parseIpRanges(arg_ipRange)
         
-    if subnets is None:
+    if ranges is None:
         killScript("Invalid IP range/subnet")
         
     log("Fetching information from Meraki cloud...")
@@ -309,30 +199,28 @@ def main(argv):
         if len(orgs) == 0:
             killScript("No organization found with that name")
                                 
+    printOrgs = {}
+    
     for org in orgs:
         org["networks"] = []
         success, errors, headers, orgNetworks = getOrganizationNetworks(apiKey, org["id"])
         if not orgNetworks is None:
             org["networks"] = orgNetworks
-            for net in org["networks"]:
-                net["clients"] = []
-                success, errors, headers, netClients = getNetworkClients(apiKey, net["id"])
-                if not netClients is None:
-                    net["clients"] = netClients    
-
-    log("Matching client IP addresses to subnets...")
-    
-    printOrgs = {}
-    
-    for org in orgs:
+            
         matchingNetworks = []
         for net in org["networks"]:
             log('Processing network "%s"...' % net["name"])
+            # Clients are matched as pages arrive, so only matching clients are kept in memory
             matchingClients = []
-            for client in net["clients"]:
-                if "ip" in client and (not client["ip"] is None):
-                    if ipaddress.ip_address(client["ip"]) in hosts:
-                        matchingClients.append(client)
+            for success, errors, headers, page in iterNetworkClientPages(apiKey, net["id"]):
+                if not success or page is None:
+                    log('ERROR: Could not fetch clients for network "%s". Its list of clients is incomplete' % net["name"])
+                    break
+                for client in page:
+                    for field in ["ip", "ip6"]:
+                        if not client.get(field, None) is None and ipInRanges(client[field], ranges):
+                            matchingClients.append(client)
+                            break
             if len(matchingClients) > 0:
                 matchingNetworks.append({"name": net["name"], "clients": matchingClients})
         
@@ -362,8 +250,12 @@ def main(argv):
                         if len(manufacturer) > 24:
                             manufacturer = "%s..." % manufacturer[0:21]
                         
-                    print ('%-31s %-16s %-18s %-25s %s' % (description, client["ip"],client["mac"], user, manufacturer))
+                    ip = client["ip"]
+                    if ip is None or not ipInRanges(ip, ranges):
+                        ip = client["ip6"]
+                        
+                    print ('%-31s %-16s %-18s %-25s %s' % (description, ip, client["mac"], user, manufacturer))
                 
     
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    main(configureCacheFromArgv(sys.argv[1:]))
@@ -14,6 +14,8 @@ Optional parameters:
  -f <file path>     The file name or path of the file to be used for output. If omitted, default
                      is file name "inventory_[timestamp].csv" in the current directory. Use
                      "/print" to display on the monitor instead.
+ --no-cache         Do not use cached organization, network and inventory lists, even if OS environment
+                     variable "MERAKI_RESPONSE_CACHE" is set
                      
 Examples:
     python inventorycsv.py -k 1234
@@ -32,145 +34,14 @@ Notes:
 
 import sys, getopt, requests, time, datetime, os
 
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
-
-API_MAX_RETRIES             = 3
-API_CONNECT_TIMEOUT         = 60
-API_TRANSMIT_TIMEOUT        = 60
-API_STATUS_RATE_LIMIT       = 429
-API_RETRY_DEFAULT_WAIT      = 3
+from meraki_request import merakiRequest
+from meraki_request import configureCacheFromArgv
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE        = True
 
-API_BASE_URL                = "https://api.meraki.com/api/v1"
 API_KEY_ENV_VAR_NAME        = "MERAKI_DASHBOARD_API_KEY"
 
-
-### SECTION: FUNCTIONS FOR MERAKI DASHBOARD COMMUNICATION
-
-
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-        
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        qArrayFix = {}
-        for item in p_queryItems:
-            if isinstance(p_queryItems[item], list):
-                qArrayFix["%s[]" % item] = p_queryItems[item]
-            else:
-                qArrayFix[item] = p_queryItems[item]
-        query = "?" + urlencode(qArrayFix, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-    
-    verbs   = {
-        'DELETE'    : { 'function': session.delete, 'hasBody': False },
-        'GET'       : { 'function': session.get,    'hasBody': False },
-        'POST'      : { 'function': session.post,   'hasBody': True  },
-        'PUT'       : { 'function': session.put,    'hasBody': True  }
-    }
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-            
-        if verb in verbs:
-            if verbs[verb]['hasBody'] and not p_requestBody is None:
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-            else: 
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        retryInterval = API_RETRY_DEFAULT_WAIT
-        if "Retry-After" in r.headers:
-            retryInterval = r.headers["Retry-After"]
-        if "retry-after" in r.headers:
-            retryInterval = r.headers["retry-after"]
-        
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, retryInterval))
-        time.sleep(int(retryInterval))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
-
 # getOrganizations
 #
 # Description: List the organizations that the user has privileges on
@@ -347,17 +218,25 @@ def main(argv):
         
         success, errors, statuses = getOrganizationDevicesStatuses(apiKey, org['id'])
         
+        # Index networks and statuses once, so that matching devices to them takes linear time
+        networksById = {}
+        if not networks is None:
+            for net in networks:
+                networksById[net["id"]] = net
+                
+        statusesBySerial = {}
+        if not statuses is None:
+            for statDevice in statuses:
+                statusesBySerial[statDevice["serial"]] = statDevice
+        
         for device in inventory:
             device["networkName"]       = ""
             device["networkTags"]       = []
-            if not networks is None:
-                if not device["networkId"] is None:
-                     for net in networks:
-                        if net["id"] == device["networkId"]:
-                            device["networkName"] = net["name"]
-                            if not net["tags"] is None:
-                                device["networkTags"] = net["tags"]
-                            break
+            if not device["networkId"] is None and device["networkId"] in networksById:
+                net = networksById[device["networkId"]]
+                device["networkName"] = net["name"]
+                if not net["tags"] is None:
+                    device["networkTags"] = net["tags"]
                             
             device["status"]            = ""
             device["lastReportedAt"]    = ""
@@ -367,23 +246,22 @@ def main(argv):
             device["wan2Ip"]            = ""
             device["tags"]              = []
             
-            if not statuses is None:
-                for statDevice in statuses:
-                    if device['serial'] == statDevice['serial']:
-                        if "status" in statDevice and not statDevice["status"] is None:
-                            device["status"] = statDevice['status']
-                        if "lastReportedAt" in statDevice and not statDevice["lastReportedAt"] is None:
-                            device["lastReportedAt"] = statDevice['lastReportedAt']
-                        if "publicIp" in statDevice and not statDevice["publicIp"] is None:
-                            device["publicIp"] = statDevice['publicIp']
-                        if "lanIp" in statDevice and not statDevice["lanIp"] is None:
-                            device["lanIp"] = statDevice['lanIp']
-                        if "wan1Ip" in statDevice and not statDevice["wan1Ip"] is None:
-                            device["wan1Ip"] = statDevice['wan1Ip']
-                        if "wan2Ip" in statDevice and not statDevice["wan2Ip"] is None:
-                            device["wan2Ip"] = statDevice['wan2Ip']
-                        if "tags" in statDevice and not statDevice["tags"] is None:
-                            device["tags"] = statDevice['tags']
+            if device['serial'] in statusesBySerial:
+                statDevice = statusesBySerial[device['serial']]
+                if "status" in statDevice and not statDevice["status"] is None:
+                    device["status"] = statDevice['status']
+                if "lastReportedAt" in statDevice and not statDevice["lastReportedAt"] is None:
+                    device["lastReportedAt"] = statDevice['lastReportedAt']
+                if "publicIp" in statDevice and not statDevice["publicIp"] is None:
+                    device["publicIp"] = statDevice['publicIp']
+                if "lanIp" in statDevice and not statDevice["lanIp"] is None:
+                    device["lanIp"] = statDevice['lanIp']
+                if "wan1Ip" in statDevice and not statDevice["wan1Ip"] is None:
+                    device["wan1Ip"] = statDevice['wan1Ip']
+                if "wan2Ip" in statDevice and not statDevice["wan2Ip"] is None:
+                    device["wan2Ip"] = statDevice['wan2Ip']
+                if "tags" in statDevice and not statDevice["tags"] is None:
+                    device["tags"] = statDevice['tags']
                         
             org["inventory"].append(device)
                     
@@ -480,4 +358,4 @@ def main(argv):
     print('End of script.')
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    main(configureCacheFromArgv(sys.argv[1:]))
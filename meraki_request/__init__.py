@@ -0,0 +1,8 @@
+from .client import merakiRequest, merakiRequestPage, merakiRequestPages, merakiRequestItems, nextPageEndpoint
+from .client import getSession, closeSession, setBaseUrl, NoRebuildAuthSession
+from .ratelimit import setOrganization, setRateLimit, setRateLimitEnabled
+from .cache import enableCache, disableCache, configureCacheFromArgv
+from .memo import enableMemo, disableMemo, clearMemo
+from .metrics import getMetrics, writeMetrics, enableMetricsExport
+from .planner import parsePlanArgument, createPlan, addPlanPhase, printPlan
+from .actionbatch import ActionBatchEngine
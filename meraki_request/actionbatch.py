@@ -0,0 +1,146 @@
+# Concurrent action batch engine.
+#
+# Scripts that make many configuration changes group them into asynchronous action batches of up to 100 actions.
+# The usual approach is to submit a batch, then poll the list of all action batches of the organization until it
+# has completed, which runs one batch at a time and downloads every batch of the organization on every poll.
+#
+# ActionBatchEngine keeps up to ACTION_BATCH_MAX_CONCURRENT asynchronous batches in flight, the number the
+# platform runs concurrently per organization. Actions are queued with addAction() and submitted as soon as a
+# batch is full. When all slots are taken, submission waits for one of the engine's own batches to finish. Only the
+# engine's own batches are polled, one by one, with exponential backoff while nothing changes. Failed batches are
+# reported as soon as they are detected, through the p_onFailure callback, instead of after the whole run.
+#
+# Example:
+#     engine = ActionBatchEngine(apiKey, organizationId)
+#     for serial in serials:
+#         engine.addAction({"resource": "/devices/%s" % serial, "operation": "update", "body": {"name": "x"}})
+#     if not engine.wait():
+#         print("Some actions failed")
+
+import time
+
+from .client import merakiRequest
+
+# Maximum number of actions in a single asynchronous action batch
+ACTION_BATCH_MAX_ACTIONS        = 100
+
+# Maximum number of asynchronous action batches that run at the same time in an organization
+ACTION_BATCH_MAX_CONCURRENT     = 5
+
+# Polling interval in seconds. It doubles up to the maximum while no batch finishes and is reset when one does
+ACTION_BATCH_POLL_INTERVAL      = 1
+ACTION_BATCH_POLL_MAX_INTERVAL  = 16
+
+# Batches that have not finished this many seconds after being submitted are reported as failed
+ACTION_BATCH_TIMEOUT            = 900
+
+
+class ActionBatchEngine:
+    def __init__(self, p_apiKey, p_organizationId, p_actionsPerBatch=ACTION_BATCH_MAX_ACTIONS,
+            p_maxConcurrent=ACTION_BATCH_MAX_CONCURRENT, p_onFailure=None, p_verbose=False):
+        # p_onFailure: Optional function called with a failure record every time a batch fails. A failure record
+        # is a dictionary with keys "batchId" (None if the batch could not be submitted), "errors" and "actions"
+        self.apiKey             = p_apiKey
+        self.organizationId     = p_organizationId
+        self.actionsPerBatch    = max(1, min(p_actionsPerBatch, ACTION_BATCH_MAX_ACTIONS))
+        self.maxConcurrent      = max(1, p_maxConcurrent)
+        self.onFailure          = p_onFailure
+        self.verbose            = p_verbose
+
+        self.queue              = []
+        self.inFlight           = {}
+        self.completed          = []
+        self.failures           = []
+        self.failuresReported   = 0
+
+    def addAction(self, p_action):
+        # Queues an action. Submits a batch when the queue is full
+        #returns success, batchId. batchId is None if no batch was submitted
+        self.queue.append(p_action)
+        if len(self.queue) >= self.actionsPerBatch:
+            return self.submitQueue()
+        return True, None
+
+    def flush(self):
+        # Submits the queued actions, if any, without waiting for them to complete
+        #returns success, batchId. batchId is None if no batch was submitted
+        if len(self.queue) == 0:
+            return True, None
+        return self.submitQueue()
+
+    def wait(self):
+        # Submits the queued actions and blocks until all batches of the engine have finished.
+        # Returns True if no batch has failed since the previous call of wait()
+        self.flush()
+        self.waitUntilInFlightAtMost(0)
+        flag_noNewFailures      = len(self.failures) == self.failuresReported
+        self.failuresReported   = len(self.failures)
+        return flag_noNewFailures
+
+    def submitQueue(self):
+        actions     = self.queue
+        self.queue  = []
+
+        self.waitUntilInFlightAtMost(self.maxConcurrent - 1)
+
+        endpoint    = "/organizations/%s/actionBatches" % self.organizationId
+        body        = {"confirmed": True, "synchronous": False, "actions": actions}
+        success, errors, headers, response = merakiRequest(self.apiKey, "POST", endpoint, p_requestBody=body,
+            p_verbose=self.verbose)
+
+        if response is None or not "id" in response:
+            self.reportFailure(None, errors, actions)
+            return False, None
+
+        batchId = str(response["id"])
+        if self.verbose:
+            print("Submitted action batch %s with %s actions" % (batchId, len(actions)))
+        self.inFlight[batchId] = {"actions": actions, "submitted": time.monotonic()}
+        return True, batchId
+
+    def pollInFlight(self):
+        # Checks the status of every batch in flight once. Returns the number of batches that have finished
+        finished = 0
+        for batchId in list(self.inFlight):
+            endpoint = "/organizations/%s/actionBatches/%s" % (self.organizationId, batchId)
+            success, errors, headers, batch = merakiRequest(self.apiKey, "GET", endpoint, p_verbose=self.verbose)
+
+            record = self.inFlight[batchId]
+            status = {}
+            if not batch is None and "status" in batch:
+                status = batch["status"]
+
+            if status.get("failed", False):
+                del self.inFlight[batchId]
+                self.reportFailure(batchId, status.get("errors", None), record["actions"])
+                finished += 1
+            elif status.get("completed", False):
+                del self.inFlight[batchId]
+                self.completed.append(batchId)
+                finished += 1
+            elif time.monotonic() - record["submitted"] > ACTION_BATCH_TIMEOUT:
+                del self.inFlight[batchId]
+                self.reportFailure(batchId, ["Timed out waiting for action batch to complete"], record["actions"])
+                finished += 1
+        return finished
+
+    def waitUntilInFlightAtMost(self, p_count):
+        interval = ACTION_BATCH_POLL_INTERVAL
+        while len(self.inFlight) > p_count:
+            time.sleep(interval)
+            if self.pollInFlight() > 0:
+                interval = ACTION_BATCH_POLL_INTERVAL
+            else:
+                interval = min(interval * 2, ACTION_BATCH_POLL_MAX_INTERVAL)
+
+    def reportFailure(self, p_batchId, p_errors, p_actions):
+        failure = {"batchId": p_batchId, "errors": p_errors, "actions": p_actions}
+        self.failures.append(failure)
+        if p_batchId is None:
+            print("ERROR: Unable to submit action batch with %s actions" % len(p_actions))
+        else:
+            print("ERROR: Action batch %s has failed" % p_batchId)
+        if not p_errors is None:
+            print(p_errors)
+        if not self.onFailure is None:
+            self.onFailure(failure)
@@ -0,0 +1,138 @@
+# Opt-in on-disk TTL cache for slow-changing organization-level lists.
+#
+# Almost every script starts by fetching the same organization, network and inventory lists. When several scripts
+# are run against the same organization within a short time, each of them downloads these lists again. When the
+# cache is enabled, merakiRequest() stores successful GET responses for the endpoints listed in CACHE_TTL_SECONDS
+# in a SQLite database as compressed JSON and serves them from there until their time to live expires.
+#
+# The cache is disabled by default. Enable it for all scripts by setting OS environment variable
+# MERAKI_RESPONSE_CACHE to any value, or from a script by calling enableCache(). Scripts that support it accept
+# command line argument --no-cache to bypass the cache for a single run. Any successful POST, PUT or DELETE
+# request drops all cached responses of the API key that made it, since it may have changed any of the lists. This
+# also happens when the cache is disabled in the process that made the request.
+
+import os, re, json, zlib, time, sqlite3, hashlib, threading
+
+from urllib.parse import urlencode
+
+CACHE_ENABLE_ENV_VAR_NAME   = "MERAKI_RESPONSE_CACHE"
+CACHE_DB_ENV_VAR_NAME       = "MERAKI_RESPONSE_CACHE_DB"
+CACHE_DB_TIMEOUT            = 30
+
+CACHE_DB_PATH               = os.environ.get(CACHE_DB_ENV_VAR_NAME,
+                                os.path.join(os.path.expanduser("~"), ".meraki_response_cache.sqlite"))
+CACHE_ENABLED               = not os.environ.get(CACHE_ENABLE_ENV_VAR_NAME, None) is None
+
+CACHE_NO_CACHE_ARGUMENT     = "--no-cache"
+
+# Endpoints that can be cached and for how many seconds. Endpoints not listed here are never cached
+CACHE_TTL_SECONDS           = [
+                                (r"^/organizations$",                               3600),
+                                (r"^/organizations/[^/]+$",                         3600),
+                                (r"^/organizations/[^/]+/networks$",                900),
+                                (r"^/organizations/[^/]+/configTemplates$",         900),
+                                (r"^/organizations/[^/]+/inventoryDevices$",        900),
+                                (r"^/organizations/[^/]+/devices$",                 900)
+                            ]
+
+CACHE_TTL_REGEXES           = [(re.compile(pattern), ttl) for pattern, ttl in CACHE_TTL_SECONDS]
+
+THREAD_DATA                 = threading.local()
+
+
+def enableCache(p_dbPath=None):
+    global CACHE_ENABLED, CACHE_DB_PATH
+    CACHE_ENABLED = True
+    if not p_dbPath is None:
+        CACHE_DB_PATH = p_dbPath
+
+
+def disableCache():
+    global CACHE_ENABLED
+    CACHE_ENABLED = False
+
+
+def configureCacheFromArgv(p_argv):
+    # Disables the cache if argument --no-cache is present. Returns the remaining arguments, so that scripts
+    # can pass them on to getopt unchanged
+    if CACHE_NO_CACHE_ARGUMENT in p_argv:
+        disableCache()
+    return [arg for arg in p_argv if arg != CACHE_NO_CACHE_ARGUMENT]
+
+
+def ttlForEndpoint(p_endpoint):
+    for regex, ttl in CACHE_TTL_REGEXES:
+        if regex.match(p_endpoint):
+            return ttl
+    return None
+
+
+def apiKeyHash(p_apiKey):
+    # Never store API keys in the cache, only a hash that tells them apart
+    return hashlib.sha256(str(p_apiKey).encode()).hexdigest()[:16]
+
+
+def cacheKey(p_apiKey, p_endpoint, p_queryItems):
+    query = ""
+    if not p_queryItems is None:
+        query = urlencode(sorted(p_queryItems.items()), True)
+    return "%s %s?%s" % (apiKeyHash(p_apiKey), p_endpoint, query)
+
+
+def getConnection():
+    # SQLite connections cannot be shared between threads, so every thread opens its own
+    connection = getattr(THREAD_DATA, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(CACHE_DB_PATH, timeout=CACHE_DB_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS responses
+            (key TEXT PRIMARY KEY, keyHash TEXT, expires REAL, body BLOB)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_keyHash ON responses (keyHash)")
+        connection.commit()
+        THREAD_DATA.connection = connection
+    return connection
+
+
+def isCacheable(p_httpVerb, p_endpoint):
+    return CACHE_ENABLED and p_httpVerb.upper() == "GET" and not ttlForEndpoint(p_endpoint) is None
+
+
+def cacheGet(p_apiKey, p_endpoint, p_queryItems):
+    # Returns the cached response body, or None if there is no valid cached response
+    try:
+        connection = getConnection()
+        row = connection.execute("SELECT expires, body FROM responses WHERE key = ?",
+            (cacheKey(p_apiKey, p_endpoint, p_queryItems),)).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None or row[0] < time.time():
+        return None
+    return json.loads(zlib.decompress(row[1]).decode())
+
+
+def cachePut(p_apiKey, p_endpoint, p_queryItems, p_responseBody):
+    ttl = ttlForEndpoint(p_endpoint)
+    if ttl is None or p_responseBody is None:
+        return
+    body = zlib.compress(json.dumps(p_responseBody).encode())
+    try:
+        connection = getConnection()
+        connection.execute("INSERT OR REPLACE INTO responses (key, keyHash, expires, body) VALUES (?, ?, ?, ?)",
+            (cacheKey(p_apiKey, p_endpoint, p_queryItems), apiKeyHash(p_apiKey), time.time() + ttl, body))
+        connection.commit()
+    except sqlite3.Error:
+        pass
+
+
+def cacheInvalidate(p_apiKey):
+    # Drops all cached responses of an API key. Called after every successful write, even if this process does not
+    # use the cache, so that later runs that do use it do not read lists from before the write. A cache database
+    # is never created just to invalidate it
+    if not os.path.exists(CACHE_DB_PATH):
+        return
+    try:
+        connection = getConnection()
+        connection.execute("DELETE FROM responses WHERE keyHash = ?", (apiKeyHash(p_apiKey),))
+        connection.commit()
+    except sqlite3.Error:
+        pass
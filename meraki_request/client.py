@@ -0,0 +1,325 @@
+# Shared Meraki Dashboard API request layer.
+#
+# Most scripts in this repository carry their own copy of merakiRequest(), which builds a new
+# NoRebuildAuthSession for every call. That means a new TCP and TLS handshake for every request and
+# every page. This module keeps one long-lived session with a keep-alive connection pool for the whole
+# run, while keeping the same merakiRequest() signature and (success, errors, headers, body) contract.
+# Paginated lists are followed iteratively and can also be consumed page by page or item by item.
+# Every request takes a token from the host-wide rate limiter in ratelimit.py first. Organization-level lists can
+# optionally be served from the on-disk cache in cache.py. Identical GET requests within a run are coalesced by
+# memo.py. Per-operation metrics are collected in metrics.py.
+#
+# Usage, from a script in the root of this repository:
+#     from meraki_request import merakiRequest
+#
+# Usage, from a script in a subfolder of this repository:
+#     sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+#     from meraki_request import merakiRequest
+
+import os, time, atexit, threading
+
+from urllib.parse import urlencode
+from requests import Session, utils
+from requests.adapters import HTTPAdapter
+
+from .ratelimit import bucketForEndpoint, acquireToken, reportRateLimited, learnOrganizations
+from .cache import isCacheable, cacheGet, cachePut, cacheInvalidate
+from .memo import singleFlight, memoInvalidate
+from .metrics import operationName, recordRequest, recordRateLimited, recordPageFollowed, recordCacheHit, recordMemoHit
+
+class NoRebuildAuthSession(Session):
+    def rebuild_auth(self, prepared_request, response):
+        """
+        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
+        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
+        """
+
+API_MAX_RETRIES             = 3
+API_CONNECT_TIMEOUT         = 60
+API_TRANSMIT_TIMEOUT        = 60
+API_STATUS_RATE_LIMIT       = 429
+API_RETRY_DEFAULT_WAIT      = 3
+
+# Number of hosts to keep pools for (api.meraki.com plus the shards it redirects to) and number of
+# keep-alive connections kept open per host. Raise API_POOL_MAXSIZE if running many worker threads
+API_POOL_CONNECTIONS        = 10
+API_POOL_MAXSIZE            = 32
+
+API_BASE_URL_ENV_VAR_NAME   = "MERAKI_DASHBOARD_API_BASE_URL"
+API_BASE_URL                = os.environ.get(API_BASE_URL_ENV_VAR_NAME, "https://api.meraki.com/api/v1")
+
+SESSION                     = None
+SESSION_LOCK                = threading.Lock()
+
+
+def getSession():
+    # Returns the shared session of this process, creating it on first use
+    global SESSION
+
+    with SESSION_LOCK:
+        if SESSION is None:
+            session = NoRebuildAuthSession()
+            adapter = HTTPAdapter(pool_connections=API_POOL_CONNECTIONS, pool_maxsize=API_POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            SESSION = session
+    return SESSION
+
+
+def closeSession():
+    # Closes all pooled connections. A new session will be created if merakiRequest() is called again
+    global SESSION
+
+    with SESSION_LOCK:
+        if not SESSION is None:
+            SESSION.close()
+            SESSION = None
+
+atexit.register(closeSession)
+
+
+def setBaseUrl(p_baseUrl):
+    # Points all subsequent requests to a different API base URL, for example a local test server
+    global API_BASE_URL
+    API_BASE_URL = p_baseUrl.rstrip("/")
+
+
+def endpointFromUrl(p_url):
+    # Converts an absolute URL, like the ones in Link headers, to an endpoint relative to the base URL
+    splitLink = p_url.split("/api/v1", 1)
+    if len(splitLink) > 1:
+        return splitLink[1]
+    return p_url
+
+
+def nextPageEndpoint(p_responseHeaders):
+    # Returns the endpoint of the next page from the Link header of a response, or None if last page
+    if p_responseHeaders is None or not "Link" in p_responseHeaders:
+        return None
+    for link in utils.parse_header_links(p_responseHeaders["Link"]):
+        if link.get("rel") == "next":
+            return endpointFromUrl(link["url"])
+    return None
+
+
+def merakiRequestPage(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None,
+        p_requestBody=None, p_verbose=False, p_retry=0):
+    # Sends a single request, without following pagination links. Retries on rate limit
+    #returns success, errors, responseHeaders, responseBody
+
+    bearerString = "Bearer " + str(p_apiKey)
+    headers = {"Authorization": bearerString}
+    if not p_additionalHeaders is None:
+        headers.update(p_additionalHeaders)
+
+    query = ""
+    if not p_queryItems is None:
+        qArrayFix = {}
+        for item in p_queryItems:
+            if isinstance(p_queryItems[item], list) and not item.endswith("[]"):
+                qArrayFix["%s[]" % item] = p_queryItems[item]
+            else:
+                qArrayFix[item] = p_queryItems[item]
+        query = "?" + urlencode(qArrayFix, True)
+    url = API_BASE_URL + p_endpoint + query
+
+    verb = p_httpVerb.upper()
+
+    session = getSession()
+
+    verbs   = {
+        'DELETE'    : { 'function': session.delete, 'hasBody': False },
+        'GET'       : { 'function': session.get,    'hasBody': False },
+        'POST'      : { 'function': session.post,   'hasBody': True  },
+        'PUT'       : { 'function': session.put,    'hasBody': True  }
+    }
+
+    if not verb in verbs:
+        return False, None, None, None
+
+    bucket      = bucketForEndpoint(p_apiKey, p_endpoint)
+    operation   = operationName(verb, p_endpoint)
+
+    retry = p_retry
+    while True:
+        if retry > API_MAX_RETRIES:
+            if(p_verbose):
+                print("ERROR: Reached max retries")
+            return False, None, None, None
+
+        rateLimiterWait = acquireToken(bucket)
+
+        try:
+            if(p_verbose):
+                print(verb, url)
+
+            startTime = time.monotonic()
+
+            if verbs[verb]['hasBody'] and not p_requestBody is None:
+                r = verbs[verb]['function'](
+                    url,
+                    headers =   headers,
+                    json    =   p_requestBody,
+                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
+                )
+            else:
+                r = verbs[verb]['function'](
+                    url,
+                    headers =   headers,
+                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
+                )
+        except:
+            return False, None, None, None
+
+        recordRequest(operation, time.monotonic() - startTime, len(r.content), rateLimiterWait)
+
+        if(p_verbose):
+            print(r.status_code)
+
+        if r.status_code != API_STATUS_RATE_LIMIT:
+            break
+
+        retryInterval = API_RETRY_DEFAULT_WAIT
+        if "Retry-After" in r.headers:
+            retryInterval = r.headers["Retry-After"]
+
+        if(p_verbose):
+            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (retry+1, retryInterval))
+        reportRateLimited(bucket, int(retryInterval))
+        recordRateLimited(operation, int(retryInterval))
+        time.sleep(int(retryInterval))
+        retry += 1
+
+    success         = r.status_code in range (200, 299)
+    errors          = None
+    responseHeaders = r.headers
+    responseBody    = None
+
+    if success and verb != "GET":
+        cacheInvalidate(p_apiKey)
+        memoInvalidate()
+
+    try:
+        rjson = r.json()
+    except:
+        rjson = None
+
+    if not rjson is None:
+        if "errors" in rjson:
+            errors = rjson["errors"]
+            if(p_verbose):
+                print(errors)
+        else:
+            responseBody = rjson
+
+    if success and verb == "GET":
+        learnOrganizations(p_endpoint, responseBody)
+
+    return success, errors, responseHeaders, responseBody
+
+
+def merakiRequestPages(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None,
+        p_requestBody=None, p_verbose=False, p_retry=0):
+    # Generator that follows Link: rel=next headers iteratively, yielding every page as it arrives.
+    # Stops after the first unsuccessful page
+    #yields success, errors, responseHeaders, responseBody
+
+    endpoint    = p_endpoint
+    queryItems  = p_queryItems
+    retry       = p_retry
+
+    while not endpoint is None:
+        success, errors, responseHeaders, responseBody = merakiRequestPage(p_apiKey, p_httpVerb, endpoint,
+            p_additionalHeaders=p_additionalHeaders, p_queryItems=queryItems, p_requestBody=p_requestBody,
+            p_verbose=p_verbose, p_retry=retry)
+
+        yield success, errors, responseHeaders, responseBody
+
+        if not success:
+            return
+
+        endpoint = nextPageEndpoint(responseHeaders)
+        if not endpoint is None:
+            recordPageFollowed(operationName(p_httpVerb, p_endpoint))
+            if(p_verbose):
+                print("Next page:", endpoint)
+
+        # The next page link already includes the query string of the original request
+        queryItems  = None
+        retry       = 0
+
+
+def merakiRequestItems(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None,
+        p_requestBody=None, p_verbose=False):
+    # Generator that yields the individual items of a paginated list endpoint, one page in memory at a time.
+    # Use merakiRequestPages() instead if the caller needs to know whether a page failed
+    for success, errors, responseHeaders, responseBody in merakiRequestPages(p_apiKey, p_httpVerb, p_endpoint,
+            p_additionalHeaders=p_additionalHeaders, p_queryItems=p_queryItems, p_requestBody=p_requestBody,
+            p_verbose=p_verbose):
+        if not success or responseBody is None:
+            continue
+        if isinstance(responseBody, list):
+            for item in responseBody:
+                yield item
+        else:
+            yield responseBody
+
+
+def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None,
+        p_requestBody=None, p_verbose=False, p_retry=0):
+    # Collects all pages of a request into a single response body, appending in place. Identical GET requests
+    # are sent only once, see memo.py
+    #returns success, errors, responseHeaders, responseBody
+
+    if p_httpVerb.upper() != "GET":
+        return merakiRequestCollect(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=p_additionalHeaders,
+            p_queryItems=p_queryItems, p_requestBody=p_requestBody, p_verbose=p_verbose, p_retry=p_retry)
+
+    result, flagShared = singleFlight(p_apiKey, p_endpoint, p_additionalHeaders, p_queryItems,
+        lambda: merakiRequestCollect(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=p_additionalHeaders,
+            p_queryItems=p_queryItems, p_requestBody=p_requestBody, p_verbose=p_verbose, p_retry=p_retry))
+
+    if flagShared:
+        recordMemoHit(operationName(p_httpVerb, p_endpoint))
+        if(p_verbose):
+            print("GET", p_endpoint, "(shared)")
+
+    return result
+
+
+def merakiRequestCollect(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None,
+        p_requestBody=None, p_verbose=False, p_retry=0):
+    #returns success, errors, responseHeaders, responseBody
+    flagCacheable = isCacheable(p_httpVerb, p_endpoint)
+    if flagCacheable:
+        cachedBody = cacheGet(p_apiKey, p_endpoint, p_queryItems)
+        if not cachedBody is None:
+            learnOrganizations(p_endpoint, cachedBody)
+            recordCacheHit(operationName(p_httpVerb, p_endpoint))
+            if(p_verbose):
+                print("GET", p_endpoint, "(cached)")
+            return True, None, None, cachedBody
+
+    success         = False
+    errors          = None
+    responseHeaders = None
+    responseBody    = None
+    isFirstPage     = True
+
+    for success, errors, responseHeaders, pageBody in merakiRequestPages(p_apiKey, p_httpVerb, p_endpoint,
+            p_additionalHeaders=p_additionalHeaders, p_queryItems=p_queryItems, p_requestBody=p_requestBody,
+            p_verbose=p_verbose, p_retry=p_retry):
+        if not success:
+            if not isFirstPage:
+                responseBody = None
+            break
+        if isFirstPage:
+            responseBody = pageBody
+            isFirstPage  = False
+        elif isinstance(responseBody, list) and isinstance(pageBody, list):
+            responseBody.extend(pageBody)
+
+    if flagCacheable and success:
+        cachePut(p_apiKey, p_endpoint, p_queryItems, responseBody)
+
+    return success, errors, responseHeaders, responseBody
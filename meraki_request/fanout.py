@@ -0,0 +1,84 @@
+# Bounded concurrency fan-out engine for per-network request loops.
+#
+# Many scripts issue one or more GET requests per network, one at a time, so a large organization spends most
+# of its run time waiting for round trips. fanOut() runs a list of jobs concurrently on an asyncio event loop,
+# with at most p_maxConcurrency requests in flight, and returns the results keyed by network or device.
+#
+# Requests are executed through the shared session of client.py on a thread pool, so they reuse its keep-alive
+# connections and take their tokens from the host-wide rate limiter. Concurrency therefore only removes idle
+# time between requests; it does not raise the request rate above the organization's budget.
+#
+# A job is a dictionary with the following keys:
+#     key       : Key to group results by, typically a network ID or device serial
+#     label     : Name of the result within its group, for example "vlans"
+#     function  : Function to call. Usually one of the API wrapper functions of the calling script
+#     args      : Optional. Tuple of positional arguments for function
+#     kwargs    : Optional. Dictionary of keyword arguments for function
+#
+# Example:
+#     jobs = []
+#     for net in networks:
+#         jobs.append({"key": net["id"], "label": "vlans", "function": getNetworkApplianceVlans,
+#             "args": (apiKey, net["id"])})
+#     results = fanOut(jobs)
+#     success, errors, allVlans = results[net["id"]]["vlans"]
+#
+# Callers that want to act on every result as soon as it arrives, for example to commit it to a database so that
+# an interrupted run can resume, can pass p_onResult. It is called as p_onResult(job, result) in the calling
+# thread, one job at a time, in order of completion. Callers that handle every result there, for example large
+# responses written to a database as they arrive, can pass p_keepResults=False, so that results are not kept in
+# memory until all jobs have completed. fanOut() then returns an empty dictionary.
+
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import API_POOL_MAXSIZE
+
+FANOUT_DEFAULT_CONCURRENCY  = 10
+
+
+async def fanOutAsync(p_jobs, p_maxConcurrency=FANOUT_DEFAULT_CONCURRENCY, p_verbose=False, p_onResult=None,
+        p_keepResults=True):
+    # Awaitable version of fanOut(), for callers that already run an event loop
+    #returns {key: {label: function return value}}. Jobs that raised an exception have value None
+
+    maxConcurrency  = max(1, min(p_maxConcurrency, API_POOL_MAXSIZE))
+    loop            = asyncio.get_running_loop()
+    semaphore       = asyncio.Semaphore(maxConcurrency)
+    results         = {}
+
+    def callJob(job):
+        return job["function"](*job.get("args", ()), **job.get("kwargs", {}))
+
+    async def runJob(job, executor):
+        async with semaphore:
+            try:
+                result = await loop.run_in_executor(executor, callJob, job)
+            except Exception as e:
+                if p_verbose:
+                    print('ERROR: Job "%s" for "%s" failed: %s' % (job["label"], job["key"], e))
+                result = None
+        return job, result
+
+    with ThreadPoolExecutor(max_workers=maxConcurrency) as executor:
+        tasks = [runJob(job, executor) for job in p_jobs]
+        for task in asyncio.as_completed(tasks):
+            job, result = await task
+            if p_keepResults:
+                if not job["key"] in results:
+                    results[job["key"]] = {}
+                results[job["key"]][job["label"]] = result
+            if not p_onResult is None:
+                p_onResult(job, result)
+
+    return results
+
+
+def fanOut(p_jobs, p_maxConcurrency=FANOUT_DEFAULT_CONCURRENCY, p_verbose=False, p_onResult=None,
+        p_keepResults=True):
+    # Runs all jobs with bounded concurrency and blocks until they have completed
+    #returns {key: {label: function return value}}. Jobs that raised an exception have value None
+    if len(p_jobs) == 0:
+        return {}
+    return asyncio.run(fanOutAsync(p_jobs, p_maxConcurrency, p_verbose, p_onResult, p_keepResults))
@@ -0,0 +1,122 @@
+# Single-flight de-duplication and per-run memo of identical GET requests.
+#
+# Scripts often request the same resource more than once in a run, for example the settings of a configuration
+# template once for every network bound to it. merakiRequest() coalesces identical GET requests: if the same
+# request is already in flight in another thread, the caller waits for it and gets a copy of its response instead
+# of sending a second one. This is always on, since the response could not be any fresher than the one in flight.
+#
+# When the memo is enabled, successful responses are also kept in memory for the rest of the run, so that
+# repeated GETs are answered without a network call. Any successful POST, PUT or DELETE request clears the memo,
+# since it may have changed any of the memoized resources. Endpoints in MEMO_EXCLUDED_ENDPOINTS, whose responses
+# are expected to change on their own, like the status of action batches, are never memoized. Enable the memo
+# from a script by calling enableMemo(). Since every successful response is kept until the memo is cleared, it
+# does not suit scripts that fetch many large responses, like client lists or traffic histories.
+
+import re, copy, threading
+
+from urllib.parse import urlencode
+
+MEMO_ENABLED                = False
+
+MEMO_EXCLUDED_ENDPOINTS     = [
+                                r"^/organizations/[^/]+/actionBatches",
+                                r"^/organizations/[^/]+/firmware/upgrades",
+                                r"/liveTools/"
+                            ]
+
+MEMO_EXCLUDED_REGEXES       = [re.compile(pattern) for pattern in MEMO_EXCLUDED_ENDPOINTS]
+
+MEMO                        = {}
+IN_FLIGHT                   = {}
+MEMO_LOCK                   = threading.Lock()
+
+# Incremented on every write. Responses of requests that were sent before a write are not memoized
+MEMO_GENERATION             = 0
+
+
+def enableMemo():
+    global MEMO_ENABLED
+    MEMO_ENABLED = True
+
+
+def disableMemo():
+    global MEMO_ENABLED
+    MEMO_ENABLED = False
+    clearMemo()
+
+
+def clearMemo():
+    with MEMO_LOCK:
+        MEMO.clear()
+
+
+def memoInvalidate():
+    # Called after every successful write
+    global MEMO_GENERATION
+    with MEMO_LOCK:
+        MEMO_GENERATION += 1
+        MEMO.clear()
+
+
+def memoKey(p_apiKey, p_endpoint, p_additionalHeaders, p_queryItems):
+    query = ""
+    if not p_queryItems is None:
+        query = urlencode(sorted(p_queryItems.items()), True)
+    headers = ""
+    if not p_additionalHeaders is None:
+        headers = urlencode(sorted(p_additionalHeaders.items()))
+    return (str(p_apiKey), p_endpoint, query, headers)
+
+
+def isMemoizable(p_endpoint):
+    for regex in MEMO_EXCLUDED_REGEXES:
+        if regex.search(p_endpoint):
+            return False
+    return True
+
+
+def copyResult(p_result):
+    # Callers often modify the bodies they receive, so every caller gets its own copy
+    success, errors, headers, body = p_result
+    return success, copy.deepcopy(errors), headers, copy.deepcopy(body)
+
+
+def singleFlight(p_apiKey, p_endpoint, p_additionalHeaders, p_queryItems, p_requestFunction):
+    # Returns the memoized result of a GET request, the result of an identical request already in flight, or
+    # the result of calling p_requestFunction(). Second return value is True if no request was sent
+    #returns (success, errors, responseHeaders, responseBody), flagShared
+    key                 = memoKey(p_apiKey, p_endpoint, p_additionalHeaders, p_queryItems)
+    flagMemoizable      = MEMO_ENABLED and isMemoizable(p_endpoint)
+
+    with MEMO_LOCK:
+        if flagMemoizable and key in MEMO:
+            return copyResult(MEMO[key]), True
+        if key in IN_FLIGHT:
+            flight = IN_FLIGHT[key]
+            flight["waiters"] += 1
+            isLeader = False
+        else:
+            flight = {"event": threading.Event(), "waiters": 0, "result": (False, None, None, None)}
+            IN_FLIGHT[key] = flight
+            isLeader = True
+        generation = MEMO_GENERATION
+
+    if not isLeader:
+        flight["event"].wait()
+        return copyResult(flight["result"]), True
+
+    result = (False, None, None, None)
+    try:
+        result = p_requestFunction()
+    finally:
+        with MEMO_LOCK:
+            del IN_FLIGHT[key]
+            flagStore = flagMemoizable and result[0] and generation == MEMO_GENERATION
+            if flight["waiters"] > 0 or flagStore:
+                # The leader's caller may modify its result, so waiters and the memo share a private copy
+                flight["result"] = copyResult(result)
+            if flagStore:
+                MEMO[key] = flight["result"]
+        flight["event"].set()
+
+    return result, False
@@ -0,0 +1,200 @@
+# Per-operation instrumentation of the shared request layer.
+#
+# merakiRequest() records, for every operation: number of requests sent, request latency, bytes received,
+# pagination pages followed, 429 responses, time slept because of Retry-After headers, time spent waiting for
+# the host-wide rate limiter, cache hits and responses shared by identical requests (memo hits). An operation is the HTTP verb and the endpoint with IDs replaced
+# by "{id}", for example "GET /networks/{id}/appliance/vlans". Latency percentiles are computed from a uniform random
+# sample of METRICS_LATENCY_SAMPLES latencies per operation, so that memory use stays constant in scripts that run
+# forever.
+#
+# To dump the collected metrics when the script exits, set OS environment variable MERAKI_METRICS_FILE to a file
+# path, or call enableMetricsExport(). Files ending in ".prom" are written in Prometheus text exposition format,
+# suitable for the node_exporter textfile collector. Any other file is written as JSON.
+
+import os, re, json, random, atexit, threading
+
+METRICS_FILE_ENV_VAR_NAME   = "MERAKI_METRICS_FILE"
+
+METRICS_EXPORT_PATH         = os.environ.get(METRICS_FILE_ENV_VAR_NAME, None)
+METRICS_EXPORT_FORMAT       = None
+
+METRICS_PERCENTILES         = [50, 95, 99]
+
+# Maximum number of latencies kept per operation for percentiles
+METRICS_LATENCY_SAMPLES     = 1024
+
+NAME_SEGMENT_REGEX          = re.compile(r"^[A-Za-z]+$")
+
+METRICS                     = {}
+METRICS_LOCK                = threading.Lock()
+
+
+def operationName(p_httpVerb, p_endpoint):
+    # Path segments that are not plain words are IDs, serials, MAC addresses or numbers
+    segments = []
+    for segment in p_endpoint.split("?")[0].split("/"):
+        if segment == "" or NAME_SEGMENT_REGEX.match(segment):
+            segments.append(segment)
+        else:
+            segments.append("{id}")
+    return "%s %s" % (p_httpVerb.upper(), "/".join(segments))
+
+
+def getOperationMetrics(p_operation):
+    # Must be called with METRICS_LOCK held
+    if not p_operation in METRICS:
+        METRICS[p_operation] = {
+            "requests"              : 0,
+            "latencies"             : [],
+            "latencySecondsTotal"   : 0,
+            "bytesReceived"         : 0,
+            "pagesFollowed"         : 0,
+            "rateLimited"           : 0,
+            "retryAfterSeconds"     : 0,
+            "rateLimiterWaitSeconds": 0,
+            "cacheHits"             : 0,
+            "memoHits"              : 0
+        }
+    return METRICS[p_operation]
+
+
+def recordRequest(p_operation, p_latency, p_bytesReceived, p_rateLimiterWait=0):
+    with METRICS_LOCK:
+        operation = getOperationMetrics(p_operation)
+        operation["requests"]               += 1
+        operation["bytesReceived"]          += p_bytesReceived
+        operation["rateLimiterWaitSeconds"] += p_rateLimiterWait
+        operation["latencySecondsTotal"]    += p_latency
+        # Reservoir sampling: every latency recorded so far has the same chance of being in the sample
+        if len(operation["latencies"]) < METRICS_LATENCY_SAMPLES:
+            operation["latencies"].append(p_latency)
+        else:
+            index = random.randrange(operation["requests"])
+            if index < METRICS_LATENCY_SAMPLES:
+                operation["latencies"][index] = p_latency
+
+
+def recordRateLimited(p_operation, p_retryAfter):
+    with METRICS_LOCK:
+        operation = getOperationMetrics(p_operation)
+        operation["rateLimited"]        += 1
+        operation["retryAfterSeconds"]  += p_retryAfter
+
+
+def recordPageFollowed(p_operation):
+    with METRICS_LOCK:
+        getOperationMetrics(p_operation)["pagesFollowed"] += 1
+
+
+def recordCacheHit(p_operation):
+    with METRICS_LOCK:
+        getOperationMetrics(p_operation)["cacheHits"] += 1
+
+
+def recordMemoHit(p_operation):
+    with METRICS_LOCK:
+        getOperationMetrics(p_operation)["memoHits"] += 1
+
+
+def percentile(p_sortedValues, p_percentile):
+    # Nearest-rank percentile
+    if len(p_sortedValues) == 0:
+        return None
+    rank = max(1, int(-(-p_percentile * len(p_sortedValues) // 100)))
+    return p_sortedValues[rank - 1]
+
+
+def getMetrics():
+    # Returns a summary of the metrics collected so far, keyed by operation
+    result = {}
+    with METRICS_LOCK:
+        for name in METRICS:
+            operation   = METRICS[name]
+            latencies   = sorted(operation["latencies"])
+            summary     = {}
+            for key in operation:
+                if key != "latencies":
+                    summary[key] = operation[key]
+            for p in METRICS_PERCENTILES:
+                summary["latencySecondsP%s" % p] = percentile(latencies, p)
+            result[name] = summary
+    return result
+
+
+def resetMetrics():
+    with METRICS_LOCK:
+        METRICS.clear()
+
+
+def formatJson(p_metrics):
+    return json.dumps(p_metrics, indent=4, sort_keys=True)
+
+
+def formatPrometheus(p_metrics):
+    counters = [
+        ("meraki_api_requests_total",                   "requests",                 "Requests sent to the Dashboard API"),
+        ("meraki_api_response_bytes_total",             "bytesReceived",            "Response bytes received"),
+        ("meraki_api_pages_followed_total",             "pagesFollowed",            "Pagination links followed"),
+        ("meraki_api_rate_limited_total",               "rateLimited",              "Responses with status 429"),
+        ("meraki_api_retry_after_seconds_total",        "retryAfterSeconds",        "Seconds slept because of Retry-After"),
+        ("meraki_api_rate_limiter_wait_seconds_total",  "rateLimiterWaitSeconds",   "Seconds waited for the host-wide rate limiter"),
+        ("meraki_api_cache_hits_total",                 "cacheHits",                "Responses served from the on-disk cache"),
+        ("meraki_api_memo_hits_total",                  "memoHits",                 "Responses shared with an identical request of the same run")
+    ]
+
+    lines = []
+    for metricName, key, description in counters:
+        lines.append("# HELP %s %s" % (metricName, description))
+        lines.append("# TYPE %s counter" % metricName)
+        for operation in sorted(p_metrics):
+            lines.append('%s{operation="%s"} %s' % (metricName, operation, p_metrics[operation][key]))
+
+    metricName = "meraki_api_request_latency_seconds"
+    lines.append("# HELP %s Dashboard API request latency" % metricName)
+    lines.append("# TYPE %s summary" % metricName)
+    for operation in sorted(p_metrics):
+        for p in METRICS_PERCENTILES:
+            value = p_metrics[operation]["latencySecondsP%s" % p]
+            if not value is None:
+                lines.append('%s{operation="%s",quantile="%s"} %s' % (metricName, operation, p / 100, value))
+        lines.append('%s_sum{operation="%s"} %s' % (metricName, operation, p_metrics[operation]["latencySecondsTotal"]))
+        lines.append('%s_count{operation="%s"} %s' % (metricName, operation, p_metrics[operation]["requests"]))
+
+    return "\n".join(lines) + "\n"
+
+
+def writeMetrics(p_path, p_format=None):
+    # Writes the collected metrics to a file. Format is "json" or "prometheus". If omitted, it is chosen by the
+    # file extension. The file is replaced atomically, so that collectors never read a partial file
+    metricsFormat = p_format
+    if metricsFormat is None:
+        metricsFormat = "prometheus" if p_path.endswith(".prom") else "json"
+
+    metrics = getMetrics()
+    if metricsFormat == "prometheus":
+        text = formatPrometheus(metrics)
+    else:
+        text = formatJson(metrics)
+
+    tempPath = "%s.%s.tmp" % (p_path, os.getpid())
+    with open(tempPath, "w") as file:
+        file.write(text)
+    os.replace(tempPath, p_path)
+
+
+def enableMetricsExport(p_path, p_format=None):
+    # Dump metrics to p_path when the script exits
+    global METRICS_EXPORT_PATH, METRICS_EXPORT_FORMAT
+    METRICS_EXPORT_PATH     = p_path
+    METRICS_EXPORT_FORMAT   = p_format
+
+
+def exportMetricsAtExit():
+    if METRICS_EXPORT_PATH is None:
+        return
+    try:
+        writeMetrics(METRICS_EXPORT_PATH, METRICS_EXPORT_FORMAT)
+    except Exception as e:
+        print("ERROR: Unable to write metrics file: %s" % e)
+
+atexit.register(exportMetricsAtExit)
@@ -0,0 +1,102 @@
+# Dry-run API call budget planner for bulk scripts.
+#
+# Bulk scripts can hold an organization's request budget for a long time, and it is hard to guess how long before
+# running them. Scripts that support it accept command line argument --plan. In plan mode a script only fetches
+# cheap organization-level lists, counts the calls a real run would make per phase and prints the plan instead of
+# changing anything. The expected duration is computed at the request rate of the host-wide rate limiter.
+#
+# Phases whose call count depends on data that is not available from organization-level lists, like the number of
+# VLANs per network, are marked as estimates, together with the assumption they are based on.
+#
+# Example:
+#     flag_plan, argv = parsePlanArgument(argv)
+#     ...
+#     if flag_plan:
+#         plan = createPlan("tag_all_ports.py")
+#         addPlanPhase(plan, "Organization lists", 3)
+#         addPlanPhase(plan, "Fetch switch ports", len(switches))
+#         addPlanPhase(plan, "Update switch ports", maxPorts, p_assumption="every port needs to be updated")
+#         printPlan(plan)
+
+import math
+
+from . import ratelimit
+
+PLAN_ARGUMENT               = "--plan"
+
+# Phases that together account for at least this share of all calls are reported as dominant
+PLAN_DOMINANT_SHARE         = 0.8
+
+
+def parsePlanArgument(p_argv):
+    # Returns (True if --plan is present, remaining arguments), so that scripts can pass the remaining arguments
+    # on to getopt unchanged
+    return PLAN_ARGUMENT in p_argv, [arg for arg in p_argv if arg != PLAN_ARGUMENT]
+
+
+def createPlan(p_scriptName):
+    return {"script": p_scriptName, "phases": []}
+
+
+def addPlanPhase(p_plan, p_phaseName, p_calls, p_assumption=None):
+    # Adds the projected number of calls of a phase. Set p_assumption to a short description of what the
+    # number is based on, if it is an estimate rather than an exact count
+    p_plan["phases"].append({
+        "name"          : p_phaseName,
+        "calls"         : int(math.ceil(p_calls)),
+        "assumption"    : p_assumption
+    })
+
+
+def planTotalCalls(p_plan):
+    return sum(phase["calls"] for phase in p_plan["phases"])
+
+
+def planMinutes(p_plan, p_requestsPerSecond=None):
+    # Expected duration in minutes when the whole run is limited by the request rate
+    requestsPerSecond = p_requestsPerSecond
+    if requestsPerSecond is None:
+        requestsPerSecond = ratelimit.RATE_LIMIT_REQUESTS_PER_SECOND
+    return int(math.ceil(planTotalCalls(p_plan) / requestsPerSecond / 60))
+
+
+def dominantPhases(p_plan):
+    # Returns the largest phases that together account for PLAN_DOMINANT_SHARE of all calls
+    total   = planTotalCalls(p_plan)
+    result  = []
+    covered = 0
+    for phase in sorted(p_plan["phases"], key=lambda x: x["calls"], reverse=True):
+        if total == 0 or covered >= total * PLAN_DOMINANT_SHARE:
+            break
+        result.append(phase)
+        covered += phase["calls"]
+    return result
+
+
+def printPlan(p_plan, p_requestsPerSecond=None):
+    requestsPerSecond = p_requestsPerSecond
+    if requestsPerSecond is None:
+        requestsPerSecond = ratelimit.RATE_LIMIT_REQUESTS_PER_SECOND
+
+    total       = planTotalCalls(p_plan)
+    minutes     = planMinutes(p_plan, requestsPerSecond)
+    dominant    = [phase["name"] for phase in dominantPhases(p_plan)]
+
+    print('\nAPI call plan for %s (dry run, no changes made)\n' % p_plan["script"])
+    print("%-40s %10s %7s" % ("Phase", "Calls", "Share"))
+    for phase in p_plan["phases"]:
+        share = 0 if total == 0 else 100 * phase["calls"] / total
+        marker = "~" if not phase["assumption"] is None else " "
+        print("%-40s %9s%s %6.1f%%" % (phase["name"], "{:,}".format(phase["calls"]), marker, share))
+
+    print("\nProjected calls: {:,}".format(total))
+    print("Expected duration: about %s minute%s at %s requests per second" % (minutes, "" if minutes == 1 else "s",
+        requestsPerSecond))
+    if len(dominant) > 0:
+        print("Dominant phases: %s" % ", ".join(dominant))
+
+    estimates = [phase for phase in p_plan["phases"] if not phase["assumption"] is None]
+    if len(estimates) > 0:
+        print("\n~ Estimated phases:")
+        for phase in estimates:
+            print("    %s: %s" % (phase["name"], phase["assumption"]))
@@ -0,0 +1,178 @@
+# Host-wide token bucket rate limiter for the Meraki Dashboard API.
+#
+# The Dashboard API request budget is per organization, but every script only reacts to its own 429 responses.
+# When several scripts run on the same host at the same time, they stampede into 429 storms and backoff sleeps.
+# This module keeps one token bucket per organization in a small SQLite database shared by all processes on
+# the host, so that concurrent scripts split the budget between them instead. merakiRequest() acquires a token
+# from the bucket before every request.
+#
+# Requests to endpoints under /organizations/{organizationId} are charged to that organization. Requests to
+# /networks/{networkId} and /devices/{serial} are charged to the organization the network or device belongs to.
+# The organization of networks and devices is learned from the organization-level lists scripts fetch anyway,
+# like the networks, devices and inventory of an organization, so it costs no additional requests and works for
+# scripts that loop over several organizations. Requests for networks or devices that have not been seen in such a
+# list are charged to the organization set with setOrganization(), or to a bucket per API key if none has been set.
+
+import os, re, time, sqlite3, hashlib, tempfile, threading
+
+RATE_LIMIT_REQUESTS_PER_SECOND  = 10
+RATE_LIMIT_BURST_SIZE           = 10
+RATE_LIMIT_DB_TIMEOUT           = 30
+
+RATE_LIMIT_DB_ENV_VAR_NAME      = "MERAKI_RATE_LIMIT_DB"
+RATE_LIMIT_DISABLE_ENV_VAR_NAME = "MERAKI_RATE_LIMIT_DISABLED"
+
+RATE_LIMIT_DB_PATH              = os.environ.get(RATE_LIMIT_DB_ENV_VAR_NAME,
+                                    os.path.join(tempfile.gettempdir(), "meraki_rate_limit.sqlite"))
+RATE_LIMIT_ENABLED              = os.environ.get(RATE_LIMIT_DISABLE_ENV_VAR_NAME, None) is None
+
+CURRENT_ORGANIZATION_ID         = None
+
+ORGANIZATION_ENDPOINT_REGEX     = re.compile(r"^/organizations/([^/?]+)")
+NETWORK_ENDPOINT_REGEX          = re.compile(r"^/networks/([^/?]+)")
+DEVICE_ENDPOINT_REGEX           = re.compile(r"^/devices/([^/?]+)")
+
+# Organization-level lists whose items identify networks by "id", and devices by "serial" and "networkId"
+ORGANIZATION_NETWORKS_REGEX     = re.compile(r"^/organizations/([^/?]+)/networks/?(\?|$)")
+ORGANIZATION_DEVICES_REGEX      = re.compile(r"^/organizations/([^/?]+)/(devices|inventoryDevices|inventory/devices)")
+
+# Organization IDs of the networks and devices seen in responses, keyed by networkId and serial
+NETWORK_ORGANIZATIONS           = {}
+DEVICE_ORGANIZATIONS            = {}
+
+THREAD_DATA                     = threading.local()
+
+
+def setOrganization(p_organizationId):
+    # Sets the organization that requests for networks and devices of unknown organization are charged to
+    global CURRENT_ORGANIZATION_ID
+    CURRENT_ORGANIZATION_ID = None if p_organizationId is None else str(p_organizationId)
+
+
+def setRateLimit(p_requestsPerSecond, p_burstSize=None):
+    global RATE_LIMIT_REQUESTS_PER_SECOND, RATE_LIMIT_BURST_SIZE
+    RATE_LIMIT_REQUESTS_PER_SECOND = p_requestsPerSecond
+    if not p_burstSize is None:
+        RATE_LIMIT_BURST_SIZE = p_burstSize
+
+
+def setRateLimitEnabled(p_enabled):
+    global RATE_LIMIT_ENABLED
+    RATE_LIMIT_ENABLED = p_enabled
+
+
+def learnOrganizations(p_endpoint, p_responseBody):
+    # Records the organization of the networks and devices in a successful GET response, so that later requests
+    # for them are charged to the right organization
+    if p_responseBody is None:
+        return
+
+    match = ORGANIZATION_NETWORKS_REGEX.match(p_endpoint)
+    if not match is None and isinstance(p_responseBody, list):
+        for network in p_responseBody:
+            if isinstance(network, dict) and "id" in network:
+                NETWORK_ORGANIZATIONS[network["id"]] = match.group(1)
+        return
+
+    match = ORGANIZATION_DEVICES_REGEX.match(p_endpoint)
+    if not match is None and isinstance(p_responseBody, list):
+        for device in p_responseBody:
+            if not isinstance(device, dict):
+                continue
+            if device.get("serial", None) is not None:
+                DEVICE_ORGANIZATIONS[device["serial"]] = match.group(1)
+            if device.get("networkId", None) is not None:
+                NETWORK_ORGANIZATIONS[device["networkId"]] = match.group(1)
+        return
+
+    match = NETWORK_ENDPOINT_REGEX.match(p_endpoint)
+    if not match is None and isinstance(p_responseBody, dict) and "organizationId" in p_responseBody:
+        NETWORK_ORGANIZATIONS[match.group(1)] = str(p_responseBody["organizationId"])
+
+
+def bucketForEndpoint(p_apiKey, p_endpoint):
+    match = ORGANIZATION_ENDPOINT_REGEX.match(p_endpoint)
+    if not match is None:
+        return "org:%s" % match.group(1)
+    match = NETWORK_ENDPOINT_REGEX.match(p_endpoint)
+    if not match is None and match.group(1) in NETWORK_ORGANIZATIONS:
+        return "org:%s" % NETWORK_ORGANIZATIONS[match.group(1)]
+    match = DEVICE_ENDPOINT_REGEX.match(p_endpoint)
+    if not match is None and match.group(1) in DEVICE_ORGANIZATIONS:
+        return "org:%s" % DEVICE_ORGANIZATIONS[match.group(1)]
+    if not CURRENT_ORGANIZATION_ID is None:
+        return "org:%s" % CURRENT_ORGANIZATION_ID
+    # Never store API keys in the shared database, only a hash that tells them apart
+    return "key:%s" % hashlib.sha256(str(p_apiKey).encode()).hexdigest()[:16]
+
+
+def getConnection():
+    # SQLite connections cannot be shared between threads, so every thread opens its own
+    connection = getattr(THREAD_DATA, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(RATE_LIMIT_DB_PATH, timeout=RATE_LIMIT_DB_TIMEOUT, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        THREAD_DATA.connection = connection
+    return connection
+
+
+def updateBucket(p_bucket, p_cost, p_floor=None):
+    # Refills the bucket for the time elapsed since its last update and takes p_cost tokens from it, if available.
+    # If p_floor is set, the token count is lowered to at least that value, which makes all processes wait.
+    # Returns the number of seconds to wait before the tokens will be available, or 0 if they were taken
+    connection = getConnection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        row = connection.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (p_bucket,)).fetchone()
+        if row is None:
+            tokens = RATE_LIMIT_BURST_SIZE
+        else:
+            tokens = min(RATE_LIMIT_BURST_SIZE, row[0] + (now - row[1]) * RATE_LIMIT_REQUESTS_PER_SECOND)
+
+        if not p_floor is None:
+            tokens = min(tokens, p_floor)
+
+        wait = 0
+        if tokens >= p_cost:
+            tokens -= p_cost
+        else:
+            wait = (p_cost - tokens) / RATE_LIMIT_REQUESTS_PER_SECOND
+
+        connection.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+            (p_bucket, tokens, now))
+        connection.execute("COMMIT")
+    except:
+        connection.execute("ROLLBACK")
+        raise
+    return wait
+
+
+def acquireToken(p_bucket):
+    # Blocks until a request can be sent without exceeding the budget of the bucket.
+    # Returns the number of seconds spent waiting
+    if not RATE_LIMIT_ENABLED:
+        return 0
+
+    waited = 0
+    while True:
+        try:
+            wait = updateBucket(p_bucket, 1)
+        except sqlite3.Error:
+            # Never block requests because the shared database is unavailable
+            return waited
+        if wait <= 0:
+            return waited
+        time.sleep(wait)
+        waited += wait
+
+
+def reportRateLimited(p_bucket, p_retryAfter):
+    # Drains the bucket after a 429 response, so that every process sharing it backs off for p_retryAfter seconds
+    if not RATE_LIMIT_ENABLED:
+        return
+    try:
+        updateBucket(p_bucket, 0, p_floor=-float(p_retryAfter) * RATE_LIMIT_REQUESTS_PER_SECOND)
+    except sqlite3.Error:
+        pass
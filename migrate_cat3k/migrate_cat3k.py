@@ -48,7 +48,10 @@ General notes:
        name        
 '''
 
-import sys, getopt, requests, json, paramiko, re, time, datetime
+import sys, os, getopt, requests, json, paramiko, re, time, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meraki_request import ActionBatchEngine
 
 #SECTION: GLOBAL VARIABLES: MODIFY TO CHANGE SCRIPT BEHAVIOUR
 
@@ -66,11 +69,7 @@ LAST_MERAKI_REQUEST         = datetime.datetime.now()   #used by merakiRequestTh
 API_BASE_URL                = 'https://api.meraki.com/api/v0'
 API_BASE_URL_MEGA_PROXY     = 'https://api.meraki.com/api/v0'
 API_BASE_URL_NO_MEGA        = 'https://api.meraki.com/api/v0'
-ACTION_BATCH_QUEUE          = []
-
-#Max number of loops to try when waiting for action batches to complete and retry interval in seconds
-ABWAIT_MAX_LOOPS            = 20
-ABWAIT_RETRY_INTERVAL       = 2
+ACTION_BATCH_ENGINE         = None   #created on first use by getActionBatchEngine()
 
 #SECTION: Classes
       
@@ -492,91 +491,31 @@ def getInventory(p_apiKey, p_orgId):
     return(r.json())
         
         
-def createActionBatch (p_apiKey, p_orgId, p_actions):   
-    merakiRequestThrottler()
-    
-    payload = json.dumps(
-        {
-            'confirmed':True, 
-            'synchronous':False,
-            'actions': p_actions
-        }
-    )
-        
-    try:
-        r = requests.post( API_BASE_URL + '/organizations/%s/actionBatches' % p_orgId, data=payload, headers={'X-Cisco-Meraki-API-Key': p_apiKey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT))
-    except:
-        return None
+def getActionBatchEngine(p_apiKey, p_orgId):
+    #Action batches are submitted through the shared engine, which keeps several batches running concurrently
+    global ACTION_BATCH_ENGINE
+    if ACTION_BATCH_ENGINE is None:
+        ACTION_BATCH_ENGINE = ActionBatchEngine(p_apiKey, p_orgId)
+    return ACTION_BATCH_ENGINE
     
-    if 200 <= r.status_code < 300:
-        rjson = r.json()
-        return rjson['id']
-      
-    return None
-        
     
 def queueActionBatch (p_apiKey, p_orgId, p_action, p_forceCommit=False):
     #return success, batchId
-    global ACTION_BATCH_QUEUE
-    
+    engine = getActionBatchEngine(p_apiKey, p_orgId)
+    success = True
+    batchId = None
     if not p_action is None:
-        ACTION_BATCH_QUEUE.append(p_action)
-    queueLength = len(ACTION_BATCH_QUEUE)
-    if queueLength == 100 or (queueLength > 0 and p_forceCommit):
-        print('Committing action batch:')
-        print(ACTION_BATCH_QUEUE)
-        
-        batchId = createActionBatch (p_apiKey, p_orgId, ACTION_BATCH_QUEUE)        
-        ACTION_BATCH_QUEUE = []
-        
-        if not batchId is None:
-            return (True, batchId)
-        else:
-            return (False, None)
-    
-    return (True, None)
-    
-    
-def getActionBatches(p_apiKey, p_orgId):
-    merakiRequestThrottler()
-    try:
-        r = requests.get( API_BASE_URL + '/organizations/%s/actionBatches' % p_orgId, headers={'X-Cisco-Meraki-API-Key': p_apiKey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        print('ERROR 12: Unable to get action batches')
-        return(None)
-    
-    if r.status_code != requests.codes.ok:
-        return(None)
-    
-    return(r.json())
+        success, batchId = engine.addAction(p_action)
+    if p_forceCommit and success and batchId is None:
+        success, batchId = engine.flush()
+    if not batchId is None:
+        print('Submitted action batch with batchId %s' % batchId)
+    return (success, batchId)
     
     
 def waitForActionBatchesToComplete(p_apiKey, p_orgId, p_batchIds):
-    flag_waitSomeMore   = True
-    flag_batchHasFailed = False
-        
-    i = -1
-    while flag_waitSomeMore:
-        i += 1
-        if i >= ABWAIT_MAX_LOOPS:
-            break
-        flag_waitSomeMore   = False
-        actionBatches       = getActionBatches(p_apiKey, p_orgId)
-        #print(actionBatches)
-        for id in p_batchIds:
-            for record in actionBatches:
-                if record['id'] == id:
-                    if not record['status']['completed'] and not record['status']['failed']:
-                        flag_waitSomeMore = True
-                        break
-                    if record['status']['failed']:
-                        print('ERROR 29: Action batch with batchId %s has failed' % id)
-                        if 'errors' in record['status']:
-                            print(record['status']['errors'])
-                        return False
-        if flag_waitSomeMore:
-            time.sleep(ABWAIT_RETRY_INTERVAL)                        
-    return True
+    #Waits for all batches submitted so far. Failed batches are printed as soon as they are detected
+    return getActionBatchEngine(p_apiKey, p_orgId).wait()
     
     
 def sendHostnameToQueue(p_apiKey, p_orgId, p_networkId, p_hostname, p_increment, p_serial):
@@ -592,7 +531,7 @@ def sendHostnameToQueue(p_apiKey, p_orgId, p_networkId, p_hostname, p_increment,
             'name'    : name
         }
         action = {
-            'resource'  : '/networks/' + p_networkId + '/devices/' + p_serial,
+            'resource'  : '/devices/' + p_serial,
             'operation' : 'update',
             'body'      : body
         }    
@@ -644,7 +583,7 @@ def sendPortConfigToQueue(p_apiKey, p_orgId, p_portConfig, p_serial, p_copperCou
                 body['vlan']    = port['config']['native']
                                        
         action = {
-            'resource'  : '/devices/' + p_serial + '/switchPorts/' + str(port['number']),
+            'resource'  : '/devices/' + p_serial + '/switch/ports/' + str(port['number']),
             'operation' : 'update',
             'body'      : body
         }    
@@ -763,9 +702,9 @@ def main(argv):
                 break
         if not networkFound:
             body = {
-                'name'      : net['name'],
-                'type'      : 'switch',
-                'tags'      : 'migrate_cat3k'
+                'name'          : net['name'],
+                'productTypes'  : ['switch'],
+                'tags'          : ['migrate_cat3k']
             }
             action = {
                 'resource'  : '/organizations/' + orgId + '/networks',
@@ -835,7 +774,7 @@ def main(argv):
                             
         if not flag_deviceFoundAndClaimed:
             body = {
-                'serial'    : device['serial']
+                'serials'   : [device['serial']]
             }
             action = {
                 'resource'  : '/networks/' + device['networkId'] + '/devices',
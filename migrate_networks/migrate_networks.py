@@ -23,15 +23,17 @@ Only the following configuration elements will be copied:
         MR traffic shaping rules
         
 Syntax, Windows:
-    python migrate_networks.py [-k <api_key>] [-c <config_file>] 
+    python migrate_networks.py [-k <api_key>] [-c <config_file>] [--plan]
     
 Syntax, Linux and Mac:
-    python3 migrate_networks.py [-k <api_key>] [-c <config_file>]
+    python3 migrate_networks.py [-k <api_key>] [-c <config_file>] [--plan]
     
 Optional parameters:
     -k <api_key>        Your Meraki Dashboard API key. If omitted, one will be loaded from
                         environment variable MERAKI_DASHBOARD_API_KEY
     -c <config_file>    Path to the configuration file to use. Default is "./config.yaml"         
+    --plan              Do not change anything. Print how many API calls the enabled tasks would
+                        make and how long that would take instead
               
 Example:
     Copy all networks from organization "Big Industries Inc" to organization "Parent company"
@@ -62,141 +64,14 @@ Linux and Mac:
 ### Code to interact with Meraki Dashboard API generated using this script:
 ### https://github.com/mpapazog/rogue_meraki_python_sdk
 
-import time, ipaddress
+import sys, os, time, ipaddress
 
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
-
-API_MAX_RETRIES             = 3
-API_CONNECT_TIMEOUT         = 60
-API_TRANSMIT_TIMEOUT        = 60
-API_STATUS_RATE_LIMIT       = 429
-API_RETRY_DEFAULT_WAIT      = 3
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meraki_request import merakiRequest, enableMemo
+from meraki_request import parsePlanArgument, createPlan, addPlanPhase, printPlan
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE        = True
-
-API_BASE_URL                = "https://api.meraki.com/api/v1"
-
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-        
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        qArrayFix = {}
-        for item in p_queryItems:
-            if isinstance(p_queryItems[item], list):
-                qArrayFix["%s[]" % item] = p_queryItems[item]
-            else:
-                qArrayFix[item] = p_queryItems[item]
-        query = "?" + urlencode(qArrayFix, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-    
-    verbs   = {
-        'DELETE'    : { 'function': session.delete, 'hasBody': False },
-        'GET'       : { 'function': session.get,    'hasBody': False },
-        'POST'      : { 'function': session.post,   'hasBody': True  },
-        'PUT'       : { 'function': session.put,    'hasBody': True  }
-    }
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-            
-        if verb in verbs:
-            if verbs[verb]['hasBody'] and not p_requestBody is None:
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-            else: 
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        retryInterval = API_RETRY_DEFAULT_WAIT
-        if "Retry-After" in r.headers:
-            retryInterval = r.headers["Retry-After"]
-        if "retry-after" in r.headers:
-            retryInterval = r.headers["retry-after"]
-        
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, retryInterval))
-        time.sleep(int(retryInterval))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
     
 # getOrganizations
 #
@@ -920,6 +795,11 @@ def getNetworkApplianceTrafficShapingRules(apiKey, networkId):
 
 import sys, getopt, os, datetime, yaml, re
 
+#Used by --plan for counts that cannot be known without fetching the configuration of every network
+PLAN_VLANS_PER_NETWORK          = 4
+PLAN_STATIC_ROUTES_PER_NETWORK  = 2
+PLAN_SSIDS_PER_NETWORK          = 15
+
 def log(text, filePath=None):
     logString = "%s -- %s" % (str(datetime.datetime.now())[:19], text)
     print(logString)
@@ -1055,10 +935,78 @@ def replaceObjectsAndGroups(rawString, sourceObjects, sourceGroups, targetObject
             result = result.replace(oldStr, newStr)
     return result
     
+def printMigrationPlan(config, filteredSourceNetworks, targetOrgNetworks, sourceObjects, sourceObjectGroups):
+    # Counts the calls the enabled tasks of main() would make, from organization-level lists only
+    tasks = config['enabledTasks']
+    
+    newNetworks     = 0
+    allNets         = len(filteredSourceNetworks)
+    nets            = 0
+    applianceNets   = 0
+    wirelessNets    = 0
+    allWirelessNets = 0
+    for net in filteredSourceNetworks:
+        if 'wireless' in net['productTypes']:
+            allWirelessNets += 1
+        targetNetId = getNetworkIdByName(targetOrgNetworks, net['name'])
+        if targetNetId is None:
+            newNetworks += 1
+            if not tasks['createNetworks']:
+                continue
+        elif networkContainsForbiddenTags(config, targetNetId, targetOrgNetworks):
+            continue
+        nets += 1
+        if 'appliance' in net['productTypes']:
+            applianceNets += 1
+        if 'wireless' in net['productTypes']:
+            wirelessNets += 1
+            
+    plan = createPlan("migrate_networks.py")
+    addPlanPhase(plan, "Organization lists", 7)
+    if tasks['copyPolicyObjects']:
+        addPlanPhase(plan, "Copy policy objects and groups", len(sourceObjects) + len(sourceObjectGroups) + 2,
+            p_assumption="upper bound, objects that are already identical are skipped")
+    if tasks['copyVpnFirewallRules']:
+        addPlanPhase(plan, "Copy VPN firewall rules", 2)
+    if tasks['createNetworks']:
+        # The destination network list is refreshed after every network created
+        addPlanPhase(plan, "Create networks", 2 * newNetworks)
+    if tasks['refreshTimeZones']:
+        addPlanPhase(plan, "Refresh time zones", nets)
+    if tasks['copyMxRoutingMode']:
+        addPlanPhase(plan, "Copy MX routing mode", 2 * applianceNets)
+    if tasks['copyMxVlans']:
+        addPlanPhase(plan, "Copy MX VLANs", applianceNets * (6 + PLAN_VLANS_PER_NETWORK),
+            p_assumption="%s VLANs per network" % PLAN_VLANS_PER_NETWORK)
+    if tasks['copyMxStaticRoutes']:
+        addPlanPhase(plan, "Copy MX static routes", applianceNets * (2 + 2 * PLAN_STATIC_ROUTES_PER_NETWORK),
+            p_assumption="%s static routes per network, in source and destination" % PLAN_STATIC_ROUTES_PER_NETWORK)
+    if tasks['copyMxFirewallRules']:
+        addPlanPhase(plan, "Copy MX L3 firewall rules", 2 * applianceNets)
+    if tasks['copyMxTrafficShaping']:
+        addPlanPhase(plan, "Copy MX traffic shaping", 4 * applianceNets)
+    if tasks['copyMrSsids']:
+        addPlanPhase(plan, "Copy MR SSIDs", allWirelessNets + PLAN_SSIDS_PER_NETWORK * wirelessNets)
+    if tasks['copyMrFirewallRules']:
+        addPlanPhase(plan, "Copy MR firewall rules", 2 * PLAN_SSIDS_PER_NETWORK * wirelessNets)
+    if tasks['copyMrTrafficShapingRules']:
+        addPlanPhase(plan, "Copy MR traffic shaping rules", 2 * PLAN_SSIDS_PER_NETWORK * wirelessNets)
+    if tasks['copyAlerts']:
+        addPlanPhase(plan, "Copy alerts", allNets + nets)
+    if tasks['copySiteToSiteVpnConfig']:
+        addPlanPhase(plan, "Copy site-to-site VPN", 2 * applianceNets)
+    printPlan(plan)
+    
 def main(argv):  
     arg_apiKey      = None
     arg_configFile  = "config.yaml"
     
+    flag_plan, argv = parsePlanArgument(argv)
+    
+    #Policy objects and other organization-level lists are looked up repeatedly. Send each of these requests
+    #only once, until the script makes a change
+    enableMemo()
+    
     try:
         opts, args = getopt.getopt(argv, 'k:c:h:')
     except getopt.GetoptError:
@@ -1137,6 +1085,10 @@ def main(argv):
     success, errors, targetObjectGroups = getOrganizationPolicyObjectsGroups(apiKey, targetOrgId)
     if targetObjectGroups is None:
         killScript("Unable to fetch destination org policy object groups")
+        
+    if flag_plan:
+        printMigrationPlan(config, filteredSourceNetworks, targetOrgNetworks, sourceObjects, sourceObjectGroups)
+        sys.exit()
 
     if config['enabledTasks']['copyPolicyObjects']:
         log("Copying policy objects and groups...")
@@ -1,16 +1,22 @@
-read_me = """Python 3 script that logs data from the Meraki dashboard into a MongoDB database.
-You will need to have MongoDB installed and supply a configuration file for this script to run.
+read_me = """Python 3 script that logs data from the Meraki dashboard into a MongoDB database, or into a local
+SQLite database file. To log into MongoDB, you will need to have MongoDB installed.
+You will need to supply a configuration file for this script to run.
 You can get the MongoDB Community Server here: https://www.mongodb.com/try/download/community
 You can find a sample configuration file here: 
   https://github.com/meraki/automation-scripts/blob/master/offline_logging/config.yaml
 
 Script syntax:
-    python offline_logging.py -c <config_file>
+    python offline_logging.py -c <config_file> [-q <collection> [-f <field>=<value>]]
+
+Optional parameters:
+    -q <collection>     Instead of scanning, print the documents of a collection in the configured storage,
+                        one JSON document per line
+    -f <field>=<value>  Only print documents with this value of field. Can be used multiple times
 
 Required Python 3 modules:
     requests
     pyyaml
-    pymongo
+    pymongo (only needed if storage_backend is "mongodb")
     
 To install these Python 3 modules via pip you can use the following commands:
     pip install requests
@@ -25,139 +31,63 @@ View the created database with a MongoDB viewing tool such as MongoDB Compass:
  A version of MongoDB Compass can be installed with the MongoDB Community Server. 
 """
 
-import sys, getopt, yaml, time, datetime, pymongo
-
-from urllib.parse import urlencode
-from requests import Session, utils
+import sys, os, getopt, yaml, time, datetime, json, sqlite3, threading, copy
 
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
+try:
+    import pymongo
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+except ImportError:
+    pymongo = None
 
-API_MAX_RETRIES         = 3
-API_CONNECT_TIMEOUT     = 60
-API_TRANSMIT_TIMEOUT    = 60
-API_STATUS_RATE_LIMIT   = 429
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meraki_request import merakiRequest, setOrganization
+from meraki_request.fanout import fanOut
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE    = True
 
-API_BASE_URL            = "https://api.meraki.com/api/v1"
+#Documents are written to the database in bulk, this many at a time. Can be overridden with "write_chunk_size" in
+#the "mongodb" or "sqlite" section of the configuration file
+DEFAULT_WRITE_CHUNK_SIZE = 1000
 
+#Where documents are stored. Can be overridden with "storage_backend" in the configuration file:
+#  mongodb: A MongoDB server, configured in the "mongodb" section
+#  sqlite:  A local SQLite database file, configured in the "sqlite" section. Needs no server
+DEFAULT_STORAGE_BACKEND = 'mongodb'
+DEFAULT_SQLITE_DATABASE_FILE = 'meraki.db'
 
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
+#Document fields indexed in every SQLite table, used by traffic history and high water mark lookups
+SQLITE_INDEXED_FIELDS = ['networkId', 'clientId']
 
-    bearerString = "Bearer " + p_apiKey
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        query = "?" + urlencode(p_queryItems, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
+#Number of networks scanned at the same time, and number of requests per network, like traffic histories of
+#clients, sent at the same time. Can be overridden with "max_concurrent_networks" and
+#"max_concurrent_requests_per_network" in the configuration file
+DEFAULT_MAX_CONCURRENT_NETWORKS             = 4
+DEFAULT_MAX_CONCURRENT_REQUESTS_PER_NETWORK = 8
 
-    try:
-        if(p_verbose):
-            print(verb, url)
-        if verb == "GET":
-            r = session.get(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        elif verb == "PUT":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.put(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "POST":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.post(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "DELETE":
-            r = session.delete(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, r.headers["Retry-After"]))
-        time.sleep(int(r.headers["Retry-After"]))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
+#What to do when a scan is still running at the time the next one should start. Can be overridden with
+#"scan_overrun_policy" in the configuration file:
+#  skip:    Wait for the next regular start time. The next scan covers all the time since the previous one
+#  queue:   Start the late scan immediately, then return to the regular start times
+#  shorten: Like queue, but the late scan only logs the endpoints that report a timespan, so that it
+#           finishes sooner. The others report current state and are logged again by the next regular scan
+SCAN_OVERRUN_POLICIES   = ['skip', 'queue', 'shorten']
+DEFAULT_SCAN_OVERRUN_POLICY = 'skip'
 
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
+#Endpoints that report data for a timespan ending now. Each scan requests the time since the previous scan started
+TIMESPAN_ENDPOINTS      = ['getNetworkClients', 'getNetworkClientsApplicationUsage']
+
+#Maximum timespan accepted by the endpoints above, in seconds
+MAX_TIMESPAN_SECONDS    = 31*24*60*60
+
+#Collection that stores the timestamp of the newest traffic history record logged for every client, and its number
+#of pages, in update mode. Can be overridden with "high_water_mark_collection" in the getNetworkClientTrafficHistory
+#configuration
+DEFAULT_HIGH_WATER_MARK_COLLECTION = 'networkClientTrafficHistoryMarks'
+
+#Fields printed to identify documents that could not be written
+DOCUMENT_ID_FIELDS      = ['id', 'clientId', 'clientMac', 'mac', 'networkId', 'pageNumber']
     
     
 def getNetworks(p_apiKey, p_organizationId):
@@ -277,25 +207,70 @@ def filter_admins(p_admins, p_networks, p_tags):
     return result
     
     
-def log_to_database(db, document, collection, mode='append', keyValuePair=None):
-    dbc = db[collection]
+def describe_document(document):
+    description = []
+    for key in DOCUMENT_ID_FIELDS:
+        if key in document:
+            description.append("%s: %s" % (key, document[key]))
+    if 'trafficHistory' in document:
+        description.append("trafficHistory record count: %s" % len(document['trafficHistory']))
+    return ", ".join(description)
+    
     
-    if mode == 'append':
+def write_chunk_one_by_one(dbc, chunk, mode, key_fields):
+    # Fallback for chunks that could not be written in bulk, for example because one of their documents is too
+    # large. Writes every document separately, so that only the ones that fail are lost
+    failed = 0
+    for document in chunk:
         try:
-            dbc.insert_one(document)
+            if mode == 'update':
+                dbc.update_one({key: document[key] for key in key_fields}, {"$set": document}, upsert=True)
+            else:
+                dbc.insert_one(document)
         except Exception as e:
-            print(e)
-            print("ERROR: Could not create document in database")
-            return False
-    elif mode == 'update':
+            failed += 1
+            print("ERROR: Could not write document to collection %s: %s" % (dbc.name, e))
+            print("    %s" % describe_document(document))
+    return failed
+    
+    
+def write_documents(db, documents, collection, mode='append', key_fields=None, chunk_size=DEFAULT_WRITE_CHUNK_SIZE):
+    # Writes a list of documents in chunks of chunk_size. In append mode, every chunk is written with a single
+    # unordered insert_many(). In update mode, every chunk is a single bulk_write() of upserts that match existing
+    # documents by the fields in key_fields. Errors are reported per chunk and do not stop the remaining chunks
+    # Returns the number of documents that could not be written
+    if len(documents) == 0:
+        return 0
+        
+    dbc = db[collection]
+    if key_fields is None:
+        mode = 'append'
+    total_chunks = (len(documents) + chunk_size - 1) // chunk_size
+    failed = 0
+    
+    for chunk_number in range(total_chunks):
+        chunk = documents[chunk_number*chunk_size:(chunk_number+1)*chunk_size]
         try:
-            dbc.update_one(keyValuePair, {"$set": document}, upsert=True)
+            if mode == 'update':
+                operations = []
+                for document in chunk:
+                    operations.append(UpdateOne({key: document[key] for key in key_fields}, {"$set": document}, upsert=True))
+                dbc.bulk_write(operations, ordered=False)
+            else:
+                dbc.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            failed += len(write_errors)
+            print("ERROR: %s of %s documents in chunk %s/%s could not be written to collection %s" % (
+                len(write_errors), len(chunk), chunk_number+1, total_chunks, collection))
+            for error in write_errors:
+                print("    %s -- %s" % (error.get('errmsg', ''), describe_document(chunk[error['index']])))
         except Exception as e:
-            print(e)
-            print("ERROR: Could not update document in database")
-            return False
+            print("WARNING: Bulk write of chunk %s/%s to collection %s failed, writing documents one by one: %s" % (
+                chunk_number+1, total_chunks, collection, e))
+            failed += write_chunk_one_by_one(dbc, chunk, mode, key_fields)
             
-    return True
+    return failed
     
     
 def database_delete_all_matches(db, collection, filter):
@@ -310,6 +285,20 @@ def database_delete_all_matches(db, collection, filter):
     return True
     
     
+def read_high_water_marks(sink, collection, network_id):
+    # Returns a dictionary of the high water marks of all clients of a network, keyed by clientId
+    result = {}
+    try:
+        for mark in sink.find(collection, {'networkId': network_id}):
+            result[mark['clientId']] = mark
+    except Exception as e:
+        print(e)
+        print("ERROR: Could not read traffic history high water marks for net %s" % network_id)
+        return None
+        
+    return result
+    
+    
 def split_history_array(history, max_records):
     result = []
     line = []
@@ -325,13 +314,418 @@ def split_history_array(history, max_records):
     return result
       
     
-def perform_scan(config):
+def json_default(value):
+    # Serializes values that JSON does not support, like the scanTime of documents
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+    
+    
+class MongoSink:
+    # Stores documents in a MongoDB database
+    def __init__(self, config):
+        self.client     = pymongo.MongoClient("mongodb://" + config['host'] + ":" + str(config['port']) + "/")
+        self.db         = self.client[config['database_name']]
+        self.chunk_size = config.get('write_chunk_size', DEFAULT_WRITE_CHUNK_SIZE)
+        
+    def write(self, documents, collection, mode='append', key_fields=None):
+        # Returns the number of documents that could not be written
+        return write_documents(self.db, documents, collection, mode, key_fields, self.chunk_size)
+        
+    def delete(self, collection, filter):
+        return database_delete_all_matches(self.db, collection, filter)
+        
+    def find(self, collection, filter=None):
+        if filter is None:
+            filter = {}
+        return list(self.db[collection].find(filter))
+        
+    def close(self):
+        self.client.close()
+        
+        
+class SQLiteSink:
+    # Stores documents in a local SQLite database file, in write-ahead log mode, so that the database can be read
+    # while a scan is writing to it. Every collection is a table of JSON documents. In update mode, documents are
+    # matched by a unique key made of their key fields, and their fields replace those of the stored document, like
+    # $set in MongoDB. Network scans run in parallel threads and share a single connection, one write at a time
+    def __init__(self, config):
+        self.chunk_size = config.get('write_chunk_size', DEFAULT_WRITE_CHUNK_SIZE)
+        self.lock       = threading.Lock()
+        self.tables     = set()
+        self.connection = sqlite3.connect(config.get('database_file', DEFAULT_SQLITE_DATABASE_FILE),
+                            check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        
+    def table(self, collection):
+        # Creates the table of a collection the first time it is used. Returns its quoted name
+        name = collection.replace('"', '""')
+        if not collection in self.tables:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS "%s" (documentKey TEXT, document TEXT NOT NULL)' % name)
+            self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS "%s_documentKey" ON "%s" (documentKey) '
+                'WHERE documentKey IS NOT NULL' % (name, name))
+            for field in SQLITE_INDEXED_FIELDS:
+                self.connection.execute('CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" (json_extract(document, %s))' % (
+                    name, field, name, self.path(field)))
+            self.connection.commit()
+            self.tables.add(collection)
+        return '"%s"' % name
+        
+    def path(self, field):
+        # Returns the JSON path of a document field as an SQL string literal. Paths are part of the statement
+        # instead of parameters, so that conditions on indexed fields can use their index
+        return "'%s'" % ('$."%s"' % field).replace("'", "''")
+        
+    def where(self, filter):
+        # Returns a WHERE clause that matches documents whose fields equal all values in filter, and its parameters
+        if filter is None or len(filter) == 0:
+            return "", []
+        conditions = []
+        values = []
+        for field in filter:
+            conditions.append("json_extract(document, %s) = ?" % self.path(field))
+            values.append(filter[field])
+        return " WHERE " + " AND ".join(conditions), values
+        
+    def write(self, documents, collection, mode='append', key_fields=None):
+        # Writes documents in chunks of chunk_size, one transaction per chunk. Chunks that fail are retried one
+        # document at a time, like write_documents() does for MongoDB
+        # Returns the number of documents that could not be written
+        if len(documents) == 0:
+            return 0
+        if key_fields is None:
+            mode = 'append'
+            
+        # In update mode, every row also has a patch that removes the fields of the new document from the stored one.
+        # The fields that are left are then added to the new document, so that fields the new document does not
+        # have are kept, apart from null ones, and the others are replaced as a whole instead of merged
+        rows = []
+        for document in documents:
+            if mode == 'update':
+                key = json.dumps([document[field] for field in key_fields], default=json_default)
+                rows.append((key, json.dumps(document, default=json_default), json.dumps(dict.fromkeys(document))))
+            else:
+                rows.append((None, json.dumps(document, default=json_default)))
+            
+        failed = 0
+        with self.lock:
+            table = self.table(collection)
+            statement = "INSERT INTO %s (documentKey, document) VALUES (?1, ?2)" % table
+            if mode == 'update':
+                statement += (" ON CONFLICT (documentKey) WHERE documentKey IS NOT NULL "
+                    "DO UPDATE SET document = json_patch(excluded.document, json_patch(%s.document, ?3))" % table)
+            total_chunks = (len(rows) + self.chunk_size - 1) // self.chunk_size
+            for chunk_number in range(total_chunks):
+                chunk = rows[chunk_number*self.chunk_size:(chunk_number+1)*self.chunk_size]
+                try:
+                    with self.connection:
+                        self.connection.executemany(statement, chunk)
+                except sqlite3.Error as e:
+                    print("WARNING: Bulk write of chunk %s/%s to collection %s failed, writing documents one by one: %s" % (
+                        chunk_number+1, total_chunks, collection, e))
+                    for i in range(len(chunk)):
+                        try:
+                            with self.connection:
+                                self.connection.execute(statement, chunk[i])
+                        except sqlite3.Error as e:
+                            failed += 1
+                            print("ERROR: Could not write document to collection %s: %s" % (collection, e))
+                            print("    %s" % describe_document(documents[chunk_number*self.chunk_size + i]))
+        return failed
+        
+    def delete(self, collection, filter):
+        where, values = self.where(filter)
+        try:
+            with self.lock, self.connection:
+                self.connection.execute("DELETE FROM %s%s" % (self.table(collection), where), values)
+        except sqlite3.Error as e:
+            print(e)
+            print("ERROR: Could not delete document in database")
+            return False
+            
+        return True
+        
+    def find(self, collection, filter=None):
+        # Datetime values, like scanTime, are returned as ISO 8601 strings
+        where, values = self.where(filter)
+        with self.lock:
+            cursor = self.connection.execute("SELECT document FROM %s%s ORDER BY rowid" % (self.table(collection), where),
+                values)
+            return [json.loads(row[0]) for row in cursor.fetchall()]
+            
+    def close(self):
+        self.connection.close()
+        
+        
+STORAGE_BACKENDS = {
+    'mongodb'   : MongoSink,
+    'sqlite'    : SQLiteSink
+}
+    
+    
+def open_sink(config):
+    backend = config.get('storage_backend', DEFAULT_STORAGE_BACKEND)
+    return STORAGE_BACKENDS[backend](config.get(backend, {}))
+    
+    
+def query_documents(config, collection, filter):
+    # Prints the documents of a collection that match filter, one JSON document per line
+    sink = open_sink(config)
+    for document in sink.find(collection, filter):
+        print(json.dumps(document, default=json_default))
+    sink.close()
+    
+    
+def scan_network(config, sink, network, timespan, template_auth_users):
+    # Logs all enabled endpoints of a single network. Runs in a worker thread of perform_scan()
+    # template_auth_users: Users of configuration templates fetched during this scan, keyed by template ID. Shared
+    # by all networks of the scan, so that the users of a template are fetched only once
+    # Returns the number of seconds the network took
+    start_time      = time.monotonic()
+    api_key         = config['meraki_dashboard_api']['api_key']
+    
+    # value used as a flag if "getNetworkClients" is disabled
+    clients = None         
+    
+    if 'getNetworkClients' in config['endpoints'] and config['endpoints']['getNetworkClients']['enabled']:
+        success, errors, headers, raw_clients = getClients(api_key, network['id'], timespan)
+        if raw_clients is None:
+            print("ERROR: Cloud not fetch clients for net %s" % network['id'])
+        else:
+            scan_time = datetime.datetime.now()
+            
+            if config['endpoints']['getNetworkClients']['ignore_manufacturer_meraki']:
+                clients = []
+                for client in raw_clients:
+                    if not client['manufacturer'] in ["Cisco Meraki", "Meraki"]:
+                        clients.append(client)
+            else:
+                clients = raw_clients
+            
+            documents = []
+            for client in clients:
+                document = client
+                document['scanTime'] = scan_time
+                document['scanIntervalMinutes'] = config['scan_interval_minutes']
+                document['scanTimespanSeconds'] = timespan
+                document['networkId'] = network['id']
+                document['networkName'] = network['name']
+                documents.append(document)
+            sink.write(documents, config['endpoints']['getNetworkClients']['collection'],
+                config['endpoints']['getNetworkClients']['mode'])
+    if 'getNetworkClientsApplicationUsage' in config['endpoints'] and config['endpoints']['getNetworkClientsApplicationUsage']['enabled']:
+        if clients is None:
+            print("ERROR: Client list must be fetched for getNetworkClientsApplicationUsage")
+        else:
+            client_list = ""
+            for client in clients:
+                if client_list != "":
+                    client_list += ","
+                client_list += client['id']
+            
+            success, errors, headers, usage = getApplicationUsage(api_key, network['id'], client_list, timespan)
+            
+            if usage is None:
+                print("ERROR: Cloud not fetch clients' usage for net %s" % network['id'])
+            else:          
+                scan_time = datetime.datetime.now()                
+                documents = []
+                for item in usage:
+                    document = item
+                    document['scanTime'] = scan_time
+                    document['scanIntervalMinutes'] = config['scan_interval_minutes']
+                    document['scanTimespanSeconds'] = timespan
+                    document['networkId'] = network['id']
+                    document['networkName'] = network['name']
+                    documents.append(document)
+                sink.write(documents, config['endpoints']['getNetworkClientsApplicationUsage']['collection'],
+                    config['endpoints']['getNetworkClientsApplicationUsage']['mode'])
+    if 'getNetworkClientTrafficHistory' in config['endpoints'] and config['endpoints']['getNetworkClientTrafficHistory']['enabled']:
+        if clients is None:
+            print("ERROR: Client list must be fetched for getNetworkClientTrafficHistory")
+        else:
+            # In update mode, only records newer than the client's high water mark are written, as additional
+            # pages. Clients without a mark, for example when upgrading from full rewrites, start over once.
+            # The newest time bucket of a history is still being counted, and records of other applications can
+            # still be added to it, so it is held back until a later scan returns a newer bucket
+            history_config      = config['endpoints']['getNetworkClientTrafficHistory']
+            flag_incremental    = history_config['mode'] == 'update'
+            mark_collection     = history_config.get('high_water_mark_collection', DEFAULT_HIGH_WATER_MARK_COLLECTION)
+            marks = {}
+            if flag_incremental:
+                marks = read_high_water_marks(sink, mark_collection, network['id'])
+                
+            # Without the marks, it is unknown which records have already been logged
+            if not marks is None:
+                clients_by_id = {}
+                for client in clients:
+                    clients_by_id[client['id']] = client
+                    
+                # Pages are written in chunks as histories arrive, instead of once all clients have been fetched.
+                # Neither fanOut() nor the request layer keep a history once on_history() has returned, so a
+                # network only keeps the pages waiting for the next chunk, and the responses still in flight
+                pending = {'documents': [], 'failed': 0}
+                new_marks = []
+                
+                def flush_pages():
+                    if flag_incremental:
+                        # Pages are upserted by number, so that a scan that failed to write some of them is
+                        # repeated without duplicates
+                        pending['failed'] += sink.write(pending['documents'], history_config['collection'],
+                            mode='update', key_fields=['networkId', 'clientId', 'pageNumber'])
+                    else:
+                        sink.write(pending['documents'], history_config['collection'], mode="append")
+                    pending['documents'] = []
+                
+                def on_history(job, result):
+                    client = clients_by_id[job['key']]
+                    traffic_history = None
+                    if not result is None:
+                        success, errors, headers, traffic_history = result
+                    if traffic_history is None:
+                        return
+                        
+                    mark = marks.get(client['id'], None)
+                    if flag_incremental and len(traffic_history) > 0:
+                        newest_ts = max(record['ts'] for record in traffic_history)
+                        traffic_history = [record for record in traffic_history if record['ts'] < newest_ts]
+                    if not mark is None:
+                        traffic_history = [record for record in traffic_history if record['ts'] > mark['lastTs']]
+                        
+                    history_pages = split_history_array(traffic_history, history_config['max_history_records_per_document'])
+                    
+                    previous_pages = 0
+                    if not mark is None:
+                        previous_pages = mark['totalPages']
+                    total_pages = previous_pages + len(history_pages)
+                                        
+                    if len(history_pages) > 0:
+                        base_info = {
+                            'clientId'              : client['id'],
+                            'clientMac'             : client['mac'],
+                            'clientIp'              : client['ip'],
+                            'clientDescription'     : client['description'],
+                            'networkId'             : network['id'],
+                            'networkName'           : network['name'],
+                            'scanTime'              : scan_time,
+                            'scanIntervalMinutes'   : config['scan_interval_minutes']
+                        }
+                        # In update mode, pages written by earlier scans would keep an outdated page count. The
+                        # current one is stored in the client's high water mark instead
+                        if not flag_incremental:
+                            base_info['totalPages'] = total_pages
+                        
+                        filter = {
+                            'clientId'  : base_info['clientId'],
+                            'networkId' : base_info['networkId']
+                        }
+                        
+                        if flag_incremental:
+                            if mark is None:
+                                sink.delete(history_config['collection'], filter)
+                            new_marks.append({
+                                'clientId'      : client['id'],
+                                'networkId'     : network['id'],
+                                'lastTs'        : max(record['ts'] for record in traffic_history),
+                                'totalPages'    : total_pages,
+                                'scanTime'      : scan_time
+                            })
+                                                                            
+                        page_number = previous_pages
+                        for page in history_pages:
+                            page_number += 1
+                            document = {}
+                            for key in base_info:
+                                document[key] = base_info[key]
+                            document['pageNumber'] = page_number
+                            document['trafficHistory'] = page
+                            pending['documents'].append(document)
+                        if len(pending['documents']) >= sink.chunk_size:
+                            flush_pages()
+                
+                # Traffic histories are fetched one client at a time, so the requests of a network run concurrently
+                jobs = []
+                for client in clients:
+                    jobs.append({'key': client['id'], 'label': 'history', 'function': getClientTrafficHistory,
+                        'args': (api_key, network['id'], client['id'])})
+                fanOut(jobs, config.get('max_concurrent_requests_per_network', DEFAULT_MAX_CONCURRENT_REQUESTS_PER_NETWORK),
+                    p_onResult=on_history, p_keepResults=False)
+                flush_pages()
+                
+                if flag_incremental:
+                    # Marks only move forward once all pages of the network have been written
+                    if pending['failed'] == 0:
+                        sink.write(new_marks, mark_collection, mode='update', key_fields=['networkId', 'clientId'])
+                    else:
+                        print("WARNING: Traffic history high water marks of net %s not updated" % network['id'])
+    if 'getNetworkMerakiAuthUsers' in config['endpoints'] and config['endpoints']['getNetworkMerakiAuthUsers']['enabled']:
+        success, errors, headers, auth_users = getNetworkMerakiAuthUsers(api_key, network['id'])
+        if 'configTemplateId' in network and config['endpoints']['getNetworkMerakiAuthUsers']['include_template_users']:
+            template_id = network['configTemplateId']
+            if not template_id in template_auth_users:
+                success, errors, headers, response = getNetworkMerakiAuthUsers(api_key, template_id)
+                if not response is None:
+                    template_auth_users[template_id] = response
+            if template_id in template_auth_users:
+                # The documents below are modified per network, so every network gets its own copy
+                template_users = copy.deepcopy(template_auth_users[template_id])
+                if not auth_users is None:
+                    auth_users += template_users
+                else:
+                    auth_users = template_users
+        if not auth_users is None:
+            documents = []
+            for user in auth_users:
+                document = user 
+                document['networkId'] = network['id']
+                documents.append(document)
+            sink.write(documents, config['endpoints']['getNetworkMerakiAuthUsers']['collection'],
+                config['endpoints']['getNetworkMerakiAuthUsers']['mode'], 
+                key_fields=['id', 'networkId'])
+    if 'getNetworkSmDevices' in config['endpoints'] and config['endpoints']['getNetworkSmDevices']['enabled']:
+        if 'systemsManager' in network['productTypes']:
+            success, errors, headers, sm_devices = getNetworkSmDevices(api_key, network['id'])
+            if not sm_devices is None:
+                tag_disabled = not config['endpoints']['getNetworkSmDevices']['filter_by_device_tag_enabled']
+                tag_filter = config['endpoints']['getNetworkSmDevices']['target_device_tag']
+                scan_time = datetime.datetime.now()  
+                documents = []
+                for device in sm_devices:
+                    if tag_disabled or tag_filter in device['tags']:
+                        document = {
+                            'scanTime': scan_time,
+                            'scanIntervalMinutes': config['scan_interval_minutes'],
+                            'networkId': network['id'],
+                            'networkName': network['name']
+                        }
+                        for key in device:
+                            document[key] = device[key]
+                        documents.append(document)
+                        
+                sink.write(documents, 
+                    config['endpoints']['getNetworkSmDevices']['collection'],
+                    config['endpoints']['getNetworkSmDevices']['mode'], 
+                    key_fields=['id'])
+            
+    return time.monotonic() - start_time
+    
+    
+def perform_scan(config, timespan=None):
+    # timespan: Seconds of data to request from endpoints in TIMESPAN_ENDPOINTS. Defaults to the scan interval
     print(str(datetime.datetime.now()) + " -- Starting scan")
+    scan_start      = time.monotonic()
     
     api_key         = config['meraki_dashboard_api']['api_key']
     org_id          = config['meraki_dashboard_api']['organization_id']
     scan_interval   = config['scan_interval_minutes']*60
     
+    if timespan is None:
+        timespan = scan_interval
+    
+    # Charge network-level requests to this organization's shared rate limit budget
+    setOrganization(org_id)
+    
     success, errors, headers, all_networks = getNetworks(api_key, org_id)
     
     if not success:
@@ -339,190 +733,140 @@ def perform_scan(config):
     else:
         filtered_networks = filter_networks(config['sources'], all_networks)
         
-        mongo_client = pymongo.MongoClient("mongodb://" + config['mongodb']['host'] + ":" + str(config['mongodb']['port']) + "/")    
-        db = mongo_client[config['mongodb']['database_name']]
+        sink = open_sink(config)
                 
         if 'getOrganizationAdmins' in config['endpoints'] and config['endpoints']['getOrganizationAdmins']['enabled']:
             success, errors, headers, all_admins = getOrganizationAdmins(api_key, org_id)
             if not all_admins is None:
                 admins = filter_admins(all_admins, filtered_networks, config['sources']['network_tags'])
-                for admin in admins:
-                    log_to_database(db, admin, config['endpoints']['getOrganizationAdmins']['collection'],
-                            config['endpoints']['getOrganizationAdmins']['mode'], 
-                            keyValuePair={'id': admin['id']})
+                sink.write(admins, config['endpoints']['getOrganizationAdmins']['collection'],
+                        config['endpoints']['getOrganizationAdmins']['mode'], 
+                        key_fields=['id'])
         
                 
-        for network in filtered_networks: 
-            # value used as a flag if "getNetworkClients" is disabled
-            clients = None         
-            
-            if 'getNetworkClients' in config['endpoints'] and config['endpoints']['getNetworkClients']['enabled']:
-                success, errors, headers, raw_clients = getClients(api_key, network['id'], scan_interval)
-                if raw_clients is None:
-                    print("ERROR: Cloud not fetch clients for net %s" % network['id'])
-                else:
-                    scan_time = datetime.datetime.now()
-                    
-                    if config['endpoints']['getNetworkClients']['ignore_manufacturer_meraki']:
-                        clients = []
-                        for client in raw_clients:
-                            if not client['manufacturer'] in ["Cisco Meraki", "Meraki"]:
-                                clients.append(client)
-                    else:
-                        clients = raw_clients
-                    
-                    for client in clients:
-                        document = client
-                        document['scanTime'] = scan_time
-                        document['scanIntervalMinutes'] = config['scan_interval_minutes']
-                        document['networkId'] = network['id']
-                        document['networkName'] = network['name']
-                        log_to_database(db, document, config['endpoints']['getNetworkClients']['collection'],
-                            config['endpoints']['getNetworkClients']['mode'])
-            if 'getNetworkClientsApplicationUsage' in config['endpoints'] and config['endpoints']['getNetworkClientsApplicationUsage']['enabled']:
-                if clients is None:
-                    print("ERROR: Client list must be fetched for getNetworkClientsApplicationUsage")
-                else:
-                    client_list = ""
-                    for client in clients:
-                        if client_list != "":
-                            client_list += ","
-                        client_list += client['id']
-                    
-                    success, errors, headers, usage = getApplicationUsage(api_key, network['id'], client_list, scan_interval)
-                    
-                    if usage is None:
-                        print("ERROR: Cloud not fetch clients' usage for net %s" % network['id'])
-                    else:          
-                        scan_time = datetime.datetime.now()                
-                        for item in usage:
-                            document = item
-                            document['scanTime'] = scan_time
-                            document['scanIntervalMinutes'] = config['scan_interval_minutes']
-                            document['networkId'] = network['id']
-                            document['networkName'] = network['name']
-                            log_to_database(db, document, config['endpoints']['getNetworkClientsApplicationUsage']['collection'],
-                                config['endpoints']['getNetworkClientsApplicationUsage']['mode'])
-            if 'getNetworkClientTrafficHistory' in config['endpoints'] and config['endpoints']['getNetworkClientTrafficHistory']['enabled']:
-                if clients is None:
-                    print("ERROR: Client list must be fetched for getNetworkClientTrafficHistory")
-                else:
-                    for client in clients:
-                        success, errors, headers, traffic_history = getClientTrafficHistory(api_key, network['id'], client['id'])
-                        
-                        if not traffic_history is None:                        
-                            history_pages = split_history_array(traffic_history, 
-                                config['endpoints']['getNetworkClientTrafficHistory']['max_history_records_per_document'])
-                            
-                            total_pages = len(history_pages)
-                                                
-                            if total_pages > 0:
-                                base_info = {
-                                    'clientId'              : client['id'],
-                                    'clientMac'             : client['mac'],
-                                    'clientIp'              : client['ip'],
-                                    'clientDescription'     : client['description'],
-                                    'networkId'             : network['id'],
-                                    'networkName'           : network['name'],
-                                    'scanTime'              : scan_time,
-                                    'scanIntervalMinutes'   : config['scan_interval_minutes'],
-                                    'totalPages'            : total_pages
-                                }
-                                
-                                filter = {
-                                    'clientId'  : base_info['clientId'],
-                                    'networkId' : base_info['networkId']
-                                }
-                                
-                                if config['endpoints']['getNetworkClientTrafficHistory']['mode'] == 'update':
-                                    success = database_delete_all_matches(db, 
-                                        config['endpoints']['getNetworkClientTrafficHistory']['collection'], filter)
-                                                                                    
-                                page_number = 0
-                                for page in history_pages:
-                                    page_number += 1
-                                    document = {}
-                                    for key in base_info:
-                                        document[key] = base_info[key]
-                                    document['pageNumber'] = page_number
-                                    document['trafficHistory'] = page
-                                    success = log_to_database(db, document, config['endpoints']['getNetworkClientTrafficHistory']['collection'], mode="append")   
-                                    if not success:
-                                        print("clientId                    : %s" % document['clientId'])
-                                        print("clientMac                   : %s" % document['clientMac'])
-                                        print("clientIp                    : %s" % document['clientIp'])
-                                        print("clientDescription           : %s" % document['clientDescription'])
-                                        print("networkId                   : %s" % document['networkId'])
-                                        print("networkName                 : %s" % document['networkName'])
-                                        print("pageNumber                   : %s" % document['pageNumber'])
-                                        print("trafficHistory record count : %s" % len(document['trafficHistory']))
-            if 'getNetworkMerakiAuthUsers' in config['endpoints'] and config['endpoints']['getNetworkMerakiAuthUsers']['enabled']:
-                success, errors, headers, auth_users = getNetworkMerakiAuthUsers(api_key, network['id'])
-                if 'configTemplateId' in network and config['endpoints']['getNetworkMerakiAuthUsers']['include_template_users']:
-                    success, errors, headers, template_users = getNetworkMerakiAuthUsers(api_key, network['configTemplateId'])
-                    if not template_users is None:
-                        if not auth_users is None:
-                            auth_users += template_users
-                        else:
-                            auth_users = template_users
-                if not auth_users is None:
-                    for user in auth_users:
-                        document = user 
-                        document['networkId'] = network['id']
-                        log_to_database(db, document, config['endpoints']['getNetworkMerakiAuthUsers']['collection'],
-                            config['endpoints']['getNetworkMerakiAuthUsers']['mode'], 
-                            keyValuePair={'id': user['id'], 'networkId': network['id']})
-            if 'getNetworkSmDevices' in config['endpoints'] and config['endpoints']['getNetworkSmDevices']['enabled']:
-                if 'systemsManager' in network['productTypes']:
-                    success, errors, headers, sm_devices = getNetworkSmDevices(api_key, network['id'])
-                    if not sm_devices is None:
-                        tag_disabled = not config['endpoints']['getNetworkSmDevices']['filter_by_device_tag_enabled']
-                        tag_filter = config['endpoints']['getNetworkSmDevices']['target_device_tag']
-                        scan_time = datetime.datetime.now()  
-                        for device in sm_devices:
-                            if tag_disabled or tag_filter in device['tags']:
-                                document = {
-                                    'scanTime': scan_time,
-                                    'scanIntervalMinutes': config['scan_interval_minutes'],
-                                    'networkId': network['id'],
-                                    'networkName': network['name']
-                                }
-                                for key in device:
-                                    document[key] = device[key]
-                                
-                                log_to_database(db, document, 
-                                    config['endpoints']['getNetworkSmDevices']['collection'],
-                                    config['endpoints']['getNetworkSmDevices']['mode'], 
-                                    keyValuePair={'id': device['id']})                              
+        # Networks are scanned concurrently. All their requests share the rate limit budget of the organization.
+        # Template users are fetched again in every scan, since they may have changed
+        template_auth_users = {}
+        jobs = []
+        for network in filtered_networks:
+            jobs.append({'key': network['id'], 'label': 'scan', 'function': scan_network,
+                'args': (config, sink, network, timespan, template_auth_users)})
+                
+        progress = {'done': 0}
+        
+        def on_network_scanned(job, elapsed):
+            progress['done'] += 1
+            network = job['args'][2]
+            if elapsed is None:
+                print("ERROR: Scan of network %s failed (%s/%s)" % (network['name'], progress['done'], len(jobs)))
+            else:
+                print("%s -- Network %s scanned in %.1f seconds (%s/%s)" % (datetime.datetime.now(), network['name'],
+                    elapsed, progress['done'], len(jobs)))
+                
+        fanOut(jobs, config.get('max_concurrent_networks', DEFAULT_MAX_CONCURRENT_NETWORKS), p_verbose=True,
+            p_onResult=on_network_scanned)
+        sink.close()
             
-    print(str(datetime.datetime.now()) + " -- Scan complete")
+    elapsed = time.monotonic() - scan_start
+    print(str(datetime.datetime.now()) + " -- Scan complete in %.1f seconds" % elapsed)
+    if elapsed > scan_interval:
+        print("WARNING: Scan took longer than scan_interval_minutes. Consider raising max_concurrent_networks")
 
 
 def main(argv):
     arg_config_file = None
+    arg_query       = None
+    query_filter    = {}
     
     try:
-        opts, args = getopt.getopt(argv, 'c:')
+        opts, args = getopt.getopt(argv, 'c:q:f:')
     except getopt.GetoptError:
         sys.exit(2)
         
     for opt, arg in opts:
         if opt == '-c':
             arg_config_file = arg
+        elif opt == '-q':
+            arg_query = arg
+        elif opt == '-f':
+            if not '=' in arg:
+                kill_script()
+            field, value = arg.split('=', 1)
+            # Values are typed like in the configuration file, so that numbers and booleans match
+            query_filter[field] = yaml.safe_load(value)
             
     if arg_config_file is None:
         kill_script()
     
     try:
         config = load_config(arg_config_file)
-        print(str(datetime.datetime.now()) + " -- Initializing script")
     except:
         kill_script()
+    if config is None:
+        kill_script()
+        
+    backend = config.get('storage_backend', DEFAULT_STORAGE_BACKEND)
+    if not backend in STORAGE_BACKENDS:
+        print("ERROR: storage_backend must be one of: %s" % ", ".join(STORAGE_BACKENDS))
+        sys.exit(2)
+    if backend == 'mongodb' and pymongo is None:
+        print("ERROR: Python module pymongo is required for storage_backend mongodb")
+        sys.exit(2)
+        
+    if not arg_query is None:
+        query_documents(config, arg_query, query_filter)
+        sys.exit(0)
+        
+    print(str(datetime.datetime.now()) + " -- Initializing script")
+                
+    overrun_policy = config.get('scan_overrun_policy', DEFAULT_SCAN_OVERRUN_POLICY)
+    if not overrun_policy in SCAN_OVERRUN_POLICIES:
+        print("ERROR: scan_overrun_policy must be one of: %s" % ", ".join(SCAN_OVERRUN_POLICIES))
+        sys.exit(2)
                 
+    # Scans start on a fixed grid of monotonic clock times, scan_interval apart, so that the time a scan takes
+    # does not add up over time. Every scan requests the time since the previous scan actually started, so that
+    # consecutive scans neither leave gaps nor overlap, even if one of them started late
+    scan_interval   = config['scan_interval_minutes']*60
+    next_start      = time.monotonic()
+    previous_start  = None
+    flag_shorten    = False
+    
     while(True):
-        perform_scan(config)
-        print(str(datetime.datetime.now()) + " -- Next scan in " + str(config['scan_interval_minutes']) + " minutes")
-        time.sleep(config['scan_interval_minutes']*60)
+        scan_start = time.monotonic()
+        
+        timespan = scan_interval
+        if not previous_start is None:
+            timespan = int(round(min(scan_start - previous_start, MAX_TIMESPAN_SECONDS)))
+        
+        scan_config = config
+        if flag_shorten:
+            scan_config = dict(config)
+            scan_config['endpoints'] = {}
+            for name in config['endpoints']:
+                if name in TIMESPAN_ENDPOINTS:
+                    scan_config['endpoints'][name] = config['endpoints'][name]
+                    
+        perform_scan(scan_config, timespan)
+        previous_start  = scan_start
+        flag_shorten    = False
+        
+        next_start += scan_interval
+        now = time.monotonic()
+        if now > next_start:
+            # Regular start times that have already passed
+            missed = int((now - next_start) // scan_interval) + 1
+            if overrun_policy == 'skip':
+                next_start += missed*scan_interval
+                print("WARNING: Scan overran its interval. Skipping %s scan(s)" % missed)
+            else:
+                next_start += (missed-1)*scan_interval
+                flag_shorten = overrun_policy == 'shorten'
+                print("WARNING: Scan overran its interval. Starting next scan immediately")
+                
+        wait = max(0, next_start - time.monotonic())
+        print(str(datetime.datetime.now()) + " -- Next scan in %.1f minutes" % (wait/60))
+        time.sleep(wait)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
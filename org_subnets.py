@@ -15,6 +15,8 @@ Parameters:
     -o <org_name>       The name of the organization to print subnet info for. This parameter can be 
                         omitted if your API key can only access one org. Use keyword "/all" instead of a name
                         to fetch information for all organizations accessible by your API key
+    --no-cache          Do not use cached organization and network lists, even if OS environment variable
+                        MERAKI_RESPONSE_CACHE is set
                         
 Example, print subnet info for organization with name Big Industries Inc:
     python org_subnets.py -k 1234 -o "Big Industries Inc"
@@ -31,140 +33,14 @@ def printHelp():
     
 import time
 
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
-
-API_MAX_RETRIES             = 3
-API_CONNECT_TIMEOUT         = 60
-API_TRANSMIT_TIMEOUT        = 60
-API_STATUS_RATE_LIMIT       = 429
-API_RETRY_DEFAULT_WAIT      = 3
+from meraki_request import merakiRequest
+from meraki_request.fanout import fanOut
+from meraki_request import configureCacheFromArgv
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE        = True
 
-API_BASE_URL                = "https://api.meraki.com/api/v1"
 API_KEY_ENV_VAR_NAME        = "MERAKI_DASHBOARD_API_KEY"
-
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-        
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        qArrayFix = {}
-        for item in p_queryItems:
-            if isinstance(p_queryItems[item], list):
-                qArrayFix["%s[]" % item] = p_queryItems[item]
-            else:
-                qArrayFix[item] = p_queryItems[item]
-        query = "?" + urlencode(qArrayFix, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-    
-    verbs   = {
-        'DELETE'    : { 'function': session.delete, 'hasBody': False },
-        'GET'       : { 'function': session.get,    'hasBody': False },
-        'POST'      : { 'function': session.post,   'hasBody': True  },
-        'PUT'       : { 'function': session.put,    'hasBody': True  }
-    }
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-            
-        if verb in verbs:
-            if verbs[verb]['hasBody'] and not p_requestBody is None:
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-            else: 
-                r = verbs[verb]['function'](
-                    url,
-                    headers =   headers,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        retryInterval = API_RETRY_DEFAULT_WAIT
-        if "Retry-After" in r.headers:
-            retryInterval = r.headers["Retry-After"]
-        if "retry-after" in r.headers:
-            retryInterval = r.headers["retry-after"]
-        
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, retryInterval))
-        time.sleep(int(retryInterval))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
     
     
 # getOrganizations
@@ -374,6 +250,19 @@ def main(argv):
                 if 'appliance' in net['productTypes']:
                     org['networks'].append(net)
        
+    # Fetch the addressing of all appliance networks concurrently, instead of one call at a time
+    jobs = []
+    for org in organizations:
+        for net in org['networks']:
+            for label, function in [
+                    ('singleLan',           getNetworkApplianceSingleLan),
+                    ('vlans',               getNetworkApplianceVlans),
+                    ('routes',              getNetworkApplianceStaticRoutes),
+                    ('vpnAdvertisements',   getNetworkApplianceVpnAdvertisements)]:
+                jobs.append({'key': net['id'], 'label': label, 'function': function, 'args': (apiKey, net['id'])})
+                
+    results = fanOut(jobs)
+    
     for org in organizations:
         for net in org['networks']:
             net['singleLan']            = None
@@ -382,22 +271,28 @@ def main(argv):
             net['vpnAdvertisements']    = []
             
             print("Processing: %s > %s" % (org['name'], net["name"]))
-                        
-            success, errors, singleLan = getNetworkApplianceSingleLan(apiKey, net['id'])            
-            if not singleLan is None:
-                net['singleLan'] = singleLan
+            
+            netResults = results.get(net['id'], {})
+            
+            if not netResults.get('singleLan') is None:
+                success, errors, singleLan = netResults['singleLan']
+                if not singleLan is None:
+                    net['singleLan'] = singleLan
         
-            success, errors, allVlans = getNetworkApplianceVlans(apiKey, net['id'])            
-            if not allVlans is None:
-                net['vlans'] = allVlans
+            if not netResults.get('vlans') is None:
+                success, errors, allVlans = netResults['vlans']
+                if not allVlans is None:
+                    net['vlans'] = allVlans
                 
-            success, errors, allRoutes = getNetworkApplianceStaticRoutes(apiKey, net['id'])            
-            if not allRoutes is None:
-                net['routes'] = allRoutes
+            if not netResults.get('routes') is None:
+                success, errors, allRoutes = netResults['routes']
+                if not allRoutes is None:
+                    net['routes'] = allRoutes
         
-            success, errors, allVpnAdverts = getNetworkApplianceVpnAdvertisements(apiKey, net['id'])            
-            if not allVpnAdverts is None:
-                net['vpnAdvertisements'] = allVpnAdverts['routes']
+            if not netResults.get('vpnAdvertisements') is None:
+                success, errors, allVpnAdverts = netResults['vpnAdvertisements']
+                if not allVpnAdverts is None:
+                    net['vpnAdvertisements'] = allVpnAdverts['routes']
                 
     subnets = {}
                 
@@ -499,4 +394,4 @@ def main(argv):
             printLine(line)
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    main(configureCacheFromArgv(sys.argv[1:]))
@@ -44,7 +44,10 @@ Notes:
      this cell blank
 '''
 
-import sys, getopt, requests, json, time, datetime, ipaddress
+import sys, os, getopt, requests, json, time, datetime, ipaddress
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meraki_request import ActionBatchEngine
 
 
 ### SECTION: GLOBAL VARIABLES: MODIFY TO CHANGE SCRIPT BEHAVIOUR
@@ -57,10 +60,6 @@ API_EXEC_DELAY              = 0.21
 REQUESTS_CONNECT_TIMEOUT    = 90
 REQUESTS_READ_TIMEOUT       = 90
 
-#Max number of loops to try when waiting for action batches to complete and retry interval in seconds
-ABWAIT_MAX_LOOPS            = 20
-ABWAIT_RETRY_INTERVAL       = 2
-
 
 ### SECTION: GLOBAL VARIABLES AND CLASSES: DO NOT MODIFY
 
@@ -71,7 +70,7 @@ LAST_MERAKI_REQUEST         = datetime.datetime.now()   #used by merakiRequestTh
 API_BASE_URL                = 'https://api.meraki.com/api/v0'
 API_BASE_URL_MEGA_PROXY     = 'https://api.meraki.com/api/v0'
 API_BASE_URL_NO_MEGA        = 'https://api.meraki.com/api/v0'
-ACTION_BATCH_QUEUE          = []
+ACTION_BATCH_ENGINE         = None   #created on first use by getActionBatchEngine()
 
 
 ### SECTION: CLASS DEFINITIONS
@@ -308,99 +307,38 @@ def getOrgNetworks(p_apiKey, p_orgId):
     return(r.json())
         
     
-def createActionBatch (p_apiKey, p_orgId, p_actions):   
-    merakiRequestThrottler()
-    
-    payload = json.dumps(
-        {
-            'confirmed':True, 
-            'synchronous':False,
-            'actions': p_actions
-        }
-    )
-        
-    try:
-        r = requests.post( API_BASE_URL + '/organizations/%s/actionBatches' % p_orgId, data=payload, headers={'X-Cisco-Meraki-API-Key': p_apiKey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT))
-    except:
-        return None
+def getActionBatchEngine(p_apiKey, p_orgId):
+    #Action batches are submitted through the shared engine, which keeps several batches running concurrently
+    global ACTION_BATCH_ENGINE
+    if ACTION_BATCH_ENGINE is None:
+        ACTION_BATCH_ENGINE = ActionBatchEngine(p_apiKey, p_orgId)
+    return ACTION_BATCH_ENGINE
     
-    if 200 <= r.status_code < 300:
-        rjson = r.json()
-        return rjson['id']
-      
-    return None
-        
     
 def queueActionBatch (p_apiKey, p_orgId, p_action, p_forceCommit=False):
     #return success, batchId
-    global ACTION_BATCH_QUEUE
-    
+    engine = getActionBatchEngine(p_apiKey, p_orgId)
+    success = True
+    batchId = None
     if not p_action is None:
-        ACTION_BATCH_QUEUE.append(p_action)
-    queueLength = len(ACTION_BATCH_QUEUE)
-    if queueLength == 100 or (queueLength > 0 and p_forceCommit):
-        print('Submitting action batch:')
-        print(ACTION_BATCH_QUEUE)
-        
-        batchId = createActionBatch (p_apiKey, p_orgId, ACTION_BATCH_QUEUE)     
-        ACTION_BATCH_QUEUE = []
-        
-        if not batchId is None:
-            print('Submitted with batchId %s' % batchId)
-            return (True, str(batchId))
-        else:
-            return (False, None)
-    
-    return (True, None)
-    
-    
-def getActionBatches(p_apiKey, p_orgId):
-    merakiRequestThrottler()
-    try:
-        r = requests.get( API_BASE_URL + '/organizations/%s/actionBatches' % p_orgId, headers={'X-Cisco-Meraki-API-Key': p_apiKey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        print('ERROR 11: Unable to get action batches')
-        return(None)
-    
-    if r.status_code != requests.codes.ok:
-        return(None)
-    
-    return(r.json())
+        success, batchId = engine.addAction(p_action)
+    if p_forceCommit and success and batchId is None:
+        success, batchId = engine.flush()
+    if not batchId is None:
+        print('Submitted action batch with batchId %s' % batchId)
+    return (success, batchId)
     
     
 def waitForActionBatchesToComplete(p_apiKey, p_orgId, p_batchIds):
-    flag_waitSomeMore   = True
-    flag_batchHasFailed = False
-        
-    i = -1
-    while flag_waitSomeMore:
-        i += 1
-        if i >= ABWAIT_MAX_LOOPS:
-            break
-        flag_waitSomeMore   = False
-        actionBatches       = getActionBatches(p_apiKey, p_orgId)
-        #print(actionBatches)
-        for id in p_batchIds:
-            for record in actionBatches:
-                if record['id'] == id:
-                    if not record['status']['completed'] and not record['status']['failed']:
-                        flag_waitSomeMore = True
-                        break
-                    if record['status']['failed']:
-                        print('ERROR 12: Action batch with batchId %s has failed' % id)
-                        if 'errors' in record['status']:
-                            print(record['status']['errors'])
-                        return False
-        if flag_waitSomeMore:
-            time.sleep(ABWAIT_RETRY_INTERVAL)                        
-    return True
+    #Waits for all batches submitted so far. Failed batches are printed as soon as they are detected
+    return getActionBatchEngine(p_apiKey, p_orgId).wait()
     
     
 def sendCreateNetworkToActionBatchQueue(p_apiKey, p_orgId, p_name, p_type):    
             
     body = {
-        'name'    : p_name,
-        'type'    : p_type
+        'name'          : p_name,
+        'productTypes'  : p_type.split()
     }
     action = {
         'resource'  : '/organizations/' + p_orgId + '/networks',
@@ -421,7 +359,7 @@ def sendUpdateVlanSubnetToActionBatchQueue(p_apiKey, p_orgId, p_networkId, p_vla
         'applianceIp'   : p_routerIp
     }
     action = {
-        'resource'  : '/networks/' + p_networkId + '/vlans/' + p_vlanId,
+        'resource'  : '/networks/' + p_networkId + '/appliance/vlans/' + p_vlanId,
         'operation' : 'update',
         'body'      : body
     }    
@@ -435,7 +373,7 @@ def sendUpdateVlanSubnetToActionBatchQueue(p_apiKey, p_orgId, p_networkId, p_vla
 def sendClaimDeviceToActionBatchQueue(p_apiKey, p_orgId, p_networkId, p_serial):    
             
     body = {
-        'serial'        : p_serial
+        'serials'       : [p_serial]
     }
     action = {
         'resource'  : '/networks/' + p_networkId + '/devices',
@@ -456,7 +394,7 @@ def sendUpdateDeviceLocationToActionBatchQueue(p_apiKey, p_orgId, p_networkId, p
         'moveMapMarker' : True
     }
     action = {
-        'resource'  : '/networks/' + p_networkId + '/devices/' + p_serial,
+        'resource'  : '/devices/' + p_serial,
         'operation' : 'update',
         'body'      : body
     }    
@@ -3,7 +3,11 @@ readMe = """This is script to create a copy of a template-based network that pre
   the script is converting MX appliance networks.
  
 Syntax:
-  removetemplate -k <key> -o <org name> -n <source net name>
+  removetemplate -k <key> -o <org name> -n <source net name> [--plan]
+  
+Optional parameters:
+  --plan    Do not create or change anything. Print how many API calls the script would make and how long
+            that would take instead
   
 Notes:
   This release supports the following features:
@@ -32,138 +36,14 @@ Required Python version and modules:
 """
 
 import sys, getopt, time, json, ipaddress
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
 
-API_MAX_RETRIES         = 3
-API_CONNECT_TIMEOUT     = 60
-API_TRANSMIT_TIMEOUT    = 60
-API_STATUS_RATE_LIMIT   = 429
+from meraki_request import merakiRequest, enableMemo
+from meraki_request import parsePlanArgument, createPlan, addPlanPhase, printPlan
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE    = True
 
-API_BASE_URL            = "https://api.meraki.com/api/v1"
-
-
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-
-    bearerString = "Bearer " + p_apiKey
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        query = "?" + urlencode(p_queryItems)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
 
-    try:
-        if(p_verbose):
-            print(verb, url)
-        if verb == "GET":
-            r = session.get(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        elif verb == "PUT":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.put(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "POST":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.post(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "DELETE":
-            r = session.delete(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        if(p_verbose):
-            print("Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, r.headers["Retry-After"]))
-        time.sleep(int(r.headers["Retry-After"]))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody.append(nextBody)
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
-    
-    
 def getOrganizations(p_apiKey):
     endpoint = "/organizations"
     success, errors, headers, response = merakiRequest(p_apiKey, "GET", endpoint, p_verbose=FLAG_REQUEST_VERBOSE)    
@@ -506,6 +386,34 @@ def updateMxPortForwardingRules(p_apiKey, p_networkId, p_settings):
     return success, errors, headers, response  
     
     
+#MX settings copied as they are, after the L3 firewall rules, in this order. Columns: get function, update function,
+#True if read from the template instead of the source network, True if not copied when the source has no rules
+MX_SETTINGS_COPIED = [
+    (getMxL7FirewallRules,          updateMxL7FirewallRules,            False,  True),
+    (getMxIpsSettings,              updateMxIpsSettings,                False,  False),
+    (getMxAmpSettings,              updateMxAmpSettings,                False,  False),
+    (getMxContentFilteringSettings, updateMxContentFilteringSettings,   False,  False),
+    (getMxTrafficShapingRules,      updateMxTrafficShapingRules,        True,   False),
+    (getMxPortForwardingRules,      updateMxPortForwardingRules,        True,   True),
+    (getMxOneToOneNatRules,         updateMxOneToOneNatRules,           True,   True),
+    (getMxOneToManyNatRules,        updateMxOneToManyNatRules,          True,   True)
+]
+
+#Calls made outside MX_SETTINGS_COPIED, counted by --plan. Organization-level lists: organizations, networks and
+#administrators. Reads of the source network and template: group policies, VLAN settings, VLANs or single LAN,
+#static routes and L3 firewall rules. Firewall updates: L3 firewall rules
+PLAN_ORGANIZATION_LIST_CALLS    = 3
+PLAN_SOURCE_READ_CALLS          = 5
+PLAN_FIREWALL_UPDATE_CALLS      = 1
+    
+    
+def isEmptyRuleset(p_settings):
+    #L7 firewall rules are an object with a "rules" list, NAT and port forwarding rules are a list
+    if isinstance(p_settings, dict):
+        return p_settings.get("rules", None) == []
+    return p_settings == []
+    
+    
 def getOrganizationIdWithName(p_apiKey, p_organizationName):
     success, errors, headers, response = getOrganizations(p_apiKey)
     if not response is None:
@@ -619,12 +527,62 @@ def cleanUnknownSourceSubnets(p_firewallRuleset, p_knownSubnets):
     return {"rules": cleanRuleset}
     
 
+def printRemoveTemplatePlan(p_apiKey, p_orgId, p_sourceNet):
+    #Counts the calls main() would make, using the source network's lists that are cheap to fetch
+    success, errors, headers, groupPolicies = getGroupPolicies(p_apiKey, p_sourceNet["id"])
+    success, errors, headers, vlanSettings = getVlanSettings(p_apiKey, p_sourceNet["configTemplateId"])
+    success, errors, headers, routes = getMxStaticRoutes(p_apiKey, p_sourceNet["id"])
+    success, errors, headers, admins = getAdministrators(p_apiKey, p_orgId)
+    
+    vlanCalls = 0
+    vlanAssumption = None
+    if vlanSettings is None:
+        vlanAssumption = "unable to check if VLANs are enabled"
+    elif "vlansEnabled" in vlanSettings and not vlanSettings["vlansEnabled"]:
+        vlanCalls = 1
+    else:
+        success, errors, headers, vlans = getVlans(p_apiKey, p_sourceNet["id"])
+        if vlans is None:
+            vlanCalls = 1
+            vlanAssumption = "unable to fetch source VLANs"
+        else:
+            vlanCalls = 1 + len(vlans)
+            vlanIds = [int(vlan["id"]) for vlan in vlans]
+            if not 1 in vlanIds:
+                vlanCalls += 1
+    
+    adminCalls = 0
+    if not admins is None:
+        for admin in admins:
+            if "networks" in admin:
+                for net in admin["networks"]:
+                    if net["id"] == p_sourceNet["id"]:
+                        adminCalls += 1
+    
+    plan = createPlan("removetemplate.py")
+    addPlanPhase(plan, "Organization lists", PLAN_ORGANIZATION_LIST_CALLS)
+    addPlanPhase(plan, "Read source network and template", PLAN_SOURCE_READ_CALLS + len(MX_SETTINGS_COPIED))
+    addPlanPhase(plan, "Create network", 1)
+    addPlanPhase(plan, "Copy group policies", 0 if groupPolicies is None else len(groupPolicies))
+    addPlanPhase(plan, "Copy VLANs and addressing", vlanCalls, p_assumption=vlanAssumption)
+    addPlanPhase(plan, "Copy static routes", 0 if routes is None else len(routes))
+    addPlanPhase(plan, "Copy firewall, security and NAT", PLAN_FIREWALL_UPDATE_CALLS + len(MX_SETTINGS_COPIED),
+        p_assumption="upper bound, empty L7 and NAT rule sets are not copied")
+    addPlanPhase(plan, "Copy admin privileges", adminCalls)
+    printPlan(plan)
+    
+    
 def main(argv):
     #set default values for command line arguments
     arg_apiKey          = None
     arg_orgName         = None
     arg_sourceNetName   = None
     
+    flag_plan, argv = parsePlanArgument(argv)
+    
+    #Template settings and group policies are read more than once. Send each of these requests only once
+    enableMemo()
+    
     try:
         opts, args = getopt.getopt(argv, 'hk:o:n:')
     except getopt.GetoptError:
@@ -675,6 +633,10 @@ def main(argv):
         print('ERROR: Unable to create unique new network name')
         killScript()
         
+    if flag_plan:
+        printRemoveTemplatePlan(arg_apiKey, orgId, sourceNet)
+        sys.exit(0)
+        
     #create new network
     success, errors, headers, newNetwork = createNetwork(arg_apiKey, orgId, newNetName, sourceNet["productTypes"], 
         p_timeZone=sourceNet["timeZone"], p_tags=sourceNet["tags"])
@@ -753,45 +715,13 @@ def main(argv):
         cleanRules = cleanUnknownSourceSubnets(sourceRules, knownSubnets)
         updateMxL3FirewallRules(arg_apiKey, newNetwork["id"], cleanRules)
         
-    #- L7 Firewall Rules
-    success, errors, headers, sourceRules = getMxL7FirewallRules(arg_apiKey, sourceNet["id"]) 
-    if not sourceRules is None:
-        if sourceRules["rules"] != []:
-            updateMxL7FirewallRules(arg_apiKey, newNetwork["id"], sourceRules)
-        
-    #- Copy Threat Protection
-    success, errors, headers, sourceRules = getMxIpsSettings(arg_apiKey, sourceNet["id"])
-    if not sourceRules is None:
-        updateMxIpsSettings(arg_apiKey, newNetwork["id"], sourceRules)
-        
-    success, errors, headers, sourceRules = getMxAmpSettings(arg_apiKey, sourceNet["id"])
-    if not sourceRules is None:
-        updateMxAmpSettings(arg_apiKey, newNetwork["id"], sourceRules)
-    
-    #- Content Filtering
-    success, errors, headers, sourceRules = getMxContentFilteringSettings(arg_apiKey, sourceNet["id"])
-    if not sourceRules is None:
-        updateMxContentFilteringSettings(arg_apiKey, newNetwork["id"], sourceRules)
-        
-    #- Traffic Shaping
-    success, errors, headers, sourceRules = getMxTrafficShapingRules(arg_apiKey, sourceNet["configTemplateId"])
-    if not sourceRules is None:
-        updateMxTrafficShapingRules(arg_apiKey, newNetwork["id"], sourceRules)
-        
-    #- Port forwarding NAT rules
-    success, errors, headers, sourceRules = getMxPortForwardingRules(arg_apiKey, sourceNet["configTemplateId"])
-    if not sourceRules is None and sourceRules != []:
-        updateMxPortForwardingRules(arg_apiKey, newNetwork["id"], sourceRules)
-        
-    #- 1-to-1 NAT rules
-    success, errors, headers, sourceRules = getMxOneToOneNatRules(arg_apiKey, sourceNet["configTemplateId"])
-    if not sourceRules is None and sourceRules != []:
-        updateMxOneToOneNatRules(arg_apiKey, newNetwork["id"], sourceRules)
-        
-    #- 1-to-many NAT rules
-    success, errors, headers, sourceRules = getMxOneToManyNatRules(arg_apiKey, sourceNet["configTemplateId"])
-    if not sourceRules is None and sourceRules != []:
-        updateMxOneToManyNatRules(arg_apiKey, newNetwork["id"], sourceRules)
+    #- L7 Firewall Rules, Threat Protection, Content Filtering, Traffic Shaping and NAT rules
+    for getFunction, updateFunction, flag_fromTemplate, flag_skipIfEmpty in MX_SETTINGS_COPIED:
+        sourceId = sourceNet["configTemplateId"] if flag_fromTemplate else sourceNet["id"]
+        success, errors, headers, sourceRules = getFunction(arg_apiKey, sourceId)
+        if not sourceRules is None:
+            if not (flag_skipIfEmpty and isEmptyRuleset(sourceRules)):
+                updateFunction(arg_apiKey, newNetwork["id"], sourceRules)
     
     #- Copy Admin accounts
     success, errors, headers, response = getAdministrators(arg_apiKey, orgId)
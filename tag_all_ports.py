@@ -3,11 +3,11 @@ with a user-defined tag.
 
 Script syntax, Windows:
     python tag_all_ports.py -k <api_key> -t <tag> [-o <org_name>]
-        [-n <network_name>] [-f <filter>] [-a <add/remove>]
+        [-n <network_name>] [-f <filter>] [-a <add/remove>] [--plan]
  
 Script syntax, Linux and Mac:
     python3 tag_all_ports.py -k <api_key> -t <tag> [-o <org_name>]
-        [-n <network_name>] [-f <filter>] [-a <add/remove>]
+        [-n <network_name>] [-f <filter>] [-a <add/remove>] [--plan]
     
 Mandatory parameters:
     -k <api_key>            Your Meraki Dashboard API key
@@ -24,6 +24,8 @@ Optional parameters:
                             form "<key>:<value>"
     -a <add/remove>         Action to complete. Use value "add" to add the specified
                             tag or "remove" to remove it. If omitted "add" is assumed
+    --plan                  Do not change anything. Print how many API calls the
+                            script would make and how long that would take instead
                             
 Example, tag all access ports in the only organization I have access to with "video":
     python tag_all_ports.py -k 1234 -f type:access -t video
@@ -41,141 +43,20 @@ Depending on your operating system and Python environment, you may need to use c
  "python3" and "pip3" instead of "python" and "pip".
 """
 
-import sys, getopt, time, datetime
+import sys, getopt, datetime, re
 
-from urllib.parse import urlencode
-from requests import Session, utils
-
-class NoRebuildAuthSession(Session):
-    def rebuild_auth(self, prepared_request, response):
-        """
-        This method is intentionally empty. Needed to prevent auth header stripping on redirect. More info:
-        https://stackoverflow.com/questions/60358216/python-requests-post-request-dropping-authorization-header
-        """
-
-API_MAX_RETRIES         = 3
-API_CONNECT_TIMEOUT     = 60
-API_TRANSMIT_TIMEOUT    = 60
-API_STATUS_RATE_LIMIT   = 429
+from meraki_request import merakiRequest
+from meraki_request import parsePlanArgument, createPlan, addPlanPhase, printPlan
 
 #Set to True or False to enable/disable console logging of sent API requests
 FLAG_REQUEST_VERBOSE    = True
 
-API_BASE_URL            = "https://api.meraki.com/api/v1"
+#Used by --plan to estimate the number of ports of a switch from its model name, like "MS225-48FP"
+SWITCH_MODEL_PORTS_REGEX    = re.compile(r"-(\d+)")
+SWITCH_UPLINK_PORTS         = 4
+SWITCH_DEFAULT_PORTS        = 52
 
 
-def merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders=None, p_queryItems=None, 
-        p_requestBody=None, p_verbose=False, p_retry=0):
-    #returns success, errors, responseHeaders, responseBody
-    
-    if p_retry > API_MAX_RETRIES:
-        if(p_verbose):
-            print("ERROR: Reached max retries")
-        return False, None, None, None
-
-    bearerString = "Bearer " + str(p_apiKey)
-    headers = {"Authorization": bearerString}
-    if not p_additionalHeaders is None:
-        headers.update(p_additionalHeaders)
-        
-    query = ""
-    if not p_queryItems is None:
-        query = "?" + urlencode(p_queryItems, True)
-    url = API_BASE_URL + p_endpoint + query
-    
-    verb = p_httpVerb.upper()
-    
-    session = NoRebuildAuthSession()
-
-    try:
-        if(p_verbose):
-            print(verb, url)
-        if verb == "GET":
-            r = session.get(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        elif verb == "PUT":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.put(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "POST":
-            if not p_requestBody is None:
-                if (p_verbose):
-                    print("body", p_requestBody)
-                r = session.post(
-                    url,
-                    headers =   headers,
-                    json    =   p_requestBody,
-                    timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-                )
-        elif verb == "DELETE":
-            r = session.delete(
-                url,
-                headers =   headers,
-                timeout =   (API_CONNECT_TIMEOUT, API_TRANSMIT_TIMEOUT)
-            )
-        else:
-            return False, None, None, None
-    except:
-        return False, None, None, None
-    
-    if(p_verbose):
-        print(r.status_code)
-    
-    success         = r.status_code in range (200, 299)
-    errors          = None
-    responseHeaders = None
-    responseBody    = None
-    
-    if r.status_code == API_STATUS_RATE_LIMIT:
-        if(p_verbose):
-            print("INFO: Hit max request rate. Retrying %s after %s seconds" % (p_retry+1, r.headers["Retry-After"]))
-        time.sleep(int(r.headers["Retry-After"]))
-        success, errors, responseHeaders, responseBody = merakiRequest(p_apiKey, p_httpVerb, p_endpoint, p_additionalHeaders, 
-            p_queryItems, p_requestBody, p_verbose, p_retry+1)
-        return success, errors, responseHeaders, responseBody        
-            
-    try:
-        rjson = r.json()
-    except:
-        rjson = None
-        
-    if not rjson is None:
-        if "errors" in rjson:
-            errors = rjson["errors"]
-            if(p_verbose):
-                print(errors)
-        else:
-            responseBody = rjson  
-
-    if "Link" in r.headers:
-        parsedLinks = utils.parse_header_links(r.headers["Link"])
-        for link in parsedLinks:
-            if link["rel"] == "next":
-                if(p_verbose):
-                    print("Next page:", link["url"])
-                splitLink = link["url"].split("/api/v1")
-                success, errors, responseHeaders, nextBody = merakiRequest(p_apiKey, p_httpVerb, splitLink[1], 
-                    p_additionalHeaders=p_additionalHeaders, 
-                    p_requestBody=p_requestBody, 
-                    p_verbose=p_verbose)
-                if success:
-                    if not responseBody is None:
-                        responseBody = responseBody + nextBody
-                else:
-                    responseBody = None
-    
-    return success, errors, responseHeaders, responseBody
-  
-
 def getOrganizations(p_apiKey):
     endpoint = "/organizations"
     success, errors, headers, response = merakiRequest(p_apiKey, "GET", endpoint, p_verbose=FLAG_REQUEST_VERBOSE)    
@@ -221,6 +102,13 @@ def killScript(reason=None):
     else:
         log("ERROR: %s" % reason)
         sys.exit()
+        
+        
+def estimateSwitchPortCount(model):
+    match = SWITCH_MODEL_PORTS_REGEX.search(model)
+    if match is None:
+        return SWITCH_DEFAULT_PORTS
+    return int(match.group(1)) + SWITCH_UPLINK_PORTS
                             
     
     
@@ -232,6 +120,8 @@ def main(argv):
     arg_netName = None
     arg_action  = "add"
     
+    flag_plan, argv = parsePlanArgument(argv)
+    
     try:
         opts, args = getopt.getopt(argv, 'k:o:t:f:n:a:')
     except getopt.GetoptError:
@@ -304,6 +194,22 @@ def main(argv):
             filter = {splitStr[0]: splitStr[1]}
         else:
             killScript("Invalid port attribute filter")
+            
+    if flag_plan:
+        switches = []
+        for device in inventory:
+            if device['model'][:2] == "MS" and (device['networkId'] in filteredNetworkIds):
+                switches.append(device)
+        maxPorts = 0
+        for device in switches:
+            maxPorts += estimateSwitchPortCount(device['model'])
+        plan = createPlan("tag_all_ports.py")
+        addPlanPhase(plan, "Organization lists", 3)
+        addPlanPhase(plan, "Fetch switch ports", len(switches))
+        addPlanPhase(plan, "Update switch ports", maxPorts,
+            p_assumption="upper bound, every port matches the filter and needs its tags changed")
+        printPlan(plan)
+        sys.exit()
     
     for device in inventory:
         if device['model'][:2] == "MS" and (device['networkId'] in filteredNetworkIds):
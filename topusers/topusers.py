@@ -17,6 +17,9 @@
 #  * In Windows, use double quotes ("") to enter command line parameters containing spaces.
 #  * This script was built for Python 3.7.1.
 #  * Depending on your operating system, the command to start python can be either "python" or "python3". 
+#  * Reports are run in the background and cached. The first time a network is selected, its report is prepared
+#     while the page loads and can be viewed a few seconds later. Reports of networks viewed recently are kept
+#     up to date automatically, see REPORT_CACHE_TTL_SECONDS and REPORT_KEEPWARM_MINUTES.
 # 
 # Required Python modules:
 #  Requests     : http://docs.python-requests.org
@@ -34,7 +37,8 @@
 #  and "key.pem" files as a self-signed certificate using OpenSSL:
 #  https://stackoverflow.com/questions/10175812/how-to-create-a-self-signed-certificate-with-openssl
 
-import sys, getopt, requests, json, time, datetime, os, sqlite3
+import sys, getopt, requests, json, time, datetime, os, sqlite3, threading, heapq
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, jsonify, render_template, request, redirect, url_for, flash
 from flask_wtf import FlaskForm
 from wtforms import SelectField, SubmitField
@@ -57,13 +61,28 @@ TIMERANGE_SHORT_MINUTES     = 10
 TIMERANGE_MEDIUM_MINUTES    = 30
 TIMERANGE_LONG_MINUTES      = 60
 
+#Report cache. Pages are served from the cache only and never wait for Dashboard. Reports of networks viewed in the
+#last REPORT_KEEPWARM_MINUTES are refreshed in the background once they are older than REPORT_CACHE_TTL_SECONDS
+REPORT_CACHE_TTL_SECONDS    = 60
+REPORT_KEEPWARM_MINUTES     = 15
+REPORT_REFRESH_INTERVAL     = 10 #seconds between checks of the background refresher for reports to refresh
+
+REPORT_TOP_COUNT            = 10 #number of heaviest users listed per time range
+REPORT_MAX_CONCURRENT_REQUESTS = 6 #max client list requests in flight. 3 time ranges for 2 MXs of an HA pair
+
 #SECTION: GLOBAL VARIABLES AND CLASSES: DO NOT MODIFY
 
 LAST_MERAKI_REQUEST         = datetime.datetime.now()   #used by merakirequestthrottler()
+THROTTLER_LOCK              = threading.Lock()          #used by merakirequestthrottler()
 LAST_ORGLIST_REFRESH        = datetime.datetime.now() - datetime.timedelta(minutes=ORGLIST_STALE_MINUTES+1) #for refreshOrgList2()
 ARG_APIKEY                  = '' #DO NOT STATICALLY SET YOUR API KEY HERE
 ARG_ORGNAME                 = '' #DO NOT STATICALLY SET YOUR ORGANIZATION NAME HERE
 ORG_LIST                    = None #list of organizations, networks and MXs the used API key has access to
+REPORT_CACHE                = {} #(network parameters, minutes): (timestamp, report). Used by getCachedReport()
+RECENT_VIEWS                = {} #network parameters: time of last page view. Used by reportRefresher()
+REPORT_CACHE_LOCK           = threading.Lock()
+REPORT_REFRESH_EVENT        = threading.Event() #set to wake up reportRefresher() when a report is missing
+CLIENTLIST_POOL             = ThreadPoolExecutor(max_workers=REPORT_MAX_CONCURRENT_REQUESTS) #used by getUsageReports()
 
 class c_OutRecord:
     def __init__(self):
@@ -100,13 +119,18 @@ class c_Organization:
 #SECTION: General use functions
 
 def merakirequestthrottler():
-    #makes sure there is enough time between API requests to Dashboard not to hit shaper
+    #makes sure there is enough time between API requests to Dashboard not to hit shaper. Can be called from
+    #several threads: every caller reserves the next free slot and waits for it, so requests start at least
+    #API_EXEC_DELAY apart, while their round trips overlap
     global LAST_MERAKI_REQUEST
     
-    if (datetime.datetime.now()-LAST_MERAKI_REQUEST).total_seconds() < (API_EXEC_DELAY):
-        time.sleep(API_EXEC_DELAY)
-    
-    LAST_MERAKI_REQUEST = datetime.datetime.now()
+    with THROTTLER_LOCK:
+        slot = max(datetime.datetime.now(), LAST_MERAKI_REQUEST + datetime.timedelta(seconds=API_EXEC_DELAY))
+        LAST_MERAKI_REQUEST = slot
+        
+    wait = (slot-datetime.datetime.now()).total_seconds()
+    if wait > 0:
+        time.sleep(wait)
     return
     
 def printhelp():
@@ -285,7 +309,7 @@ def getclientlist(p_shardhost, p_serial, p_timespan):
     try:
         r = requests.get('https://%s/api/v0/devices/%s/clients?timespan=%s' % (p_shardhost, p_serial, p_timespan), headers={'X-Cisco-Meraki-API-Key': ARG_APIKEY, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
     except:
-        printusertext('ERROR 02: Unable to contact Meraki cloud')
+        print('ERROR 02: Unable to contact Meraki cloud')
         return(None)
         
     if r.status_code != requests.codes.ok:
@@ -294,7 +318,29 @@ def getclientlist(p_shardhost, p_serial, p_timespan):
     return(r.json())   
     
     
-def getUsageReport(p_netparams, p_minutes):
+def topUsers(p_clientlists):
+    #returns the REPORT_TOP_COUNT clients with the highest total usage in a list of client lists, as tuples of
+    #(total, sent, recv, description, dhcpHostname, mac, ip, vlan)
+    
+    rows = []
+    for cl in p_clientlists:
+        for client in cl:
+            rows.append((client['usage']['sent'] + client['usage']['recv'],
+                client['usage']['sent'],
+                client['usage']['recv'],
+                client['description'],
+                client['dhcpHostname'],
+                client['mac'],
+                client['ip'],
+                client['vlan']))
+                
+    return(heapq.nlargest(REPORT_TOP_COUNT, rows, key=lambda x: x[0]))
+    
+    
+def getUsageReports(p_netparams, p_minuteslist):
+    #runs the usage reports of a network for every time range in p_minuteslist. The client lists of all time
+    #ranges and of both MXs of an HA pair are requested at the same time
+    #returns {minutes: report}
     orgid       = p_netparams[0]
     orgshard    = p_netparams[1]
     netid       = p_netparams[2]
@@ -303,60 +349,83 @@ def getUsageReport(p_netparams, p_minutes):
     
     print('INFO: Running report for net "%s": MX1 "%s", MX2 "%s"' % (netid, mxserial1, mxserial2))
     
-    clientlists = []
-        
-    clist = getclientlist(orgshard, mxserial1, p_minutes*60)
-    if not clist is None:
-        clientlists.append(clist)
-    
-    if not mxserial2 is None:
-        clist = getclientlist(orgshard, mxserial2, p_minutes*60)
-        if not clist is None:
-            clientlists.append(clist)
-                
-    db = sqlite3.connect(':memory:')
+    #network parameters come from the web form, where a missing second MX is the string "None"
+    serials = [mxserial1]
+    if not mxserial2 is None and mxserial2 != 'None':
+        serials.append(mxserial2)
     
-    dbcursor = db.cursor()
+    futures = {}
+    for minutes in p_minuteslist:
+        for serial in serials:
+            futures[(minutes, serial)] = CLIENTLIST_POOL.submit(getclientlist, orgshard, serial, minutes*60)
+            
+    reports = {}
+    for minutes in p_minuteslist:
+        clientlists = []
+        for serial in serials:
+            clist = futures[(minutes, serial)].result()
+            if not clist is None:
+                clientlists.append(clist)
+        reports[minutes] = topUsers(clientlists)
     
-    dbcursor.execute('''CREATE TABLE clients
-             (UsageSent real, UsageRecv real, UsageTotal real, id text, description text, dhcpHostName text, 
-              mac text, ip text, vlan text)''')
-              
-    db.commit()
+    return(reports)
     
-    for cl in clientlists:
-        for client in cl:            
-            dbcursor.execute('''INSERT INTO clients VALUES (?,?,?,?,?,?,?,?,?)''', 
-                (client['usage']['sent'],
-                client['usage']['recv'],
-                client['usage']['sent']  + client['usage']['recv'],
-                client['id'],
-                client['description'],
-                client['dhcpHostname'],
-                client['mac'],
-                client['ip'],
-                client['vlan']))
-            
-    db.commit()
-    
-    dbcursor = db.cursor()
-    dbcursor.execute('''SELECT UsageTotal, 
-                        UsageSent, 
-                        UsageRecv, 
-                        description, 
-                        dhcpHostName, 
-                        mac, 
-                        ip, 
-                        vlan 
-                        FROM clients ORDER BY UsageTotal DESC LIMIT 10''')
-    
-    retvalue = dbcursor.fetchall()
+    
+#SECTION: Report cache and background refresh
+
+def getCachedReport(p_netstr, p_minutes):
+    #returns (timestamp, report) from the cache, or None if the report has not been run yet. Missing and expired
+    #reports are left to reportRefresher(), so this function never contacts Dashboard
+    
+    with REPORT_CACHE_LOCK:
+        RECENT_VIEWS[p_netstr] = datetime.datetime.now()
+        cached = REPORT_CACHE.get((p_netstr, p_minutes), None)
         
-    db.close()
+    if cached is None or (datetime.datetime.now()-cached[0]).total_seconds() >= REPORT_CACHE_TTL_SECONDS:
+        REPORT_REFRESH_EVENT.set()
+        
+    return(cached)
+    
+    
+def refreshReports():
+    #runs missing and expired reports of recently viewed networks. Forgets networks that have not been viewed for
+    #REPORT_KEEPWARM_MINUTES, together with their cached reports
+    
+    now = datetime.datetime.now()
+    with REPORT_CACHE_LOCK:
+        for netstr in list(RECENT_VIEWS.keys()):
+            if (now-RECENT_VIEWS[netstr]).total_seconds() >= REPORT_KEEPWARM_MINUTES * 60:
+                del RECENT_VIEWS[netstr]
+        for key in list(REPORT_CACHE.keys()):
+            if not key[0] in RECENT_VIEWS:
+                del REPORT_CACHE[key]
+        netstrs = list(RECENT_VIEWS.keys())
+        
+    for netstr in netstrs:
+        expired = []
+        for minutes in [TIMERANGE_SHORT_MINUTES, TIMERANGE_MEDIUM_MINUTES, TIMERANGE_LONG_MINUTES]:
+            with REPORT_CACHE_LOCK:
+                cached = REPORT_CACHE.get((netstr, minutes), None)
+            if cached is None or (datetime.datetime.now()-cached[0]).total_seconds() >= REPORT_CACHE_TTL_SECONDS:
+                expired.append(minutes)
+        if len(expired) > 0:
+            reports = getUsageReports(netstr.split('|'), expired)
+            with REPORT_CACHE_LOCK:
+                for minutes in reports:
+                    REPORT_CACHE[(netstr, minutes)] = (datetime.datetime.now(), reports[minutes])
+                    
+                    
+def reportRefresher():
+    #background thread that keeps the reports of recently viewed networks warm
     
-    return(retvalue)
+    while True:
+        REPORT_REFRESH_EVENT.wait(REPORT_REFRESH_INTERVAL)
+        REPORT_REFRESH_EVENT.clear()
+        try:
+            refreshReports()
+        except Exception as e:
+            print('ERROR 08: Background report refresh failed: %s' % e)
     
-
     
 #SECTION: Flask web server definitions and functions  
 
@@ -380,12 +449,19 @@ def index():
             form.netname.choices.append(('%s|%s|%s|%s|%s' % (org.id, org.shard, net.id, net.mxsn1, net.mxsn2), '%s [%s]' % (net.name, org.name) ))
     
     if request.method == 'POST':
-        output          = c_Output()
-        netparams       = form.netname.data.split('|')
-        output.short    = getUsageReport(netparams, TIMERANGE_SHORT_MINUTES)
-        output.mid      = getUsageReport(netparams, TIMERANGE_MEDIUM_MINUTES)
-        output.long     = getUsageReport(netparams, TIMERANGE_LONG_MINUTES)
-        output.timestamp= str(datetime.datetime.now())
+        #reports are served from the cache. missing ones are run in the background and shown on the next page load
+        cached = []
+        for minutes in [TIMERANGE_SHORT_MINUTES, TIMERANGE_MEDIUM_MINUTES, TIMERANGE_LONG_MINUTES]:
+            cached.append(getCachedReport(form.netname.data, minutes))
+            
+        if None in cached:
+            flash('Report is being prepared. Run it again in a few seconds')
+        else:
+            output          = c_Output()
+            output.short    = cached[0][1]
+            output.mid      = cached[1][1]
+            output.long     = cached[2][1]
+            output.timestamp= str(min(cached[0][0], cached[1][0], cached[2][0]))
         
     return render_template('index.html', form=form, tshort=TIMERANGE_SHORT_MINUTES, tmid=TIMERANGE_MEDIUM_MINUTES, tlong=TIMERANGE_LONG_MINUTES, output=output)
     
@@ -445,6 +521,8 @@ def main(argv):
         print('ERROR 03: No MX organizations for the specified API key')
         sys.exit(2) 
         
+    threading.Thread(target=reportRefresher, daemon=True).start()
+        
     if arg_mode.lower() == 'http':
         print('WARNING: Using HTTP mode (No encryption)')
         app.run(host='0.0.0.0', port=SERVER_HTTP_PORT)
@@ -4,7 +4,7 @@
 #  https://github.com/meraki/automation-scripts/blob/master/usagestats_manual.pdf 
 #
 # To run the script, enter:
-#  python usagestats.py -k <key> [-d <database> -c <command> -i <initfile> -g <groups> -f <filter>] [-u <user> -p <pass> -r <recipient> -s <server>]
+#  python usagestats.py -k <key> [-d <database> -c <command> -m <sync mode> -i <initfile> -g <groups> -f <filter>] [-u <user> -p <pass> -r <recipient> -s <server>]
 #
 # Example:
 #  python usagestats.py -k 1234 -i myproject.cfg -c report:last-month
@@ -32,6 +32,13 @@
 #                           dbreconfigure      : Overwrites configuration stored in the database with a new one. Does not
 #                                                touch network or usage data. Be very careful when using this option
 #                         If omitted, the default command is "report:last-week".
+#   -m <sync mode>      : Defines how "sync" and "report" pull data from Dashboard. Valid options:
+#                           full               : For every device, request client usage once for every day missing
+#                                                from the database. This is the default
+#                           incremental        : For every device, request only the time elapsed since its previous
+#                                                sync, plus one request for every midnight in between. Usage of the
+#                                                current day is stored per client and added to the report once the
+#                                                day is over. Recommended when syncing daily or more often
 # Optional arguments to create a database:
 #   -i <initfile>       : Init config file, containing values to arguments (see section "Writing an init config file").
 #                         This file is only used when a new database is created.
@@ -112,10 +119,13 @@
 # #TODO: check why the script is throwing warnings when the same subnet has been configured multiple times (sub+vid+vname)
 
 
-import sys, getopt, requests, json, time, ipaddress, datetime, sqlite3, os.path, smtplib
+import sys, getopt, json, time, ipaddress, datetime, sqlite3, os.path, smtplib, bisect, copy
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+from meraki_request import merakiRequest
+from meraki_request.fanout import fanOut
+
 #SECTION: CLASS DEFINITIONS
 
 
@@ -190,6 +200,16 @@ class c_optiondata:
         self.sendemail  = False
 #end class
 
+#compiled form of a network's groups, used to classify clients. see compilegroups()
+class c_classifierdata:
+    def __init__(self):
+        self.starts     = [] #sorted first addresses of non-overlapping IPv4 ranges, as integers
+        self.ends       = [] #last address of every range
+        self.rangegrp   = [] #index of the group every range belongs to
+        self.rangeprio  = [] #priority of the subnet definition every range comes from. lower wins
+        self.vids       = {} #VLAN ID (integer) to (priority, group index)
+#end class
+
 class c_filterdata():
     def __init__(self):
         self.org        = ''
@@ -201,18 +221,17 @@ class c_filterdata():
 
 
 #SECTION: GLOBAL VARIABLES: MODIFY TO CHANGE SCRIPT BEHAVIOR
-#Used for time.sleep(API_EXEC_DELAY). Delay added to avoid hitting dashboard API max request rate
-API_EXEC_DELAY = 0.21
-#connect and read timeouts for the Requests module
-REQUESTS_CONNECT_TIMEOUT = 30
-REQUESTS_READ_TIMEOUT = 30
 #Date format string for user input
 DATE_USER_FORMAT = '%Y-%m-%d'
+#Max number of organizations, networks or devices whose data is requested at the same time. Requests of all
+#organizations share the rate limit budget of the API key
+SYNC_MAX_CONCURRENT_DEVICES = 5
 #used to track if the database format used by this script has changed since a project database was created
-DB_VERSION = 4
+DB_VERSION = 5
+#databases of this version are migrated to DB_VERSION when opened
+DB_VERSION_MIGRATABLE = 4
 
 #SECTION: GLOBAL VARIABLES: DO NOT MODIFY
-LAST_MERAKI_REQUEST = datetime.datetime.now()   #used by merakirequestthrottler()
 DATE_DB_FORMAT = '%Y-%m-%d'                     #Date format used for storage in database
 
 
@@ -232,7 +251,7 @@ def printhelp():
     printusertext('Read the manual for more information: #TODO INSERT GITHUB LINK')
     printusertext('')
     printusertext('To run the script, enter:')
-    printusertext('python usagestats.py -k <key> [-d <db> -c <cmd> -i <initf> -g <grps> -f <filtr>] [-u <usr> -p <pw> -r <rcp> -s <srv>]')
+    printusertext('python usagestats.py -k <key> [-d <db> -c <cmd> -m <mode> -i <initf> -g <grps> -f <filtr>] [-u <usr> -p <pw> -r <rcp> -s <srv>]')
     printusertext('')
     printusertext('Example:')
     printusertext('python usagestats.py -k 1234 -i myproject.cfg -c report:last-month')
@@ -260,6 +279,13 @@ def printhelp():
     printusertext('                         dbreconfigure      : Overwrites configuration stored in the database with a new one. Doesn\'t')
     printusertext('                                              touch network or usage data. Be very careful when using this option')
     printusertext('                       If omitted, the default command is "report:last-week".')
+    printusertext(' -m <sync mode>      : Defines how "sync" and "report" pull data from Dashboard. Valid options:')
+    printusertext('                         full               : For every device, request client usage once for every day missing')
+    printusertext('                                              from the database. This is the default')
+    printusertext('                         incremental        : For every device, request only the time elapsed since its previous')
+    printusertext('                                              sync, plus one request for every midnight in between. Usage of the')
+    printusertext('                                              current day is stored per client and added to the report once the')
+    printusertext('                                              day is over. Recommended when syncing daily or more often')
     printusertext('Optional arguments to create a database:')
     printusertext(' -i <initfile>       : Init config file, containing values to arguments (see section "Writing an init config file").')
     printusertext('                       This file is only used when a new database is created.')
@@ -304,35 +330,28 @@ def printhelp():
     
     
     
-def merakirequestthrottler(p_requestcount=1):
-    #makes sure there is enough time between API requests to Dashboard not to hit shaper
-    global LAST_MERAKI_REQUEST
+def tagstring(p_tags):
+    #converts a list of tags returned by the API to a string of space separated tags, with a leading and a trailing
+    #space, which is the form filters and group definitions are matched against
+    if p_tags is None or len(p_tags) == 0:
+        return('')
+    if isinstance(p_tags, str):
+        return(p_tags)
+    return(' ' + ' '.join(p_tags) + ' ')
     
-    if (datetime.datetime.now()-LAST_MERAKI_REQUEST).total_seconds() < (API_EXEC_DELAY*p_requestcount):
-        time.sleep(API_EXEC_DELAY*p_requestcount)
-    
-    LAST_MERAKI_REQUEST = datetime.datetime.now()
-    return
-          
     
 def getorglist(p_apikey):
     #returns the organizations' list for a specified admin
-    
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://dashboard.meraki.com/api/v0/organizations', headers={'X-Cisco-Meraki-API-Key': p_apikey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        printusertext('ERROR 01: Unable to contact Meraki cloud')
-        sys.exit(2)
+    #on failure returns a single record with 'null' id
+    #requests are paced by the shared rate limiter, so the functions below can be called from several threads
+    success, errors, headers, response = merakiRequest(p_apikey, 'GET', '/organizations')
     
     returnvalue = []
-    if r.status_code != requests.codes.ok:
+    if not success or response is None:
         returnvalue.append({'id':'null'})
-        return returnvalue
-    
-    rjson = r.json()
+        return(returnvalue)
     
-    return(rjson)
+    return(response)
       
     
 def getshardhost(p_apikey, p_orgid):
@@ -344,71 +363,61 @@ def getnwlist(p_apikey, p_shardhost, p_orgid):
     #returns a list of all networks in an organization
     #on failure returns a single record with 'null' name and id
     
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://%s/api/v0/organizations/%s/networks' % (p_shardhost, p_orgid), headers={'X-Cisco-Meraki-API-Key': p_apikey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        printusertext('ERROR 03: Unable to contact Meraki cloud')
-        sys.exit(2)
+    success, errors, headers, response = merakiRequest(p_apikey, 'GET', '/organizations/%s/networks' % p_orgid)
     
     returnvalue = []
-    if r.status_code != requests.codes.ok:
+    if not success or response is None:
         returnvalue.append({'name': 'null', 'id': 'null'})
         return(returnvalue)
     
-    return(r.json())
+    for net in response:
+        net['tags'] = tagstring(net.get('tags', None))
+    
+    return(response)
     
     
 def getdevicelist(p_apikey, p_shardhost, p_nwid):
     #returns a list of all devices in a network
     
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://%s/api/v0/networks/%s/devices' % (p_shardhost, p_nwid), headers={'X-Cisco-Meraki-API-Key': p_apikey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        printusertext('ERROR 04: Unable to contact Meraki cloud')
-        sys.exit(2)
+    success, errors, headers, response = merakiRequest(p_apikey, 'GET', '/networks/%s/devices' % p_nwid)
         
     returnvalue = []
-    if r.status_code != requests.codes.ok:
+    if not success or response is None:
         returnvalue.append({'serial': 'null', 'model': 'null'})
         return(returnvalue)
     
-    return(r.json())
+    for dev in response:
+        if 'tags' in dev:
+            dev['tags'] = tagstring(dev['tags'])
+    
+    return(response)
     
     
 def getvlanlist(p_apikey, p_shardhost, p_nwid):
     #returns list of all MX VLANs in a network
     
-    merakirequestthrottler()
-    try:
-        r = requests.get('https://%s/api/v0/networks/%s/vlans' % (p_shardhost, p_nwid), headers={'X-Cisco-Meraki-API-Key': p_apikey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        printusertext('ERROR 05: Unable to contact Meraki cloud')
-        sys.exit(2)
+    success, errors, headers, response = merakiRequest(p_apikey, 'GET', '/networks/%s/appliance/vlans' % p_nwid)
         
     returnvalue = []
-    if r.status_code != requests.codes.ok:
+    if not success or response is None or len(response) == 0:
         returnvalue.append({'id': 'null'})
         return(returnvalue)
     
-    return(r.json())
+    return(response)
     
 
 def getclientlist(p_apikey, p_shardhost, p_serial, p_timespan):
-    #get client list for a network device from Dashboard. No artificial delay
-    try:
-        r = requests.get('https://%s/api/v0/devices/%s/clients?timespan=%s' % (p_shardhost, p_serial, p_timespan), headers={'X-Cisco-Meraki-API-Key': p_apikey, 'Content-Type': 'application/json'}, timeout=(REQUESTS_CONNECT_TIMEOUT, REQUESTS_READ_TIMEOUT) )
-    except:
-        printusertext('ERROR 06: Unable to contact Meraki cloud')
-        sys.exit(2)
+    #get client list for a network device from Dashboard. Requests are paced by the shared rate limiter, so this
+    #function can be called from several threads at the same time
+    success, errors, headers, response = merakiRequest(p_apikey, 'GET', '/devices/%s/clients' % p_serial,
+        p_queryItems={'timespan': p_timespan})
         
     returnvalue = []
-    if r.status_code != requests.codes.ok:
+    if not success or response is None:
         returnvalue.append({'id': 'null'})
         return(returnvalue)
     
-    return(r.json())
+    return(response)
     
 
 def loadinitfile(p_filename):
@@ -475,6 +484,66 @@ def loadinitfile(p_filename):
     return(opt)
     
     
+def opendatabase(p_dbfile):
+    #opens a project database. WAL journaling lets reports read while a sync is writing
+    db = sqlite3.connect(p_dbfile)
+    db.execute('''PRAGMA journal_mode=WAL''')
+    db.execute('''PRAGMA synchronous=NORMAL''')
+    return(db)
+    
+    
+def createusagetable(p_cursor):
+    #daily usage of all networks is stored in one table. its primary key doubles as the index used by syncs
+    #to find the newest day of a network and by reports to scan a date range
+    p_cursor.execute('''CREATE TABLE IF NOT EXISTS 
+            usage(netid TEXT, date TEXT, groupid INTEGER, up INTEGER, down INTEGER,
+            PRIMARY KEY(netid, date, groupid)) WITHOUT ROWID''')
+    p_cursor.execute('''CREATE TABLE IF NOT EXISTS 
+            usage_weekly(netid TEXT, week TEXT, groupid INTEGER, up INTEGER, down INTEGER,
+            PRIMARY KEY(week, netid, groupid)) WITHOUT ROWID''')
+    p_cursor.execute('''CREATE TABLE IF NOT EXISTS 
+            usage_monthly(netid TEXT, month TEXT, groupid INTEGER, up INTEGER, down INTEGER,
+            PRIMARY KEY(month, netid, groupid)) WITHOUT ROWID''')
+    
+    
+def updaterollups(p_cursor, p_netid, p_firstdate, p_lastdate):
+    #recomputes the weekly (Mon-Sun) and monthly usage totals of a network for all weeks and months that include
+    #days between dates p_firstdate and p_lastdate. used by reports for "last-week" and "last-month"
+    p_cursor.execute('''INSERT OR REPLACE INTO usage_weekly(netid, week, groupid, up, down) 
+        SELECT netid, date(date, '-6 days', 'weekday 1') AS week, groupid, SUM(up), SUM(down) FROM usage 
+        WHERE netid = ? AND date >= date(?, '-6 days', 'weekday 1') AND date <= date(?, 'weekday 0') 
+        GROUP BY week, groupid''', (p_netid, p_firstdate, p_lastdate))
+    p_cursor.execute('''INSERT OR REPLACE INTO usage_monthly(netid, month, groupid, up, down) 
+        SELECT netid, substr(date, 1, 7) AS month, groupid, SUM(up), SUM(down) FROM usage 
+        WHERE netid = ? AND date >= date(?, 'start of month') AND date <= date(?, 'start of month', '+1 month', '-1 day') 
+        GROUP BY month, groupid''', (p_netid, p_firstdate, p_lastdate))
+    
+    
+def migratedatabase(p_db):
+    #moves usage data from the per-network data_<netid> tables of database version 4 to the usage table and
+    #builds the weekly and monthly rollup tables, if the database does not have them yet
+    cursor = p_db.cursor()
+    cursor.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'data\\_%' ESCAPE '\\' ''')
+    tables = [row[0] for row in cursor.fetchall()]
+    if len(tables) > 0:
+        printusertext('INFO: Migrating %s network tables to database version %s' % (len(tables), DB_VERSION))
+    cursor.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='usage_monthly' ''')
+    flag_buildrollups = cursor.fetchone() is None
+    createusagetable(cursor)
+    for table in tables:
+        cursor.execute('''INSERT OR REPLACE INTO usage(netid, date, groupid, up, down) 
+            SELECT ?, date, CAST(groupid AS INTEGER), CAST(up AS INTEGER), CAST(down AS INTEGER) FROM ''' + table,
+            (table[5:],))
+        cursor.execute('''DROP TABLE ''' + table)
+    if flag_buildrollups or len(tables) > 0:
+        cursor.execute('''SELECT netid, MIN(date), MAX(date) FROM usage GROUP BY netid''')
+        for row in cursor.fetchall():
+            updaterollups(cursor, row[0], row[1], row[2])
+    cursor.execute('''UPDATE config SET dbversion=?''', (DB_VERSION,))
+    p_db.commit()
+    return(len(tables))
+    
+    
 def decodegroups(p_groupstr, p_dbfile):
     #converts a groups' definition string into an object structure
         
@@ -571,7 +640,7 @@ def decodegroups(p_groupstr, p_dbfile):
     #if the function made it through here, it is safe to say that the group string is clean,
     #so it can be chopped up and stored in the database
     try:
-        db = sqlite3.connect(p_dbfile)
+        db = opendatabase(p_dbfile)
         cursor = db.cursor()
         cursor.execute('''CREATE TABLE IF NOT EXISTS 
                 groups(id INTEGER PRIMARY KEY, groupid INTEGER, groupname TEXT, subnets TEXT)''')
@@ -592,6 +661,90 @@ def decodegroups(p_groupstr, p_dbfile):
     return (grp)
         
     
+def compilegroups(p_groups):
+    #compiles the subnet and VLAN ID definitions of a network's groups into a classifier, so that every client
+    #can be classified with one binary search instead of testing it against every subnet of every group.
+    #a client belongs to the first group, in definition order, with a subnet or VLAN ID that matches it
+    
+    classifier = c_classifierdata()
+    intervals  = [] #(first address, last address, priority, group index)
+    
+    priority = 0
+    for gindex in range(0, len(p_groups)):
+        for subnet in p_groups[gindex].subnets:
+            if subnet.subnet != '':
+                try:
+                    net = ipaddress.IPv4Network(subnet.subnet, strict=False)
+                    intervals.append((int(net.network_address), int(net.broadcast_address), priority, gindex))
+                except:
+                    printusertext('WARNING: Invalid subnet "%s" in group "%s"' % (subnet.subnet, p_groups[gindex].name))
+            if subnet.vid != '':
+                try:
+                    vid = int(subnet.vid)
+                    if not vid in classifier.vids:
+                        classifier.vids[vid] = (priority, gindex)
+                except:
+                    printusertext('WARNING: Invalid VLAN ID "%s" in group "%s"' % (subnet.vid, p_groups[gindex].name))
+            priority += 1
+            
+    #split overlapping subnets into non-overlapping ranges. every range is assigned to the highest priority
+    #subnet covering it, and neighbouring ranges of the same subnet are merged
+    boundaries = set()
+    for interval in intervals:
+        boundaries.add(interval[0])
+        boundaries.add(interval[1] + 1)
+    boundaries = sorted(boundaries)
+    
+    for i in range(0, len(boundaries) - 1):
+        start = boundaries[i]
+        end   = boundaries[i+1] - 1
+        best  = None
+        for interval in intervals:
+            if interval[0] <= start and end <= interval[1] and (best is None or interval[2] < best[2]):
+                best = interval
+        if best is None:
+            continue
+        if len(classifier.starts) > 0 and classifier.ends[-1] == start - 1 and classifier.rangeprio[-1] == best[2]:
+            classifier.ends[-1] = end
+        else:
+            classifier.starts.append(start)
+            classifier.ends.append(end)
+            classifier.rangegrp.append(best[3])
+            classifier.rangeprio.append(best[2])
+            
+    return(classifier)
+    
+    
+def classifyclient(p_classifier, p_client):
+    #returns the index of the group a client belongs to, or -1 if it belongs to none
+    
+    match = None
+    
+    ip = p_client.get('ip', None)
+    if not ip is None:
+        try:
+            address = int(ipaddress.IPv4Address(ip))
+            i = bisect.bisect_right(p_classifier.starts, address) - 1
+            if i >= 0 and address <= p_classifier.ends[i]:
+                match = (p_classifier.rangeprio[i], p_classifier.rangegrp[i])
+        except:
+            pass
+            
+    vlan = p_client.get('vlan', None)
+    try:
+        vlan = int(vlan)
+    except:
+        pass
+    if vlan in p_classifier.vids:
+        vmatch = p_classifier.vids[vlan]
+        if match is None or vmatch[0] < match[0]:
+            match = vmatch
+            
+    if match is None:
+        return(-1)
+    return(match[1])
+    
+    
 def buildorgstructure(p_apikey, p_filters):
     #builds master object where all org, net, device and client data will be read
     orgs = []
@@ -613,76 +766,77 @@ def buildorgstructure(p_apikey, p_filters):
             i += 1
         
     #get shard host/FQDN where destination org is stored
-    #this call sometimes fails. implementing a try-verify-wait-repeat loop
-    MAX_SHARD_RESOLVE_TRIES = 10
     for record in orgs:
-        flag_unabletoresolveshard = True
-        for i in range (0, MAX_SHARD_RESOLVE_TRIES):
-            shardhost = getshardhost(p_apikey, record.id)
-            if shardhost == 'null':
-                time.sleep(API_EXEC_DELAY*(i+1))
-            else:
-                flag_unabletoresolveshard = False
-                break
-        if flag_unabletoresolveshard:
-            printusertext('ERROR 15: Unable to read data for org "%s"' % record.name)
-            sys.exit(2)
-        else:
-            record.shardhost = shardhost 
+        record.shardhost = getshardhost(p_apikey, record.id)
     
-    #compile list of networks and devices to be processed
+    #compile list of networks to be processed. network lists of all orgs are requested at the same time
+    jobs = []
     for org in orgs:
-        netcount = 0
-        netbuffer = getnwlist(p_apikey, org.shardhost, org.id)
+        jobs.append({'key': org.id, 'label': 'networks', 'function': getnwlist,
+            'args': (p_apikey, org.shardhost, org.id)})
+    results = fanOut(jobs, SYNC_MAX_CONCURRENT_DEVICES)
+    
+    jobs = []
+    for org in orgs:
+        netbuffer = results[org.id]['networks']
+        if netbuffer is None:
+            netbuffer = [{'name': 'null', 'id': 'null'}]
         if len(netbuffer) > 0:
             if netbuffer[0]['id'] != 'null':
                 for net in netbuffer:
                     if p_filters.netname == '' or p_filters.netname == net['name']:
                         if p_filters.nettag == '' or net['tags'].find(p_filters.nettag) > -1:
                             org.nets.append(c_networkdata())
-                            org.nets[netcount].name = net['name']
-                            org.nets[netcount].id   = net['id']
-                            org.nets[netcount].tags = net['tags']
-                            
-                            devcount = 0
-                            devbuffer = getdevicelist(p_apikey, org.shardhost, net['id'])
-                            if len(devbuffer) > 0:
-                                if devbuffer[0]['serial'] != 'null':
-                                    for dev in devbuffer:
-                                        flag_matchdevtype = False
-                                        for dtype in p_filters.devtype:
-                                            if dev['model'][:len(dtype)] == dtype:
-                                                flag_matchdevtype = True
-                                                break
-                                        if flag_matchdevtype:                    
-                                            #match devtag. tags might not exist
-                                            flag_passdevtagtest = False
-                                            if p_filters.devtag == '': #if no devtag filter, nothing to check
-                                                flag_passdevtagtest = True
-                                            elif 'tags' in dev: #avoid invalid reference crash
-                                                if dev['tags'].find(p_filters.devtag) > -1:
-                                                    flag_passdevtagtest = True
-                                            #(else fail test)
-                                                    
-                                            if flag_passdevtagtest:
-                                                org.nets[netcount].devs.append(c_devicedata())
-                                                if not dev['name'] is None:
-                                                    org.nets[netcount].devs[devcount].name   = dev['name']
-                                                org.nets[netcount].devs[devcount].serial = dev['serial']
-                                                if 'tags' in dev:
-                                                    org.nets[netcount].devs[devcount].tags   = dev['tags']
-                                                devcount += 1
-                                else:
-                                    printusertext('WARNING: Unable to read device data for net "%s"' % net['name'])
-                            else:
-                                printusertext('INFO: Network "%s" contains no devices' % net['name'])
-                                        
-                            netcount += 1  
+                            org.nets[-1].name = net['name']
+                            org.nets[-1].id   = net['id']
+                            org.nets[-1].tags = net['tags']
+                            jobs.append({'key': net['id'], 'label': 'devices', 'function': getdevicelist,
+                                'args': (p_apikey, org.shardhost, net['id'])})
             else:
                 printusertext('WARNING: Unable to read network data for org "%s"' % org.name)
         else:
             printusertext('INFO: Organization "%s" contains no networks' % org.name)
             
+    #compile list of devices to be processed. device lists of all networks are requested at the same time
+    results = fanOut(jobs, SYNC_MAX_CONCURRENT_DEVICES)
+    
+    for org in orgs:
+        for net in org.nets:
+            devbuffer = results[net.id]['devices']
+            if devbuffer is None:
+                devbuffer = [{'serial': 'null', 'model': 'null'}]
+            devcount = 0
+            if len(devbuffer) > 0:
+                if devbuffer[0]['serial'] != 'null':
+                    for dev in devbuffer:
+                        flag_matchdevtype = False
+                        for dtype in p_filters.devtype:
+                            if dev['model'][:len(dtype)] == dtype:
+                                flag_matchdevtype = True
+                                break
+                        if flag_matchdevtype:                    
+                            #match devtag. tags might not exist
+                            flag_passdevtagtest = False
+                            if p_filters.devtag == '': #if no devtag filter, nothing to check
+                                flag_passdevtagtest = True
+                            elif 'tags' in dev: #avoid invalid reference crash
+                                if dev['tags'].find(p_filters.devtag) > -1:
+                                    flag_passdevtagtest = True
+                            #(else fail test)
+                                    
+                            if flag_passdevtagtest:
+                                net.devs.append(c_devicedata())
+                                if not dev.get('name', None) is None:
+                                    net.devs[devcount].name   = dev['name']
+                                net.devs[devcount].serial = dev['serial']
+                                if 'tags' in dev:
+                                    net.devs[devcount].tags   = dev['tags']
+                                devcount += 1
+                else:
+                    printusertext('WARNING: Unable to read device data for net "%s"' % net.name)
+            else:
+                printusertext('INFO: Network "%s" contains no devices' % net.name)
+            
     #remove orgs and nets that contain no devices
     cleanorgs = []
     orgcount = 0
@@ -779,6 +933,29 @@ def decodefilters(p_filterstr):
     return(output)    
     
 
+def getdevicedailyusage(p_apikey, p_shardhost, p_serial, p_classifier, p_groupcount, p_today, p_dcount):
+    #gets the cumulative usage of every group through a device, for p_dcount timespans ending now and starting
+    #at the midnights of the p_dcount-1 days before p_today and at p_today. the usage of a day is the difference
+    #between two consecutive timespans
+    #returns success, download buffers, upload buffers. buffers are indexed [group index][timespan index]
+    dbuffer = [[0.0] * p_dcount for i in range(0, p_groupcount)]
+    ubuffer = [[0.0] * p_dcount for i in range(0, p_groupcount)]
+    
+    for i in range(0, p_dcount):
+        startdate = p_today - datetime.timedelta(days=p_dcount-1-i)
+        timespan  = int((datetime.datetime.now()-startdate).total_seconds())
+        clientlist = getclientlist(p_apikey, p_shardhost, p_serial, str(timespan))
+        if len(clientlist) > 0 and clientlist[0].get('id', None) == 'null':
+            return(False, [], [])
+        for client in clientlist:
+            gindex = classifyclient(p_classifier, client)
+            if gindex > -1:
+                dbuffer[gindex][i] += client['usage']['sent'] #values returned by API are reverse
+                ubuffer[gindex][i] += client['usage']['recv']
+                
+    return(True, dbuffer, ubuffer)
+    
+
 def cmdsyncdatabase(p_apikey, p_orgs, p_dbfile):
     #pulls VLAN usage data from Dashboard to local SQLite database
     
@@ -786,19 +963,26 @@ def cmdsyncdatabase(p_apikey, p_orgs, p_dbfile):
     
     #create network ids to names mapping table if needed
     try:
-        db = sqlite3.connect(p_dbfile)
+        db = opendatabase(p_dbfile)
         cursor = db.cursor()
         cursor.execute('''CREATE TABLE IF NOT EXISTS 
                 networks(id INTEGER PRIMARY KEY, netid TEXT, netname TEXT, netorgid TEXT)''')
         cursor.execute('''CREATE TABLE IF NOT EXISTS 
                 organizations(id INTEGER PRIMARY KEY, orgid TEXT, orgname TEXT)''')
+        createusagetable(cursor)
         db.commit()
     except:
         printusertext('ERROR 17: Unable to connect to database file "%s"' % p_dbfile)
         sys.exit(2)
                 
+    today = datetime.datetime.combine(datetime.datetime.now().date(), datetime.time(0,0,0))
+    max_past_date = today - datetime.timedelta(days=29)
+    
+    #find the days missing from every network and queue one job per device. devices of all organizations and
+    #networks are processed at the same time and share the rate limit budget of the API key
+    jobs = []
+    syncnets = {} #network id: {'net', 'dcount', 'pending', 'failed'}
     for org in p_orgs:
-        printusertext('INFO: Processing organization "%s"' % org.name)
         try:
             cursor.execute('''SELECT orgid FROM organizations WHERE orgid=?''', (org.id,))
             data = cursor.fetchall()
@@ -810,30 +994,23 @@ def cmdsyncdatabase(p_apikey, p_orgs, p_dbfile):
             sys.exit(2)
         
         for net in org.nets:
-            printusertext('INFO: Processing network "%s"...' % net.name)
-            #make sure network name to id mapping and data table exist
+            #make sure network name to id mapping exists
             try:
                 cursor.execute('''SELECT netid FROM networks WHERE netid=?''', (net.id,))
                 data = cursor.fetchall()
                 if len(data) == 0:
-                    cursor.execute('''CREATE TABLE IF NOT EXISTS 
-                        data_''' + net.id + '''(id INTEGER PRIMARY KEY, date TEXT, groupid TEXT, up TEXT, down TEXT)''')
-                    db.commit()
                     cursor.execute('''INSERT INTO 
                         networks(netid, netname, netorgid) VALUES(?,?,?)''', (net.id,net.name,org.id))
                     db.commit()
             except:
                 printusertext('ERROR 19: Unable to connect to database file "%s"' % p_dbfile)
                 sys.exit(2)
-                                   
-            today = datetime.datetime.combine(datetime.datetime.now().date(), datetime.time(0,0,0))
-            max_past_date = today - datetime.timedelta(days=29)
                 
             #find newest data entry
             try:
-                cursor.execute('''SELECT date FROM data_''' + net.id + ''' ORDER BY date DESC''')
+                cursor.execute('''SELECT MAX(date) FROM usage WHERE netid=?''', (net.id,))
                 data = cursor.fetchone()
-                if data is None:    
+                if data is None or data[0] is None:    
                     newestdate = max_past_date
                 else:
                     newestdate = datetime.datetime.strptime(data[0], DATE_DB_FORMAT)
@@ -847,67 +1024,72 @@ def cmdsyncdatabase(p_apikey, p_orgs, p_dbfile):
             
             dcount = (today - newestdate).days #cannot be more than 29 days and contains no time
             
-            for group in net.groups:
-                for i in range(0,dcount):
-                    group.dbuffer.append(0.0)
-                    group.ubuffer.append(0.0)
-                  
             if dcount > 1:
+                for group in net.groups:
+                    group.dbuffer = [0.0] * dcount
+                    group.ubuffer = [0.0] * dcount
+                syncnets[net.id] = {'net': net, 'dcount': dcount, 'pending': len(net.devs), 'failed': False}
+                classifier = compilegroups(net.groups)
                 for dev in net.devs:
-                    #preload first buffers with client usage data to simplify main loop
-                    startdate   = today - datetime.timedelta(days=dcount-1)
-                    merakirequestthrottler()             
-                    dstart  = int((datetime.datetime.now()-startdate).total_seconds())  
-                    clientsafter = getclientlist(p_apikey, org.shardhost, dev.serial, str(dstart))                  
-                    for client in clientsafter:
-                        flag_gotmatch = False
-                        for group in net.groups:
-                            for subnet in group.subnets:
-                                if (subnet.subnet != '' and ipaddress.IPv4Address(client['ip']) in ipaddress.IPv4Network(subnet.subnet)) or (subnet.vid != '' and (client['vlan'] == int(subnet.vid))):
-                                    group.dbuffer[0] += client['usage']['sent'] #values returned by API are reverse
-                                    group.ubuffer[0] += client['usage']['recv']
-                                    flag_gotmatch = True
-                                    break
-                            if flag_gotmatch:
-                                break 
-                    
-                    #main loop: for every day: get client data and add it up. more processing later
-                    for i in range(1, dcount):
-                        startdate   = today - datetime.timedelta(days=dcount-i)
-                        merakirequestthrottler()           
-                        dend  = int((datetime.datetime.now()-startdate).total_seconds()) - 86400
-                        clientsafter = getclientlist(p_apikey, org.shardhost, dev.serial, str(dend))
-                                                          
-                        for client in clientsafter:
-                            flag_gotmatch = False
-                            for group in net.groups:
-                                for subnet in group.subnets:
-                                    if (subnet.subnet != '' and ipaddress.IPv4Address(client['ip']) in ipaddress.IPv4Network(subnet.subnet)) or (subnet.vid != '' and (client['vlan'] == int(subnet.vid))):
-                                        group.dbuffer[i] += client['usage']['sent'] #values returned by API are reverse
-                                        group.ubuffer[i] += client['usage']['recv']
-                                        flag_gotmatch = True
-                                        break
-                                if flag_gotmatch:
-                                    break                   
-                #end "for dev in net.devs"
-                
-                #calculate daily group usage and write to database
-                for i in range (1, dcount):
-                    for group in net.groups:
-                        try:
-                            cursor.execute('''INSERT INTO data_''' + net.id + '''(date, groupid, up, down) 
-                                VALUES(?,?,?,?)''', ((today - datetime.timedelta(days=dcount-i)).date().isoformat(), group.id, str(int(group.dbuffer[i-1]-group.dbuffer[i])), str(int(group.ubuffer[i-1]-group.ubuffer[i]))))
-                        except:
-                            printusertext('ERROR 21: Unable to connect to database file "%s"' % p_dbfile)
-                            sys.exit(2)
-                    try:
-                        db.commit()
-                    except:
-                        printusertext('ERROR 22: Unable to connect to database file "%s"' % p_dbfile)
-                        sys.exit(2)
-            #end "if dcount > 0"
+                    jobs.append({'key': net.id, 'label': dev.serial, 'function': getdevicedailyusage,
+                        'args': (p_apikey, org.shardhost, dev.serial, classifier, len(net.groups), today, dcount)})
+            else:
+                printusertext('INFO: Network "%s" is up to date' % net.name)
         #end "for net in org.nets"
     #end "for org in orgs"
+    
+    #every network is written to the database and committed as soon as all of its devices have been processed,
+    #so that an interrupted sync continues from the networks that were not completed. Database errors are reported
+    #once all requests have returned, since the script cannot exit from inside fanOut()
+    progress = {'done': 0, 'error': None}
+    
+    def onresult(p_job, p_result):
+        if not progress['error'] is None:
+            return
+        record = syncnets[p_job['key']]
+        net    = record['net']
+        record['pending'] -= 1
+        if p_result is None or not p_result[0]:
+            record['failed'] = True
+        else:
+            for gindex in range(0, len(net.groups)):
+                for i in range(0, record['dcount']):
+                    net.groups[gindex].dbuffer[i] += p_result[1][gindex][i]
+                    net.groups[gindex].ubuffer[i] += p_result[2][gindex][i]
+        if record['pending'] > 0:
+            return
+            
+        progress['done'] += 1
+        if record['failed']:
+            printusertext('WARNING: Unable to read client data for network "%s". It will be retried on next sync' % net.name)
+            return
+            
+        #calculate daily group usage and write to database in a single transaction
+        dcount = record['dcount']
+        rows = []
+        for i in range (1, dcount):
+            for group in net.groups:
+                rows.append(((today - datetime.timedelta(days=dcount-i)).date().isoformat(), group.id, int(group.dbuffer[i-1]-group.dbuffer[i]), int(group.ubuffer[i-1]-group.ubuffer[i])))
+        if len(rows) > 0:
+            try:
+                cursor.executemany('''INSERT OR REPLACE INTO usage(netid, date, groupid, up, down) 
+                    VALUES(?,?,?,?,?)''', [(net.id,) + row for row in rows])
+                updaterollups(cursor, net.id, rows[0][0], rows[-1][0])
+            except sqlite3.Error:
+                progress['error'] = 'ERROR 21: Unable to connect to database file "%s"' % p_dbfile
+                return
+            try:
+                db.commit()
+            except sqlite3.Error:
+                progress['error'] = 'ERROR 22: Unable to connect to database file "%s"' % p_dbfile
+                return
+        printusertext('INFO: Synced network "%s" (%s of %s)' % (net.name, progress['done'], len(syncnets)))
+        
+    fanOut(jobs, SYNC_MAX_CONCURRENT_DEVICES, p_onResult=onresult)
+    
+    if not progress['error'] is None:
+        printusertext(progress['error'])
+        sys.exit(2)
                                                      
     try:
         db.close()
@@ -920,12 +1102,225 @@ def cmdsyncdatabase(p_apikey, p_orgs, p_dbfile):
     return (0)    
 
     
+def getmidnights(p_start, p_end):
+    #returns the local midnights after timestamp p_start, up to and including timestamp p_end, as timestamps
+    midnights = []
+    day = datetime.datetime.combine(datetime.datetime.fromtimestamp(p_start).date(), datetime.time(0,0,0))
+    while True:
+        day += datetime.timedelta(days=1)
+        timestamp = day.timestamp()
+        if timestamp > p_end:
+            break
+        midnights.append(timestamp)
+    return(midnights)
+    
+    
+def clientusagebyid(p_clientlist):
+    #returns {client id: client record} for a client list returned by getclientlist()
+    result = {}
+    for client in p_clientlist:
+        if 'usage' in client:
+            clientid = client.get('id', None)
+            if clientid is None:
+                clientid = client.get('mac', None)
+            if not clientid is None:
+                result[clientid] = client
+    return(result)
+    
+    
+def getdevicedeltausage(p_apikey, p_shardhost, p_serial, p_lastsync, p_now):
+    #gets the client usage of a device between timestamps p_lastsync and p_now, split by local calendar day.
+    #the client list API reports usage for a timespan ending now, so one request is made for the whole window
+    #and one for every midnight inside it. the usage of a day is the difference between two consecutive requests
+    #returns success, array of [date string, {client id: [ip, vlan, sent, recv]}]
+    
+    starts = [p_lastsync] + getmidnights(p_lastsync, p_now)
+    lists  = []
+    for start in starts:
+        timespan = int(p_now - start)
+        if timespan < 1:
+            lists.append({})
+            continue
+        clientlist = getclientlist(p_apikey, p_shardhost, p_serial, str(timespan))
+        if len(clientlist) > 0 and clientlist[0].get('id', None) == 'null':
+            return(False, [])
+        lists.append(clientusagebyid(clientlist))
+    
+    pieces = []
+    for i in range(0, len(starts)):
+        date = datetime.datetime.fromtimestamp(starts[i]).date().isoformat()
+        usage = {}
+        for clientid in lists[i]:
+            client = lists[i][clientid]
+            sent = client['usage']['sent']
+            recv = client['usage']['recv']
+            if i+1 < len(lists) and clientid in lists[i+1]:
+                sent -= lists[i+1][clientid]['usage']['sent']
+                recv -= lists[i+1][clientid]['usage']['recv']
+            if sent > 0 or recv > 0:
+                usage[clientid] = [client.get('ip', None), client.get('vlan', None), max(sent, 0), max(recv, 0)]
+        pieces.append([date, usage])
+        
+    return(True, pieces)
+    
+    
+def cmdsyncincremental(p_apikey, p_orgs, p_dbfile):
+    #pulls usage data from Dashboard to local SQLite database, requesting only the time elapsed since the previous
+    #sync of every device. per-client usage counters of days that have not ended yet are kept in the database and
+    #converted to group usage when the day is over. devices are processed with bounded concurrency and every
+    #network is committed as soon as all of its devices are done
+    
+    printusertext('INFO: Starting incremental database sync')
+    
+    try:
+        db = opendatabase(p_dbfile)
+        cursor = db.cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS 
+                networks(id INTEGER PRIMARY KEY, netid TEXT, netname TEXT, netorgid TEXT)''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS 
+                organizations(id INTEGER PRIMARY KEY, orgid TEXT, orgname TEXT)''')
+        createusagetable(cursor)
+        cursor.execute('''CREATE TABLE IF NOT EXISTS 
+                syncstate(serial TEXT PRIMARY KEY, netid TEXT, lastsync REAL)''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS 
+                syncdays(netid TEXT, date TEXT, PRIMARY KEY(netid, date))''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS 
+                clientcounters(netid TEXT, date TEXT, clientid TEXT, ip TEXT, vlan TEXT, sent REAL, recv REAL,
+                PRIMARY KEY(netid, date, clientid))''')
+        db.commit()
+    except:
+        printusertext('ERROR 41: Unable to connect to database file "%s"' % p_dbfile)
+        sys.exit(2)
+        
+    now   = int(time.time())
+    today = datetime.datetime.combine(datetime.datetime.now().date(), datetime.time(0,0,0))
+    #same limit as full sync. the client list API does not return usage older than one month
+    max_past_date = today - datetime.timedelta(days=29)
+    
+    #find where every device's previous sync stopped and queue one job per device. devices of all organizations
+    #and networks are processed at the same time and share the rate limit budget of the API key
+    jobs = []
+    lastsyncs = {}
+    syncnets = {} #network id: {'net', 'pending', 'results'}
+    try:
+        for org in p_orgs:
+            cursor.execute('''SELECT orgid FROM organizations WHERE orgid=?''', (org.id,))
+            if len(cursor.fetchall()) == 0:
+                cursor.execute('''INSERT INTO organizations(orgid, orgname) VALUES(?,?)''', (org.id,org.name))
+            for net in org.nets:
+                cursor.execute('''SELECT netid FROM networks WHERE netid=?''', (net.id,))
+                if len(cursor.fetchall()) == 0:
+                    cursor.execute('''INSERT INTO 
+                        networks(netid, netname, netorgid) VALUES(?,?,?)''', (net.id,net.name,org.id))
+                        
+                #devices without a previous incremental sync start after the newest day stored by any sync
+                cursor.execute('''SELECT MAX(date) FROM usage WHERE netid=?''', (net.id,))
+                data = cursor.fetchone()
+                newestdate = max_past_date
+                if not data[0] is None:
+                    newestdate = max(max_past_date, datetime.datetime.strptime(data[0], DATE_DB_FORMAT))
+                defaultstart = (newestdate + datetime.timedelta(days=1)).timestamp()
+                
+                syncnets[net.id] = {'net': net, 'pending': len(net.devs), 'results': {}}
+                for dev in net.devs:
+                    cursor.execute('''SELECT lastsync FROM syncstate WHERE serial=?''', (dev.serial,))
+                    data = cursor.fetchone()
+                    lastsync = defaultstart
+                    if not data is None:
+                        lastsync = max(data[0], (max_past_date + datetime.timedelta(days=1)).timestamp())
+                    lastsyncs[dev.serial] = lastsync
+                    jobs.append({'key': net.id, 'label': dev.serial, 'function': getdevicedeltausage,
+                        'args': (p_apikey, org.shardhost, dev.serial, lastsync, now)})
+        db.commit()
+    except:
+        printusertext('ERROR 42: Unable to connect to database file "%s"' % p_dbfile)
+        sys.exit(2)
+        
+    #every network is written to the database and committed as soon as all of its devices have been processed,
+    #so that an interrupted sync continues from where the devices of the networks not completed stopped. Database
+    #errors are reported once all requests have returned, since the script cannot exit from inside fanOut()
+    progress = {'done': 0, 'error': None}
+    
+    def onresult(p_job, p_result):
+        if not progress['error'] is None:
+            return
+        record = syncnets[p_job['key']]
+        net    = record['net']
+        record['pending'] -= 1
+        record['results'][p_job['label']] = p_result
+        if record['pending'] > 0:
+            return
+        progress['done'] += 1
+            
+        classifier = compilegroups(net.groups)
+        
+        #days can only be closed when every device of the network has been synced past them
+        closebefore = today.timestamp()
+        
+        try:
+            for dev in net.devs:
+                result = record['results'].get(dev.serial, None)
+                if result is None or not result[0]:
+                    printusertext('WARNING: Unable to read client data for device "%s". It will be retried on next sync' % dev.serial)
+                    closebefore = min(closebefore, lastsyncs[dev.serial])
+                    continue
+                for date, usage in result[1]:
+                    cursor.execute('''INSERT OR IGNORE INTO syncdays(netid, date) VALUES(?,?)''', (net.id, date))
+                    cursor.executemany('''INSERT INTO clientcounters(netid, date, clientid, ip, vlan, sent, recv)
+                        VALUES(?,?,?,?,?,?,?) ON CONFLICT(netid, date, clientid) DO UPDATE SET
+                        ip=excluded.ip, vlan=excluded.vlan, sent=sent+excluded.sent, recv=recv+excluded.recv''',
+                        [(net.id, date, clientid, c[0], c[1], c[2], c[3]) for clientid, c in usage.items()])
+                cursor.execute('''INSERT OR REPLACE INTO syncstate(serial, netid, lastsync) VALUES(?,?,?)''',
+                    (dev.serial, net.id, now))
+                    
+            #convert per-client counters of days that are over into group usage
+            closedate = datetime.datetime.fromtimestamp(closebefore).date().isoformat()
+            cursor.execute('''SELECT date FROM syncdays WHERE netid=? AND date<? ORDER BY date ASC''', (net.id, closedate))
+            for row in cursor.fetchall():
+                date = row[0]
+                for group in net.groups:
+                    group.dbuffer = [0.0]
+                    group.ubuffer = [0.0]
+                cursor.execute('''SELECT ip, vlan, sent, recv FROM clientcounters WHERE netid=? AND date=?''', (net.id, date))
+                for client in cursor.fetchall():
+                    gindex = classifyclient(classifier, {'ip': client[0], 'vlan': client[1]})
+                    if gindex > -1:
+                        net.groups[gindex].dbuffer[0] += client[2] #values returned by API are reverse
+                        net.groups[gindex].ubuffer[0] += client[3]
+                cursor.executemany('''INSERT OR REPLACE INTO usage(netid, date, groupid, up, down) VALUES(?,?,?,?,?)''',
+                    [(net.id, date, group.id, int(group.dbuffer[0]), int(group.ubuffer[0])) for group in net.groups])
+                cursor.execute('''DELETE FROM clientcounters WHERE netid=? AND date=?''', (net.id, date))
+                cursor.execute('''DELETE FROM syncdays WHERE netid=? AND date=?''', (net.id, date))
+                updaterollups(cursor, net.id, date, date)
+            db.commit()
+        except sqlite3.Error:
+            progress['error'] = 'ERROR 43: Unable to connect to database file "%s"' % p_dbfile
+            return
+        printusertext('INFO: Synced network "%s" (%s of %s)' % (net.name, progress['done'], len(syncnets)))
+        
+    fanOut(jobs, SYNC_MAX_CONCURRENT_DEVICES, p_onResult=onresult)
+    
+    if not progress['error'] is None:
+        printusertext(progress['error'])
+        sys.exit(2)
+    
+    try:
+        db.close()
+    except:
+        printusertext('ERROR 44: Unable to connect to database file "%s"' % p_dbfile)
+        sys.exit(2)
+        
+    printusertext('INFO: Database sync complete')
+    
+    return (0)
+    
+    
 def cmddatabasedump(p_opt):
     #dumps contents of database to screen
     
     if os.path.exists(p_opt.dbfile):
         try:
-            db = sqlite3.connect(p_opt.dbfile)
+            db = opendatabase(p_opt.dbfile)
             cursor = db.cursor()
             cursor.execute('''SELECT name FROM sqlite_master WHERE type='table' ''')
             data = cursor.fetchall()
@@ -935,8 +1330,8 @@ def cmddatabasedump(p_opt):
                     print (' ---')
                     print ('TABLE %s' % record[0])
                     execstring = '''SELECT * FROM ''' + record[0]
-                    if record[0][:4] == 'data':
-                        execstring += ''' ORDER BY date DESC'''
+                    if record[0] == 'usage':
+                        execstring += ''' ORDER BY netid, date DESC'''
                     cursor.execute(execstring)
                     recdata = cursor.fetchall()
                     for item in recdata:
@@ -953,6 +1348,42 @@ def cmddatabasedump(p_opt):
     return (0)
     
    
+def rendergrouptable(p_groups, p_usage):
+    #renders the usage table of a network or organization. p_groups are the rows of the groups table and p_usage
+    #is {groupid: (up column total, down column total)}. returns plaintext, html
+    
+    totaldown = 0
+    totalup   = 0
+    for groupid in p_usage:
+        totaldown += p_usage[groupid][0]
+        totalup   += p_usage[groupid][1]
+    
+    reportstr  = 'Group name                     up kB       up %         down kB     down %        total kB    total %\r\n'
+    reporthtml = '<table><tr><td style="min-width:100px">Group name</td><td style="min-width:60px">up kB</td><td style="min-width:60px">up %</td><td style="min-width:60px">down kB</td><td style="min-width:60px">down %</td><td style="min-width:60px">total kB</td><td style="min-width:60px">total %</td></tr>'
+    
+    for group in p_groups:
+        groupdown, groupup = p_usage.get(group[0], (0, 0))
+        if totaldown == 0:
+            percentdown = 0
+        else:
+            percentdown = (groupdown/totaldown)*100
+        if totalup   == 0:
+            percentup   = 0
+        else:
+            percentup   = (groupup/totalup)*100
+        grpcombinedkb = groupdown + groupup
+        netcombinedkb = totaldown + totalup
+        if netcombinedkb == 0:
+            grpcombinedprc = 0
+        else:
+            grpcombinedprc = (grpcombinedkb/netcombinedkb)*100
+        reportstr  += '%-20s %15d %10.2f %15d %10.2f %15d %10.2f\r\n' % (group[1], groupup, percentup, groupdown, percentdown, grpcombinedkb, grpcombinedprc)
+        reporthtml += '<tr><td>%-20s</td><td>%15d</td><td>%10.2f</td><td>%15d</td><td>%10.2f</td><td>%15d</td><td>%10.2f</td></tr>' % (group[1], groupup, percentup, groupdown, percentdown, grpcombinedkb, grpcombinedprc)
+    reporthtml += '</table>'
+    
+    return(reportstr, reporthtml)
+    
+    
 def cmdreport(p_opt):
     #creates reports according to user preferences
     #TODO: add warning for missing data
@@ -1018,97 +1449,100 @@ def cmdreport(p_opt):
         
     if os.path.exists(p_opt.dbfile):
     
-        #connect to database and extract data
+        #connect to database and compute totals per network, group and organization in SQL. whole weeks and
+        #months are read from the rollup tables maintained by sync, other time ranges from the daily usage table
+        if timedef == 'last-week':
+            source = ('usage_weekly',  'u.week = ?',                  (startdate.date().isoformat(),))
+        elif timedef == 'last-month':
+            source = ('usage_monthly', 'u.month = ?',                 (startdate.strftime('%Y-%m'),))
+        else:
+            source = ('usage',         'u.date >= ? AND u.date <= ?', (startdate.date().isoformat(), enddate.date().isoformat()))
         
         try:
-            db = sqlite3.connect(p_opt.dbfile)
+            db = opendatabase(p_opt.dbfile)
             cursor  = db.cursor()
-            cursor.execute('''SELECT netid, netname, netorgid, orgid, orgname FROM 
-                networks, organizations 
-                WHERE netorgid = orgid 
-                ORDER BY orgname, netname ASC''')
-            nets    = cursor.fetchall()
             cursor.execute('''SELECT groupid, groupname, subnets FROM groups ORDER BY groupid ASC''')
             groups  = cursor.fetchall()
+            cursor.execute('''SELECT COUNT(*) FROM networks''')
+            netcount = cursor.fetchone()[0]
+            
+            #the up and down columns are stored reversed, see cmdsyncdatabase(). report them as down and up
+            cursor.execute('''SELECT orgid, u.groupid, SUM(u.up), SUM(u.down) FROM 
+                networks JOIN organizations ON netorgid = orgid 
+                JOIN ''' + source[0] + ''' AS u ON u.netid = networks.netid AND ''' + source[1] + ''' 
+                GROUP BY orgid, u.groupid''', source[2])
+            orgusage = {}
+            for row in cursor.fetchall():
+                if not row[0] in orgusage:
+                    orgusage[row[0]] = {}
+                orgusage[row[0]][row[1]] = (row[2], row[3])
+            
+            cursor.execute('''SELECT networks.netid, netname, orgid, orgname, u.groupid, SUM(u.up), SUM(u.down) FROM 
+                networks JOIN organizations ON netorgid = orgid 
+                LEFT JOIN ''' + source[0] + ''' AS u ON u.netid = networks.netid AND ''' + source[1] + ''' 
+                GROUP BY networks.netid, u.groupid 
+                ORDER BY orgname, netname, networks.netid ASC''', source[2])
         except:
             printusertext('ERROR 30: Unable to connect to database file "%s"' % p_opt.dbfile)
             sys.exit(2)
            
-        if len(nets) > 0 and len(groups) > 0:
+        if netcount > 0 and len(groups) > 0:
         
-            netgroupupdown = []
-            
-            for net in nets:
-                netgroupupdown.append(c_networkdata())
-                lastnet = len(netgroupupdown) - 1
-                netgroupupdown[lastnet].id      = net[0]
-                netgroupupdown[lastnet].name    = net[1]
-                netgroupupdown[lastnet].orgid   = net[3]
-                netgroupupdown[lastnet].orgname = net[4]
-                for group in groups:
-                    netgroupupdown[lastnet].groups.append(c_groupdata())
-                    lastgrp = len(netgroupupdown[lastnet].groups)-1
-                    netgroupupdown[lastnet].groups[lastgrp].id   = group[0]
-                    netgroupupdown[lastnet].groups[lastgrp].name = group[1]
-                    netgroupupdown[lastnet].groups[lastgrp].dbuffer.append(0)
-                    netgroupupdown[lastnet].groups[lastgrp].ubuffer.append(0)    
-
-                    try:
-                        cursor.execute('''SELECT date, groupid, up, down FROM data_''' + net[0] + ''' 
-                            WHERE date >= ? AND date <= ? AND groupid = ? 
-                            ORDER BY date ASC''', (startdate.date().isoformat(), enddate.date().isoformat(), netgroupupdown[lastnet].groups[lastgrp].id))
-                        data = cursor.fetchall()
-                    except:
-                        printusertext('ERROR 31: Unable to connect to database file "%s"' % p_opt.dbfile)
-                        sys.exit(2)
-                        
-                    for line in data:                        
-                        netgroupupdown[lastnet].groups[lastgrp].dbuffer[0] += int(line[2])
-                        netgroupupdown[lastnet].groups[lastgrp].ubuffer[0] += int(line[3])
-                        netgroupupdown[lastnet].totaldown += int(line[2])
-                        netgroupupdown[lastnet].totalup   += int(line[3])  
-                                         
-            #render results    
+            #render results while reading the rows of the query, one network at a time
             
             reportstr  = '' #plaintext version of report
             reporthtml = '<html><head></head><body>' #HTML version of report
             prevorgid  = 'null'
-            for net in netgroupupdown:
-                if net.orgid != prevorgid:
-                    if len(reportstr) == 0:
-                        #TODO: CHANGE TO USE DATE_USER_FORMAT GLOBAL VAR
-                        reportstr  += '\r\nUsage report: %s to %s\r\n' % (startdate.date().isoformat(), enddate.date().isoformat())
-                        reporthtml += '<h1>Usage report: %s to %s</h1>' % (startdate.date().isoformat(), enddate.date().isoformat())
-                        for group in groups:
-                            reportstr  += 'Group "%s": %s\r\n' % (group[1], group[2])
-                            reporthtml += '<p>Group "%s": %s</p>' % (group[1], group[2])
-                    reportstr  += '\r\n###\r\n\r\nOrganization: "%s"\r\n' % net.orgname
-                    reporthtml += '<br><br><h2>Organization: "%s"</h3>' % net.orgname
-                    prevorgid = net.orgid
-                reportstr  += '\r\nNetwork: "%s"\r\n' % net.name
-                reportstr  += 'Group name                     up kB       up %         down kB     down %        total kB    total %\r\n'
-                reporthtml += '<h3>Network: "%s"</h3>' % net.name
-                reporthtml += '<table><tr><td style="min-width:100px">Group name</td><td style="min-width:60px">up kB</td><td style="min-width:60px">up %</td><td style="min-width:60px">down kB</td><td style="min-width:60px">down %</td><td style="min-width:60px">total kB</td><td style="min-width:60px">total %</td></tr>'
-                
-                for group in net.groups:
+            prevorgname= ''
+            net        = None
+            
+            while True:
+                try:
+                    row = cursor.fetchone()
+                except:
+                    printusertext('ERROR 31: Unable to connect to database file "%s"' % p_opt.dbfile)
+                    sys.exit(2)
                     
-                    if net.totaldown == 0:
-                        percentdown = 0
-                    else:
-                        percentdown = (group.dbuffer[0]/net.totaldown)*100
-                    if net.totalup   == 0:
-                        percentup   = 0
-                    else:
-                        percentup   = (group.ubuffer[0]/net.totalup)*100
-                    grpcombinedkb = group.dbuffer[0] + group.ubuffer[0]
-                    netcombinedkb = net.totaldown + net.totalup
-                    if netcombinedkb == 0:
-                        grpcombinedprc = 0
-                    else:
-                        grpcombinedprc = (grpcombinedkb/netcombinedkb)*100
-                    reportstr  += '%-20s %15d %10.2f %15d %10.2f %15d %10.2f\r\n' % (group.name, group.ubuffer[0], percentup, group.dbuffer[0], percentdown, grpcombinedkb, grpcombinedprc)
-                    reporthtml += '<tr><td>%-20s</td><td>%15d</td><td>%10.2f</td><td>%15d</td><td>%10.2f</td><td>%15d</td><td>%10.2f</td></tr>' % (group.name, group.ubuffer[0], percentup, group.dbuffer[0], percentdown, grpcombinedkb, grpcombinedprc)
-                reporthtml += '</table>'
+                if not net is None and (row is None or row[0] != net.id):
+                    #all rows of the previous network have been read
+                    if net.orgid != prevorgid:
+                        if prevorgid != 'null':
+                            text, html = rendergrouptable(groups, orgusage.get(prevorgid, {}))
+                            reportstr  += '\r\nOrganization total: "%s"\r\n' % prevorgname + text
+                            reporthtml += '<h3>Organization total: "%s"</h3>' % prevorgname + html
+                        if len(reportstr) == 0:
+                            #TODO: CHANGE TO USE DATE_USER_FORMAT GLOBAL VAR
+                            reportstr  += '\r\nUsage report: %s to %s\r\n' % (startdate.date().isoformat(), enddate.date().isoformat())
+                            reporthtml += '<h1>Usage report: %s to %s</h1>' % (startdate.date().isoformat(), enddate.date().isoformat())
+                            for group in groups:
+                                reportstr  += 'Group "%s": %s\r\n' % (group[1], group[2])
+                                reporthtml += '<p>Group "%s": %s</p>' % (group[1], group[2])
+                        reportstr  += '\r\n###\r\n\r\nOrganization: "%s"\r\n' % net.orgname
+                        reporthtml += '<br><br><h2>Organization: "%s"</h3>' % net.orgname
+                        prevorgid   = net.orgid
+                        prevorgname = net.orgname
+                    text, html = rendergrouptable(groups, net.groups)
+                    reportstr  += '\r\nNetwork: "%s"\r\n' % net.name + text
+                    reporthtml += '<h3>Network: "%s"</h3>' % net.name + html
+                    net = None
+                    
+                if row is None:
+                    break
+                    
+                if net is None:
+                    net = c_networkdata()
+                    net.id      = row[0]
+                    net.name    = row[1]
+                    net.orgid   = row[2]
+                    net.orgname = row[3]
+                    net.groups  = {}
+                if not row[4] is None:
+                    net.groups[row[4]] = (row[5], row[6])
+                    
+            if prevorgid != 'null':
+                text, html = rendergrouptable(groups, orgusage.get(prevorgid, {}))
+                reportstr  += '\r\nOrganization total: "%s"\r\n' % prevorgname + text
+                reporthtml += '<h3>Organization total: "%s"</h3>' % prevorgname + html
             reporthtml += '</body>'   
                     
             if p_opt.sendemail:
@@ -1177,10 +1611,11 @@ def main(argv):
     arg_pass        = ''
     arg_recipient   = ''
     arg_server      = ''
+    arg_syncmode    = 'full'
         
     #get command line arguments
     try:
-        opts, args = getopt.getopt(argv, 'hk:d:c:i:g:f:u:p:r:s:')
+        opts, args = getopt.getopt(argv, 'hk:d:c:i:g:f:u:p:r:s:m:')
     except getopt.GetoptError:
         printhelp()
         sys.exit(2)
@@ -1209,6 +1644,8 @@ def main(argv):
             arg_recipient = arg
         elif opt == '-s':
             arg_server  = arg
+        elif opt == '-m':
+            arg_syncmode = arg.strip().lower()
                       
     #check if all required parameters have been given
     if arg_apikey == '':
@@ -1230,6 +1667,10 @@ def main(argv):
     if 0 < emailparams < 3:
         printusertext('ERROR 36: -u <user> -p <pass> -r <recipient> must be given to send email')
         sys.exit(2)
+        
+    if arg_syncmode != 'full' and arg_syncmode != 'incremental':
+        printusertext('ERROR 45: Invalid sync mode "%s"' % arg_syncmode)
+        sys.exit(2)
              
     #start collecting user option information
     opt = c_optiondata()
@@ -1238,7 +1679,7 @@ def main(argv):
     opt.dbfile = arg_dbfile
     if os.path.exists(opt.dbfile):
         try:
-            db = sqlite3.connect(opt.dbfile)
+            db = opendatabase(opt.dbfile)
             cursor = db.cursor()
             if arg_cmd.strip().lower() == 'dbreconfigure':
                 cursor.execute('''DROP TABLE IF EXISTS config''')
@@ -1246,12 +1687,13 @@ def main(argv):
                 db.commit()
             else:
                 cursor.execute('''SELECT groups, filter, dbversion FROM config ''')
-                for row in cursor:
-                    if row[2] != DB_VERSION:
-                        printusertext('ERROR 37: Database version not compatible. Please start a new database' % opt.dbfile)
+                for row in cursor.fetchall():
+                    if row[2] != DB_VERSION and row[2] != DB_VERSION_MIGRATABLE:
+                        printusertext('ERROR 37: Database version of file "%s" not compatible. Please start a new database' % opt.dbfile)
                         sys.exit(2)
                     opt.rawgroups = row[0]
                     opt.rawfilter = row[1]
+                migratedatabase(db)
             db.close()
         except:
             printusertext('ERROR 38: File "%s" is not a compatible SQLite database' % opt.dbfile)
@@ -1304,7 +1746,7 @@ def main(argv):
     
     #connect to db and write configuration if needed
     try:
-        db = sqlite3.connect(opt.dbfile)
+        db = opendatabase(opt.dbfile)
         cursor = db.cursor()
         cursor.execute('''CREATE TABLE IF NOT EXISTS 
                 config(id INTEGER PRIMARY KEY, dbversion INTEGER, groups TEXT, filter TEXT)''')
@@ -1346,6 +1788,8 @@ def main(argv):
         orgs = buildorgstructure(arg_apikey, filters)
                                 
         #section start: apply groups to org structure
+        vlanjobs = []
+        vlannets = []
         for org in orgs:
             for net in org.nets:
                 gcount = 0
@@ -1357,8 +1801,8 @@ def main(argv):
                     net.groups[gcount].name = group.name
                     for sub in group.subnets:
                         if (sub.orgname == '' and sub.netname == '' and sub.nettag == '') or (sub.orgname != '' and sub.orgname == org.name) or (sub.netname != '' and sub.netname == net.name) or (sub.nettag  != '' and net.tags.find(sub.nettag) > -1):   
-                            net.groups[gcount].subnets.append(c_subnetdata())
-                            net.groups[gcount].subnets[scount] = sub
+                            #every network gets its own copy, since VLAN subnets are resolved per network
+                            net.groups[gcount].subnets.append(copy.copy(sub))
                             if net.groups[gcount].subnets[scount].subnet == '':
                                 #if subnet is empty, set flag to resolve all network VLANs in one API call later
                                 flag_resolve_vlans = True
@@ -1366,31 +1810,41 @@ def main(argv):
                     gcount += 1
                     
                 if flag_resolve_vlans:
+                    #VLAN lists of all networks are requested at the same time later
+                    vlanjobs.append({'key': net.id, 'label': 'vlans', 'function': getvlanlist,
+                        'args': (arg_apikey, org.shardhost, net.id)})
+                    vlannets.append(net)
                     
-                    netvlans = getvlanlist(arg_apikey, org.shardhost, net.id)
-                                        
-                    flag_vlanresolvefail = False
-                    if netvlans[0]['id'] != 'null':
-                        for group in net.groups:
-                            for sub in group.subnets:
-                                flag_pendingresolve = True
-                                for vlan in netvlans:
-                                    if sub.vname == '' and sub.vid == '':
-                                        flag_pendingresolve = False
-                                        break
-                                    elif (sub.vname != '' and sub.vname == vlan['name']) or (sub.vid != '' and sub.vid == vlan['id']):
-                                        sub.subnet = vlan['subnet']
-                                        flag_pendingresolve = False
-                                        break
-                                if flag_pendingresolve:
-                                    printusertext('WARNING: Unable to resolve VLAN "%s%s" for network "%s"' % (sub.vname, sub.vid, net.name))
-                    else:
-                        printusertext('WARNING: Unable to read MX VLAN mappings for network "%s"' % net.name)
+        vlanresults = fanOut(vlanjobs, SYNC_MAX_CONCURRENT_DEVICES)
+        for net in vlannets:
+            netvlans = vlanresults[net.id]['vlans']
+            if netvlans is None:
+                netvlans = [{'id': 'null'}]
+                                
+            if netvlans[0]['id'] != 'null':
+                for group in net.groups:
+                    for sub in group.subnets:
+                        flag_pendingresolve = True
+                        for vlan in netvlans:
+                            if sub.vname == '' and sub.vid == '':
+                                flag_pendingresolve = False
+                                break
+                            elif (sub.vname != '' and sub.vname == vlan['name']) or (sub.vid != '' and sub.vid == str(vlan['id'])):
+                                sub.subnet = vlan['subnet']
+                                flag_pendingresolve = False
+                                break
+                        if flag_pendingresolve:
+                            printusertext('WARNING: Unable to resolve VLAN "%s%s" for network "%s"' % (sub.vname, sub.vid, net.name))
+            else:
+                printusertext('WARNING: Unable to read MX VLAN mappings for network "%s"' % net.name)
         #section end: apply groups to org structure               
                         
                     
         #execute sync
-        cmdsyncdatabase(arg_apikey, orgs, opt.dbfile)
+        if arg_syncmode == 'incremental':
+            cmdsyncincremental(arg_apikey, orgs, opt.dbfile)
+        else:
+            cmdsyncdatabase(arg_apikey, orgs, opt.dbfile)
         
      
     #if command == report, execute report